@@ -4,90 +4,120 @@ import os
 import sys
 import threading
 
-if os.path.basename(sys.argv[0]) != 'setup.py':
-    import gqylpy_log as glog
-
 from .program_log import logger as program_logger
 from .transaction_log.base import TransactionLogBase as Config
-from .tools import PY2, OmitLongString, try_json_dumps
-
-try:
-    from flask import Flask
-except ImportError:
-    Flask = None
-
-try:
-    from fastapi import FastAPI
-except ImportError:
-    FastAPI = None
-
-try:
-    import requests
-except ImportError:
-    pass
-
-try:
-    import unirest
-except ImportError:
-    pass
-else:
-    from .transaction_log.x_unirest import UnirestTransactionLog
+from .async_writer import AsyncWriter
+from .stats import Stats
+from .metrics import Metrics
+from .tools import PY2, JSONBackend, try_json_dumps
+from .hooks import when_imported, module_available
 
-try:
-    import ctec_consumer
-except ImportError:
-    pass
+# The frameworks are instrumented when the application imports them, see
+# `transaction_log`; importing this package never imports them.
+frameworks = ('flask', 'fastapi', 'requests', 'unirest', 'ctec_consumer')
 
 
 def __init__(
         appname,
-        logdir            =r'C:\BllLogs' if sys.platform == 'win32' else '/app/logs',
-        when              ='D',
-        interval          =1,
-        backup_count      =7,
-        output_to_terminal=None,
+        logdir               =r'C:\BllLogs' if sys.platform == 'win32' else '/app/logs',
+        when                 ='D',
+        interval             =1,
+        backup_count         =7,
+        output_to_terminal   =None,
+        async_mode           =None,
+        async_queue_size     =10000,
+        async_overflow       ='block',
+        json_backend         =None,
+        host_refresh_interval=None,
+        capture_limit        =1 << 20,
+        sample_rate          =1,
+        sample_rates         =None,
+        tail_capture         =None,
+        success_codes        =None,
+        self_timing          =None,
+        metrics              =None,
+        multiprocess         =None,
+        flush_interval       =None,
+        flush_size           =1 << 16,
+        fsync_interval       =None,
+        background_rollover  =None,
+        compress             =None,
+        max_bytes            =None,
+        disk_budget          =None,
+        archive              =None,
 ):
     if Config.appname is not None:
         return
 
+    # Imported here, they are slow to import and only needed from now on.
+    import gqylpy_log as glog
+    from .handlers import LogFileHandler
+
     prefix = re.match(r'[a-zA-Z]\d{9}[_-]', appname)
     if prefix is None:
         raise ValueError('parameter appname "%s" is illegal.' % appname)
 
+    for rate in [sample_rate] + list((sample_rates or {}).values()):
+        if not 0 <= rate <= 1:
+            raise ValueError('sample rate "%s" is illegal, it must be between 0 and 1.' % rate)
+
+    JSONBackend.use(json_backend)
+
+    if async_mode:
+        Config.async_writer = AsyncWriter(async_queue_size, async_overflow)
+
+    if self_timing:
+        Config.stats = Stats()
+
+    if metrics:
+        Config.metrics = Metrics()
+
     appname = appname[0].lower() + appname[1:].replace('-', '_')
     syscode = prefix.group()[:-1].upper()
 
     Config.appname = appname
     Config.syscode = syscode
     Config.output_to_terminal = output_to_terminal
+    Config.envelope_refresh_interval = host_refresh_interval
+    Config.capture_limit = capture_limit
+    Config.sample_rate = sample_rate
+    Config.sample_rates = sample_rates or {}
+    Config.tail_capture_threshold = tail_capture
+    if success_codes is not None:
+        Config.success_codes = tuple(str(x) for x in success_codes)
+    Config.refresh_envelope()
 
     if sys.platform == 'win32' and logdir == r'C:\BllLogs':
         logdir = os.path.join(logdir, appname)
 
-    handlers = [{
-        'name': 'TimedRotatingFileHandler',
-        'level': 'DEBUG',
-        'filename': '%s/debug/%s_code-debug.log' % (logdir, appname),
-        'encoding': 'utf8',
+    handler_options = {
         'when': when,
         'interval': interval,
         'backupCount': backup_count,
-        'options': {'onlyRecordCurrentLevel': True}
-    }]
+        'encoding': 'utf8',
+        'lockdir': os.path.join(logdir, '.workers') if multiprocess else None,
+        'buffer_size': flush_size,
+        'flush_interval': flush_interval,
+        'fsync_interval': fsync_interval,
+        'background_rollover': background_rollover,
+        'compress': compress,
+        'max_bytes': max_bytes,
+        'disk_budget': disk_budget,
+        'budget_dir': logdir
+    }
+
+    def file_handler(level, filename, **options):
+        options = dict(handler_options, **options)
+        handler = LogFileHandler(filename, **options)
+        handler.setLevel(level)
+        return handler
+
+    handlers = [file_handler('DEBUG', '%s/debug/%s_code-debug.log' % (logdir, appname))]
 
     for level in 'info', 'warning', 'error', 'critical':
-        handlers.append({
-            'name': 'TimedRotatingFileHandler',
-            'level': level.upper(),
-            'filename': '%s/%s_code-%s.log' % (logdir, appname, level),
-            'encoding': 'utf8',
-            'when': when,
-            'interval': interval,
-            'backupCount': backup_count,
-            'options': {'onlyRecordCurrentLevel': True}
-        })
-
-    glog.__init__('code', handlers=handlers, gname='code')
+        handlers.append(file_handler(level.upper(), '%s/%s_code-%s.log' % (logdir, appname, level)))
+
+    glog.__init__('code', handlers=handlers, options={'onlyRecordCurrentLevel': True}, gname='code')
 
     if output_to_terminal:
         glog.__init__(
@@ -100,40 +130,28 @@ def __init__(
             gname='stream'
         )
 
-    if unirest is not None:
-        unirest.USER_AGENT = syscode
-        threading.Timer(15, UnirestTransactionLog.reset_unirest_user_agent)
+    when_imported('unirest', set_unirest_user_agent)
 
-    if Flask or FastAPI or requests or unirest or ctec_consumer:
+    if any(module_available(x) for x in frameworks):
         glog.__init__(
             'info',
-            handlers=[{
-                'name': 'TimedRotatingFileHandler',
-                'level': 'INFO',
-                'filename': '%s/%s_info-info.log' % (logdir, appname),
-                'encoding': 'utf8',
-                'when': when,
-                'interval': interval,
-                'backupCount': backup_count,
-            }],
+            handlers=[file_handler('INFO', '%s/%s_info-info.log' % (logdir, appname), archive=archive)],
             gname='info_'
         )
 
     glog.__init__(
         'trace',
-        handlers=[{
-            'name': 'TimedRotatingFileHandler',
-            'level': 'DEBUG',
-            'filename': '%s/trace/%s_trace-trace.log' % (logdir, appname),
-            'encoding': 'utf8',
-            'when': when,
-            'interval': interval,
-            'backupCount': backup_count,
-        }],
+        handlers=[file_handler('DEBUG', '%s/trace/%s_trace-trace.log' % (logdir, appname))],
         gname='trace'
     )
 
 
+def set_unirest_user_agent(unirest):
+    from .transaction_log.x_unirest import UnirestTransactionLog
+    unirest.USER_AGENT = Config.syscode
+    threading.Timer(15, UnirestTransactionLog.reset_unirest_user_agent)
+
+
 def debug(msg, *args, **extra):
     program_logger(msg, *args, **extra)
 
@@ -164,9 +182,26 @@ fatal = critical
 
 
 def trace(**extra):
-    extra = OmitLongString(extra)
     extra.update({'app_name': Config.appname + '_trace', 'level': 'TRACE'})
-    glog.debug(try_json_dumps(extra), gname='trace')
+    Config.write('debug', try_json_dumps(extra, omit_long_string=True), 'trace')
+
+
+def dropped_records():
+    if Config.async_writer is None:
+        return {}
+    return dict(Config.async_writer.dropped)
+
+
+def stats(reset=False):
+    if Config.stats is None:
+        return {}
+    return Config.stats.snapshot(reset=reset)
+
+
+def metrics():
+    if Config.metrics is None:
+        return ''
+    return Config.metrics.render()
 
 
 def set_method_code(method_code):
@@ -0,0 +1,491 @@
+# coding:utf-8
+# Columnar archives of rotated journal logs:
+#
+#     python -m "i simple_channel_log.archive" convert /app/logs --remove-source
+#     python -m "i simple_channel_log.archive" info xxx_info-info.log.2024-01-01.npz
+#     python -m "i simple_channel_log.archive" read xxx_info-info.log.2024-01-01.npz \
+#         --where method_code=I00101 --where 'total_time>=1000' --columns transaction_id,total_time
+#
+# from the root of the source tree; installed, the module is
+# simple_channel_log.archive.
+#
+# A log file "xxx.log.2024-01-01" (or its ".gz"/".zst") is converted into
+# "xxx.log.2024-01-01.npz", a NumPy .npz file readable by `np.load` without
+# pickle. Its records are stored in groups of `group_size` rows, each column
+# of a group as arrays of its own:
+#
+#   - integers, and strings of digits such as http_status_code, as int64;
+#   - strings repeating a lot (dialog_type, method_code, tcode, ...) as int32
+#     codes into a dictionary of the distinct strings;
+#   - other strings (payloads, times, ...) as their UTF-8 bytes concatenated
+#     plus offsets;
+#   - other values as their JSON;
+#
+# with boolean masks for null and missing values where there are some. The
+# converter holds one group in memory at a time, and the members of a .npz
+# are loaded one by one, so that filtering by a few columns never decodes the
+# payload columns: `Archive.records` evaluates its filters on the columns
+# they name, a group at a time, and decodes the columns asked for of the
+# matching rows only. The records read back are the records written, and
+# printed as JSON lines they are the lines of the log file.
+#
+# With parameter `archive` of `__init__`, the journal log backups are
+# converted after every rollover by the background thread of the handlers,
+# and removed. Requires NumPy and Python 3.6+.
+import os
+import re
+import sys
+import json
+import zipfile
+import argparse
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .index import log_files, open_log
+
+version    = 1
+group_size = 1 << 16
+
+digits_pattern = re.compile(r'(0|-?[1-9][0-9]{0,17})\Z')
+
+operators = {
+    '=': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b
+}
+filter_pattern = re.compile(r'^(\w+)(!=|<=|>=|=|<|>|~)(.*)$', re.S)
+
+
+def convert(path, target=None, remove_source=False):
+    # Convert log file `path` into a columnar archive; returns the number of
+    # records converted and the number of lines that were not JSON objects,
+    # which are left out, and keep the source from being removed.
+    if target is None:
+        target = archive_path(path)
+    dirname, name = os.path.split(target)
+    tmp = os.path.join(dirname, '.%s.%d.tmp' % (name, os.getpid()))
+
+    columns = []  # names in order of first appearance
+    groups  = []
+    rows = skipped = 0
+    try:
+        with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+            f = open_log(path)
+            try:
+                records = []
+                for line in f:
+                    try:
+                        record = json.loads(line.decode('utf8'))
+                    except ValueError:
+                        record = None
+                    if not isinstance(record, dict):
+                        if line.strip():
+                            skipped += 1
+                        continue
+                    records.append(record)
+                    if len(records) == group_size:
+                        groups.append(write_group(zf, len(groups), records, columns))
+                        rows += len(records)
+                        records = []
+                if records:
+                    groups.append(write_group(zf, len(groups), records, columns))
+                    rows += len(records)
+            finally:
+                f.close()
+
+            meta = {
+                'version': version,
+                'source': os.path.basename(path),
+                'rows': rows,
+                'columns': columns,
+                'groups': groups
+            }
+            write_array(zf, 'meta', np.frombuffer(json.dumps(meta).encode('utf8'), np.uint8))
+        # The age of a backup decides its eviction by the disk budget.
+        st = os.stat(path)
+        os.utime(tmp, (st.st_atime, st.st_mtime))
+        os.rename(tmp, target)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    if remove_source and not skipped:
+        os.remove(path)
+
+    return rows, skipped
+
+
+def write_group(zf, g, records, columns):
+    names = set(columns)
+    for record in records:
+        for name in record:
+            if name not in names:
+                names.add(name)
+                columns.append(name)
+
+    specs = {}
+    for i, name in enumerate(columns):
+        values  = [r.get(name) for r in records]
+        missing = np.array([name not in r for r in records])
+        if missing.all():
+            continue
+        spec, arrays = encode_column(values)
+        if missing.any():
+            spec['missing'] = True
+            arrays['missing'] = missing
+        for part, array in arrays.items():
+            write_array(zf, member(g, i, part), array)
+        specs[name] = spec
+
+    return {'rows': len(records), 'columns': specs}
+
+
+def encode_column(values):
+    present = [v for v in values if v is not None]
+    null = np.array([v is None for v in values])
+    spec = {}
+
+    if all(isinstance(v, int) and not isinstance(v, bool) and -2 ** 63 <= v < 2 ** 63 for v in present):
+        spec['kind'] = 'int'
+    elif all(is_text(v) and digits_pattern.match(v) for v in present):
+        spec['kind'] = 'digits'
+    elif all(is_text(v) for v in present):
+        spec['kind'] = 'str'
+    else:
+        spec['kind'] = 'json'
+        values = [None if v is None else json.dumps(v, ensure_ascii=False) for v in values]
+
+    arrays = {}
+    if spec['kind'] in ('int', 'digits'):
+        arrays['values'] = np.array([0 if v is None else int(v) for v in values], np.int64)
+        if null.any():
+            arrays['null'] = null
+        return spec, arrays
+
+    distinct = {}
+    for v in values:
+        if v is not None and v not in distinct:
+            distinct[v] = len(distinct)
+            if len(distinct) > len(values) // 2:
+                break
+    if len(distinct) <= len(values) // 2:
+        spec['encoding'] = 'dict'
+        dictionary = sorted(distinct, key=distinct.get)
+        arrays['codes'] = np.array([-1 if v is None else distinct[v] for v in values], np.int32)
+        arrays['dict_offsets'], arrays['dict_data'] = pack(dictionary)
+    else:
+        spec['encoding'] = 'plain'
+        arrays['offsets'], arrays['data'] = pack(['' if v is None else v for v in values])
+        if null.any():
+            arrays['null'] = null
+    return spec, arrays
+
+
+def pack(strings):
+    encoded = [x.encode('utf8') for x in strings]
+    offsets = np.zeros(len(encoded) + 1, np.int64)
+    np.cumsum([len(x) for x in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(encoded), np.uint8)
+
+
+def unpack(offsets, data, index=None):
+    raw = data.tobytes()
+    if index is None:
+        index = range(len(offsets) - 1)
+    return [raw[offsets[i]:offsets[i + 1]].decode('utf8') for i in index]
+
+
+def write_array(zf, name, array):
+    with zf.open(name + '.npy', 'w', force_zip64=True) as f:
+        np.lib.format.write_array(f, np.ascontiguousarray(array), allow_pickle=False)
+
+
+def member(g, i, part):
+    return '%d.%d.%s' % (g, i, part)
+
+
+def is_text(value):
+    return isinstance(value, str)
+
+
+class Archive(object):
+
+    def __init__(self, path):
+        self.path    = path
+        self.npz     = np.load(path, allow_pickle=False)
+        self.meta    = json.loads(self.npz['meta'].tobytes().decode('utf8'))
+        self.columns = self.meta['columns']
+        self.rows    = self.meta['rows']
+        self.index   = dict((name, i) for i, name in enumerate(self.columns))
+
+    def close(self):
+        self.npz.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *a):
+        self.close()
+
+    def spec(self, g, name):
+        return self.meta['groups'][g]['columns'].get(name)
+
+    def part(self, g, name, part):
+        return self.npz[member(g, self.index[name], part)]
+
+    def values(self, g, name, rows=None):
+        # The values of a column in group `g`, of the rows of index array
+        # `rows` or of all; None where null or missing.
+        spec = self.spec(g, name)
+        n = self.meta['groups'][g]['rows']
+        if rows is None:
+            rows = np.arange(n)
+        if spec is None:
+            return [None] * len(rows)
+
+        kind = spec['kind']
+        if kind in ('int', 'digits'):
+            result = self.part(g, name, 'values')[rows].tolist()
+            if kind == 'digits':
+                result = [str(x) for x in result]
+        elif spec['encoding'] == 'dict':
+            dictionary = unpack(self.part(g, name, 'dict_offsets'), self.part(g, name, 'dict_data'))
+            result = [None if c < 0 else dictionary[c] for c in self.part(g, name, 'codes')[rows].tolist()]
+        else:
+            result = unpack(self.part(g, name, 'offsets'), self.part(g, name, 'data'), rows.tolist())
+        if kind == 'json':
+            result = [None if x is None else json.loads(x) for x in result]
+
+        nulls = self.mask(g, name, 'null')
+        if nulls is not None:
+            result = [None if x else v for v, x in zip(result, nulls[rows].tolist())]
+        return result
+
+    def mask(self, g, name, part):
+        spec = self.spec(g, name)
+        if spec is None:
+            return None
+        if part == 'missing' and not spec.get('missing'):
+            return None
+        if part == 'null' and spec.get('encoding') == 'dict':
+            return self.part(g, name, 'codes') < 0
+        try:
+            return self.part(g, name, part)
+        except KeyError:
+            return None
+
+    def missing(self, g, name):
+        if self.spec(g, name) is None:
+            return np.ones(self.meta['groups'][g]['rows'], bool)
+        x = self.mask(g, name, 'missing')
+        return np.zeros(self.meta['groups'][g]['rows'], bool) if x is None else x
+
+    def numbers(self, g, name):
+        # (int64 values, valid mask) of a column, valid where an integer.
+        n = self.meta['groups'][g]['rows']
+        spec = self.spec(g, name)
+        if spec is None:
+            return np.zeros(n, np.int64), np.zeros(n, bool)
+        if spec['kind'] in ('int', 'digits'):
+            valid = ~self.missing(g, name)
+            nulls = self.mask(g, name, 'null')
+            if nulls is not None:
+                valid &= ~nulls
+            return self.part(g, name, 'values'), valid
+        values = self.values(g, name)
+        valid = np.array([
+            isinstance(v, int) and not isinstance(v, bool) or is_text(v) and digits_pattern.match(v) is not None
+            for v in values
+        ], bool)
+        return np.array([int(v) if x else 0 for v, x in zip(values, valid.tolist())], np.int64), valid
+
+    def factorize(self, g, name):
+        # (codes, distinct values) of a string column, code -1 for null.
+        spec = self.spec(g, name)
+        if spec is not None and spec.get('encoding') == 'dict':
+            codes = self.part(g, name, 'codes')
+            return codes, unpack(self.part(g, name, 'dict_offsets'), self.part(g, name, 'dict_data'))
+        values = self.values(g, name)
+        distinct = {}
+        codes = np.array([-1 if v is None else distinct.setdefault(v, len(distinct)) for v in values], np.int64)
+        return codes, sorted(distinct, key=distinct.get)
+
+    def prefix(self, g, name, size):
+        # The first `size` bytes of each value of a string column, as an
+        # array of dtype "S<size>", without decoding the values.
+        spec = self.spec(g, name)
+        if spec is not None and spec.get('encoding') == 'dict':
+            offsets, data = self.part(g, name, 'dict_offsets'), self.part(g, name, 'dict_data')
+            codes = self.part(g, name, 'codes')
+        else:
+            offsets, data = self.part(g, name, 'offsets'), self.part(g, name, 'data')
+            codes = None
+        data = np.concatenate([data, np.zeros(size, np.uint8)])
+        starts = offsets[:-1]
+        taken = data[starts[:, None] + np.arange(size)]
+        taken[np.arange(size) >= (offsets[1:] - starts)[:, None]] = 0
+        result = taken.view('S%d' % size).ravel()
+        return result if codes is None else result[codes]
+
+    def select(self, g, filters):
+        # The index array of the rows of group `g` passing all filters.
+        n = self.meta['groups'][g]['rows']
+        selected = np.ones(n, bool)
+        for name, op, value in filters:
+            selected &= self.evaluate(g, name, op, value)
+            if not selected.any():
+                break
+        return np.nonzero(selected)[0]
+
+    def evaluate(self, g, name, op, value):
+        spec = self.spec(g, name)
+        n = self.meta['groups'][g]['rows']
+        if spec is None:
+            return np.full(n, op == '!=', bool)
+
+        if spec['kind'] in ('int', 'digits') and op != '~':
+            try:
+                number = int(value)
+            except ValueError:
+                return np.full(n, op == '!=', bool)
+            result = operators[op](self.part(g, name, 'values'), number)
+        else:
+            test = (lambda x: value in x) if op == '~' else (lambda x: operators[op](x, value))
+            if spec['kind'] in ('int', 'digits'):
+                codes = None
+                values = [str(x) for x in self.part(g, name, 'values').tolist()]
+            else:
+                codes, values = self.factorize(g, name)
+            passed = np.array([test(x) for x in values] + [False], bool)
+            result = passed[codes] if codes is not None else passed[:-1]
+
+        nulls = self.mask(g, name, 'null')
+        if nulls is not None:
+            result &= ~nulls
+        return result & ~self.missing(g, name)
+
+    def records(self, where=(), columns=None):
+        # Yield the records passing the filters of `where`, (column,
+        # operator, value) tuples, as dicts of the columns asked for.
+        filters = [parse_filter(x) if is_text(x) else x for x in where]
+        names = self.columns if columns is None else [x for x in columns if x in self.index]
+        for g in range(len(self.meta['groups'])):
+            rows = self.select(g, filters)
+            if not len(rows):
+                continue
+            values  = [self.values(g, name, rows) for name in names]
+            missing = [self.missing(g, name)[rows].tolist() for name in names]
+            for i in range(len(rows)):
+                yield dict((name, values[j][i]) for j, name in enumerate(names) if not missing[j][i])
+
+    def lines(self, where=(), columns=None):
+        # The records as the lines of the log file, with the fields in the
+        # order of the log file.
+        for record in self.records(where, columns):
+            yield json.dumps(record, ensure_ascii=False)
+
+
+def parse_filter(text):
+    # "name=value", "name!=value", "name<value" (and <=, >, >=), "name~text".
+    m = filter_pattern.match(text)
+    if m is None:
+        raise ValueError('filter "%s" is illegal.' % text)
+    return m.groups()
+
+
+def archive_path(path):
+    for ext in '.gz', '.zst':
+        if path.endswith(ext):
+            path = path[:-len(ext)]
+    return path + '.npz'
+
+
+def rotated_journal_logs(paths):
+    # The rotated journal logs not archived yet of the files and
+    # directories given.
+    for path in paths:
+        if os.path.isdir(path):
+            for x in log_files(path):
+                name = os.path.basename(x)
+                if '_info-' in name and not name.endswith('.log') and not os.path.exists(archive_path(x)):
+                    yield x
+        else:
+            yield path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='simple_channel_log.archive',
+        description='Convert rotated journal logs into columnar archives and read them.'
+    )
+    commands = parser.add_subparsers(dest='command')
+
+    x = commands.add_parser('convert', help='convert rotated journal logs')
+    x.add_argument('paths', nargs='+', metavar='PATH', help='rotated journal log, or log directory')
+    x.add_argument('--remove-source', action='store_true', help='remove each log file once converted')
+
+    x = commands.add_parser('info', help='describe an archive')
+    x.add_argument('archive')
+
+    x = commands.add_parser('read', help='print the records of an archive as JSON lines')
+    x.add_argument('archive')
+    x.add_argument('-w', '--where', action='append', default=[], metavar='FILTER',
+                   help='name=value, name!=value, name<value, name<=value, name>value, name>=value or '
+                        'name~text (substring); numeric for integer columns; repeatable, all must pass')
+    x.add_argument('-c', '--columns', help='comma separated (default: all)')
+
+    args = parser.parse_args(argv)
+
+    if np is None:
+        parser.error('NumPy is required, install it with "pip install numpy".')
+
+    if args.command == 'convert':
+        status = 0
+        for path in rotated_journal_logs(args.paths):
+            size = os.path.getsize(path)
+            rows, skipped = convert(path, remove_source=args.remove_source)
+            sys.stdout.write('%s: %d records, %d -> %d bytes%s\n' % (
+                path, rows, size, os.path.getsize(archive_path(path)),
+                ', %d lines not JSON left out, source kept' % skipped if skipped else ''
+            ))
+            if skipped:
+                status = 1
+        return status
+
+    if args.command == 'info':
+        with Archive(args.archive) as archive:
+            sys.stdout.write('source %s, %d records, %d groups\n' % (
+                archive.meta['source'], archive.rows, len(archive.meta['groups'])
+            ))
+            for name in archive.columns:
+                specs = [g['columns'][name] for g in archive.meta['groups'] if name in g['columns']]
+                kinds = sorted(set(x['kind'] + ('/' + x['encoding'] if 'encoding' in x else '') for x in specs))
+                sys.stdout.write('  %-24s %s\n' % (name, ', '.join(kinds)))
+        return 0
+
+    if args.command == 'read':
+        try:
+            where = [parse_filter(x) for x in args.where]
+        except ValueError as e:
+            parser.error(str(e))
+        columns = args.columns.split(',') if args.columns else None
+        out = getattr(sys.stdout, 'buffer', sys.stdout)
+        with Archive(args.archive) as archive:
+            for line in archive.lines(where, columns):
+                out.write(line.encode('utf8') + b'\n')
+        out.flush()
+        return 0
+
+    parser.print_help()
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+# coding:utf-8
+import os
+import sys
+import atexit
+import threading
+import traceback
+
+if sys.version_info.major >= 3:
+    import queue
+else:
+    import Queue as queue
+
+from .tools import is_char, try_json_dumps
+
+
+def emit(level, data, gname):
+    import gqylpy_log as glog
+    getattr(glog, level)(data if is_char(data) else try_json_dumps(data), gname=gname)
+
+
+class AsyncWriter(object):
+    overflow_policies = ('block', 'drop_newest', 'drop_oldest')
+
+    def __init__(self, maxsize=10000, overflow='block'):
+        if overflow not in self.overflow_policies:
+            raise ValueError('parameter async_overflow "%s" is illegal.' % overflow)
+
+        self.maxsize  = maxsize
+        self.overflow = overflow
+        self.dropped  = {}
+        self.lock     = threading.Lock()
+        self.pid      = None
+        self.queue    = None
+        self.thread   = None
+
+        atexit.register(self.close)
+
+    def start(self):
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            # After a fork the inherited queue belongs to the parent's writer
+            # thread, which does not exist in the child, so start over.
+            self.queue  = queue.Queue(self.maxsize)
+            self.thread = threading.Thread(target=self.run, name='simple_channel_log.AsyncWriter')
+            self.thread.daemon = True
+            self.thread.start()
+            self.pid = os.getpid()
+
+    def put(self, record):
+        if self.pid != os.getpid():
+            self.start()
+
+        if self.overflow == 'block':
+            self.queue.put(record)
+            return
+
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                if self.overflow == 'drop_newest':
+                    self.count_dropped(record)
+                    return
+            try:
+                oldest = self.queue.get_nowait()
+            except queue.Empty:
+                continue
+            self.count_dropped(oldest)
+
+    def count_dropped(self, record):
+        gname = record[2]
+        with self.lock:
+            self.dropped[gname] = self.dropped.get(gname, 0) + 1
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            try:
+                emit(*record)
+            except Exception:
+                sys.stderr.write(traceback.format_exc() + '\nAn exception occurred while writing the log.\n')
+
+    def close(self):
+        if self.pid != os.getpid() or not self.thread.is_alive():
+            return
+        self.queue.put(None)
+        self.thread.join()
@@ -0,0 +1,266 @@
+# coding:utf-8
+# Benchmarks of the logging hot paths, runnable offline:
+#
+#     python -m "i simple_channel_log.bench"                      # print the results
+#     python -m "i simple_channel_log.bench" --save base.json     # store a baseline
+#     python -m "i simple_channel_log.bench" --compare base.json  # flag slowdowns
+#
+# from the root of the source tree; installed, the module is
+# simple_channel_log.bench.
+#
+# The loggers are routed to os.devnull, so the numbers are the cost of this
+# library (building, fuzzy-matching and serializing records) and not of the
+# disk. Exits with status 1 when the comparison finds a regression.
+#
+# The numbers only compare on the same machine and Python, so no baseline is
+# kept in the repository: save one from the commit to compare against, in a
+# separate worktree, then compare the working tree with it. That commit must
+# have this module, so the commits before the one adding it cannot be
+# measured; to measure the uncommitted changes, it is HEAD:
+#
+#     git worktree add /tmp/base HEAD
+#     (cd /tmp/base && python -m "i simple_channel_log.bench" --save /tmp/base.json)
+#     python -m "i simple_channel_log.bench" --compare /tmp/base.json
+import os
+import gc
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+
+from datetime import datetime, timedelta
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import gqylpy_log as glog
+
+from . import info, trace
+from .tools import JSONBackend, FuzzyGet, OmitLongString, try_json_dumps
+from .transaction_log.base import TransactionLogBase as Config, request_payload_extractor
+
+sizes = ('small', 'medium', 'huge')
+
+
+def make_payload(size):
+    # Deterministic synthetic payloads shaped like the channel API bodies. The
+    # fields the journal log looks for sit at the end of the nesting, so that
+    # the fuzzy matching walks the whole payload.
+    payload = {
+        'transaction_id': '0123456789abcdef0123456789abcdef',
+        'method_code': 'I00101',
+        'province_code': '11',
+        'city_code': '110',
+        'channel': 'bench'
+    }
+    if size == 'small':
+        payload['phone'] = '13800000000'
+        return payload
+
+    count, long_every = (20, 0) if size == 'medium' else (500, 10)
+
+    items = []
+    for i in range(count):
+        item = {
+            'sku_id': 'SKU%06d' % i,
+            'name': u'商品 %d' % i,
+            'price': i * 1.5,
+            'quantity': i % 7,
+            'attrs': {'color': ('red', 'green', 'blue')[i % 3], 'size': i % 5, 'tags': ['a', 'b', 'c']}
+        }
+        if long_every and i % long_every == 0:
+            item['detail'] = u'长文本' * 400
+        items.append(item)
+
+    payload['customer'] = {
+        'name': u'张三',
+        'address': {'province': u'北京', 'city': u'北京', 'street': u'长安街 1 号'},
+        'contacts': [{'type': 'mobile', 'value': '13800000000'}, {'type': 'email', 'value': 'a@b.c'}]
+    }
+    payload['items'] = items
+    payload['order'] = {'extra': {'remark': 'x' * 200}, 'order_id': 'ORD%012d' % count}
+    payload['phone_num'] = '13800000000'
+    return payload
+
+
+def setup():
+    Config.appname = 'a000000000_bench'
+    Config.syscode = 'A000000000'
+    Config.refresh_envelope()
+    devnull = open(os.devnull, 'w')
+    for gname in 'code', 'info_', 'trace':
+        handler = logging.StreamHandler(devnull)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        glog.__init__('simple_channel_log.bench.' + gname, handlers=[handler], gname=gname)
+
+
+def journallog_logger(payload):
+    response_time = datetime.now()
+    Config.logger(
+        transaction_id='0123456789abcdef0123456789abcdef',
+        dialog_type='in',
+        address='http://127.0.0.1:8080/bench',
+        fcode='B000000000',
+        tcode=Config.syscode,
+        method_code='I00101',
+        method_name='bench',
+        http_method='POST',
+        request_time=response_time - timedelta(milliseconds=12),
+        response_time=response_time,
+        request_headers={'Content-Type': 'application/json', 'User-Agent': 'B000000000'},
+        request_payload=payload,
+        response_headers={'Content-Type': 'application/json'},
+        response_payload={'code': '0', 'data': payload},
+        http_status_code=200,
+        request_ip='127.0.0.1'
+    )
+
+
+def benchmarks():
+    cases = []
+    for size in sizes:
+        payload = make_payload(size)
+        cases.extend([
+            ('FuzzyGet[%s]' % size, lambda p=payload: FuzzyGet(p, 'order_id').v),
+            ('FuzzyExtractor[%s]' % size, lambda p=payload: request_payload_extractor(p)),
+            ('OmitLongString[%s]' % size, lambda p=payload: OmitLongString(p)),
+            ('try_json_dumps[%s]' % size, lambda p=payload: try_json_dumps(p)),
+            ('try_json_dumps_omit[%s]' % size, lambda p=payload: try_json_dumps(p, omit_long_string=True)),
+            ('journallog_logger[%s]' % size, lambda p=payload: journallog_logger(p)),
+            ('program_log.logger[%s]' % size, lambda p=payload, s=size: info('bench %s', s, payload=p)),
+            ('trace[%s]' % size, lambda p=payload: trace(payload=p))
+        ])
+    return cases
+
+
+def measure(func, min_time, repeat):
+    func()  # warm up
+
+    number = 1
+    while True:
+        elapsed = timeit(func, number)
+        if elapsed >= min_time:
+            break
+        number = number * 10 if elapsed < min_time / 10 else int(number * min_time / elapsed) + 1
+
+    best = min(timeit(func, number) for _ in range(repeat))
+    result = {'ops': number / best if best else float('inf'), 'alloc_bytes': None}
+
+    if tracemalloc is not None and hasattr(tracemalloc, 'reset_peak'):
+        # The peak memory allocated by one call, a stand-in for allocation
+        # counts that tracemalloc can not report.
+        tracemalloc.start()
+        try:
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            func()
+            result['alloc_bytes'] = tracemalloc.get_traced_memory()[1] - current
+        finally:
+            tracemalloc.stop()
+
+    return result
+
+
+def timeit(func, number):
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter() if hasattr(time, 'perf_counter') else time.time()
+        for _ in range(number):
+            func()
+        end = time.perf_counter() if hasattr(time, 'perf_counter') else time.time()
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return end - start
+
+
+def compare(results, baseline, threshold):
+    # A benchmark regresses when its throughput drops, or the memory it
+    # allocates grows, by more than `threshold` relative to the baseline.
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        slowdown = base['ops'] / result['ops'] - 1
+        result['change'] = result['ops'] / base['ops'] - 1
+        if slowdown > threshold:
+            regressions.append('%s: %.1f%% slower' % (name, slowdown * 100))
+        if base.get('alloc_bytes') and result['alloc_bytes'] is not None:
+            growth = result['alloc_bytes'] / float(base['alloc_bytes']) - 1
+            if growth > threshold:
+                regressions.append('%s: %.1f%% more memory allocated' % (name, growth * 100))
+    return regressions
+
+
+def report(results):
+    sys.stdout.write('%-32s %14s %12s %14s %9s\n' % ('benchmark', 'ops/sec', 'us/op', 'alloc bytes', 'change'))
+    for name, result in results.items():
+        alloc = result['alloc_bytes']
+        change = result.get('change')
+        sys.stdout.write('%-32s %14.1f %12.2f %14s %9s\n' % (
+            name, result['ops'], 1e6 / result['ops'],
+            '-' if alloc is None else alloc,
+            '' if change is None else '%+.1f%%' % (change * 100)
+        ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='simple_channel_log.bench',
+        description='Benchmark the logging hot paths of simple_channel_log.'
+    )
+    parser.add_argument('--save', metavar='FILE', help='store the results as a JSON baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare the results with a JSON baseline')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slowdown reported as a regression (default: 0.1)')
+    parser.add_argument('--filter', metavar='TEXT', help='only run the benchmarks whose name contains TEXT')
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds per measurement (default: 0.2)')
+    parser.add_argument('--repeat', type=int, default=5, help='measurements per benchmark (default: 5)')
+    parser.add_argument('--json-backend', default=None, help='json backend to benchmark with (default: json)')
+    args = parser.parse_args(argv)
+
+    JSONBackend.use(args.json_backend)
+    setup()
+
+    results = {}
+    for name, func in benchmarks():
+        if args.filter and args.filter not in name:
+            continue
+        results[name] = measure(func, args.min_time, args.repeat)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], args.threshold)
+
+    report(results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            for result in results.values():
+                result.pop('change', None)
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'json_backend': JSONBackend.name,
+                'results': results
+            }, f, indent=2, sort_keys=True)
+
+    if regressions:
+        sys.stdout.write('\nRegressions beyond %.1f%%:\n' % (args.threshold * 100))
+        for x in regressions:
+            sys.stdout.write('  ' + x + '\n')
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+# coding:utf-8
+# End-to-end overhead of the automatic Flask and FastAPI instrumentation:
+#
+#     python -m "i simple_channel_log.bench_http"
+#     python -m "i simple_channel_log.bench_http" --frameworks fastapi --sizes small --concurrency 16
+#
+# from the root of the source tree; installed, the module is
+# simple_channel_log.bench_http.
+#
+# Local test apps are driven in-process by a concurrent load generator, once
+# uninstrumented, built and run with the original framework callables the
+# instrumentation wraps, and once instrumented, and the p50/p99 latency and
+# requests/sec of the two runs are compared. Endpoint /echo returns the posted payload,
+# endpoint /call forwards it with `requests` to a local stub server, so the
+# outbound wrapper is measured too. The loggers are routed to os.devnull.
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+import contextlib
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import requests
+
+from .bench import setup, make_payload, sizes
+
+try:
+    import flask
+except ImportError:
+    flask = None
+
+try:
+    import fastapi
+    import httpx
+except ImportError:
+    fastapi = None
+
+local = threading.local()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = b'{"code": "0", "data": ' + self.rfile.read(int(self.headers['Content-Length'])) + b'}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *a):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def call_stub(url, payload):
+    # One keep-alive session per thread, so that the numbers are not
+    # dominated by connection setup.
+    session = getattr(local, 'session', None)
+    if session is None:
+        session = local.session = requests.Session()
+    return session.post(url, json=payload).json()
+
+
+def make_flask_app(stub_url):
+    app = flask.Flask('simple_channel_log.bench_http')
+
+    @app.post('/echo')
+    def echo():
+        return {'code': '0', 'data': flask.request.get_json()}
+
+    @app.post('/call')
+    def call():
+        return call_stub(stub_url, flask.request.get_json())
+
+    return app
+
+
+def make_fastapi_app(stub_url):
+    app = fastapi.FastAPI()
+
+    @app.post('/echo')
+    async def echo(request: fastapi.Request):
+        return {'code': '0', 'data': await request.json()}
+
+    @app.post('/call')
+    def call(payload: dict = fastapi.Body(...)):
+        return call_stub(stub_url, payload)
+
+    return app
+
+
+@contextlib.contextmanager
+def uninstrumented():
+    # Puts back the callables wrapped by the instrumentation, which keeps them
+    # as `__wrapped__`, so that none of its code runs, not even the checks
+    # of the hooks returning at once.
+    targets = [(requests.Session, 'request')]
+    if flask is not None:
+        targets.append((flask.Flask, '__init__'))
+    if fastapi is not None:
+        targets.append((fastapi.FastAPI, '__init__'))
+
+    patched = []
+    for owner, name in targets:
+        current = owner.__dict__[name]
+        original = getattr(current, '__wrapped__', None)
+        if original is not None:
+            patched.append((owner, name, current))
+            setattr(owner, name, original)
+    try:
+        yield
+    finally:
+        for owner, name, current in patched:
+            setattr(owner, name, current)
+
+
+def drive_flask(app, path, body, total, concurrency):
+    def worker(count):
+        client = app.test_client()
+        latencies = []
+        for _ in range(count):
+            start = time.perf_counter()
+            response = client.post(path, data=body, content_type='application/json')
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise RuntimeError('%s responded %d' % (path, response.status_code))
+        return latencies
+
+    return run_threads(worker, total, concurrency)
+
+
+def drive_fastapi(app, path, body, total, concurrency):
+    async def worker(client, count):
+        latencies = []
+        for _ in range(count):
+            start = time.perf_counter()
+            response = await client.post(path, content=body, headers={'Content-Type': 'application/json'})
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise RuntimeError('%s responded %d' % (path, response.status_code))
+        return latencies
+
+    async def main():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            start = time.perf_counter()
+            results = await asyncio.gather(*[worker(client, n) for n in split(total, concurrency)])
+            return [x for r in results for x in r], time.perf_counter() - start
+
+    return asyncio.run(main())
+
+
+def run_threads(worker, total, concurrency):
+    with ThreadPoolExecutor(concurrency) as pool:
+        start = time.perf_counter()
+        results = list(pool.map(worker, split(total, concurrency)))
+        elapsed = time.perf_counter() - start
+    return [x for r in results for x in r], elapsed
+
+
+def split(total, parts):
+    return [total // parts + (i < total % parts) for i in range(parts)]
+
+
+def summarize(latencies, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'rps': len(latencies) / elapsed,
+        'p50': percentile(latencies, 0.5) * 1000,
+        'p99': percentile(latencies, 0.99) * 1000
+    }
+
+
+def percentile(sorted_values, q):
+    return sorted_values[int(round(q * (len(sorted_values) - 1)))]
+
+
+def run(frameworks, paths, sizes_, total, concurrency, warmup):
+    stub = StubServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=stub.serve_forever, name='simple_channel_log.bench_http.stub', daemon=True).start()
+    stub_url = 'http://127.0.0.1:%d/stub' % stub.server_port
+
+    setup()
+
+    results = []
+    try:
+        for framework in frameworks:
+            if framework == 'flask':
+                make_app, drive = make_flask_app, drive_flask
+            else:
+                make_app, drive = make_fastapi_app, drive_fastapi
+            for path in paths:
+                for size in sizes_:
+                    body = json.dumps(make_payload(size), ensure_ascii=False).encode('utf8')
+                    row = {'framework': framework, 'path': path, 'size': size}
+                    for mode in 'off', 'on':
+                        with contextlib.ExitStack() as stack:
+                            if mode == 'off':
+                                stack.enter_context(uninstrumented())
+                            app = make_app(stub_url)
+                            drive(app, path, body, warmup, concurrency)
+                            row[mode] = summarize(*drive(app, path, body, total, concurrency))
+                    results.append(row)
+    finally:
+        stub.shutdown()
+
+    return results
+
+
+def report(results):
+    sys.stdout.write('%-8s %-6s %-7s %-4s %10s %10s %10s\n' % (
+        'app', 'path', 'size', 'log', 'req/sec', 'p50 ms', 'p99 ms'
+    ))
+    for row in results:
+        for mode in 'off', 'on':
+            x = row[mode]
+            sys.stdout.write('%-8s %-6s %-7s %-4s %10.1f %10.3f %10.3f\n' % (
+                row['framework'], row['path'], row['size'], mode, x['rps'], x['p50'], x['p99']
+            ))
+        off, on = row['off'], row['on']
+        sys.stdout.write('%-8s %-6s %-7s %-4s %+9.1f%% %+10.3f %+10.3f\n' % (
+            '', '', '', 'diff', (on['rps'] / off['rps'] - 1) * 100, on['p50'] - off['p50'], on['p99'] - off['p99']
+        ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='simple_channel_log.bench_http',
+        description='Measure the end-to-end overhead of the Flask and FastAPI transaction log.'
+    )
+    parser.add_argument('--frameworks', default='flask,fastapi', help='comma separated (default: flask,fastapi)')
+    parser.add_argument('--paths', default='/echo,/call', help='comma separated (default: /echo,/call)')
+    parser.add_argument('--sizes', default=','.join(sizes), help='comma separated (default: %s)' % ','.join(sizes))
+    parser.add_argument('--requests', type=int, default=2000, help='requests per run (default: 2000)')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients (default: 8)')
+    parser.add_argument('--warmup', type=int, default=100, help='requests before each run (default: 100)')
+    parser.add_argument('--save', metavar='FILE', help='store the results as JSON')
+    args = parser.parse_args(argv)
+
+    frameworks = []
+    for framework in args.frameworks.split(','):
+        if framework == 'flask' and flask is None or framework == 'fastapi' and fastapi is None:
+            sys.stderr.write('%s is not installed, skipped.\n' % framework)
+        elif framework not in ('flask', 'fastapi'):
+            parser.error('unknown framework "%s"' % framework)
+        else:
+            frameworks.append(framework)
+
+    results = run(
+        frameworks, args.paths.split(','), args.sizes.split(','),
+        args.requests, args.concurrency, args.warmup
+    )
+
+    report(results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
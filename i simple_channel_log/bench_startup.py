@@ -0,0 +1,176 @@
+# coding:utf-8
+# Startup cost of the logger, which short-lived scripts and cron jobs pay on
+# every run:
+#
+#     python -m "i simple_channel_log.bench_startup"
+#     python -m "i simple_channel_log.bench_startup" --budget 50 --init-budget 200 --repeat 20
+#
+# from the root of the source tree; installed, the module is
+# simple_channel_log.bench_startup.
+#
+# Every measurement is a fresh interpreter importing the package, then
+# calling `__init__` with a temporary log directory, the two timed apart.
+# One more run with -X importtime tells the modules each step imports and
+# the slowest of them. Exits with status 1 when the median time of either
+# step exceeds its budget, or when the import alone imports one of the
+# `heavy` modules, which are to be imported on first use only: a cold
+# import should cost no more than the modules of the standard library the
+# logging itself needs.
+import re
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+heavy = (
+    'flask', 'fastapi', 'starlette', 'requests', 'urllib3', 'unirest', 'ctec_consumer', 'numpy', 'zstandard',
+    'orjson', 'ujson', 'rapidjson', 'exceptionx', 'gqylpy_log', 'asyncio', 'logging', 'typing', 'ipaddress',
+    'uuid', 'inspect', 'socket'
+)
+
+probe = r'''
+import sys, time
+sys.path[:0] = %(path)r
+sys.stderr.write('-- import\n'); sys.stderr.flush()
+before = set(sys.modules)
+t0 = time.perf_counter()
+package = __import__(%(module)r, fromlist=['__init__'])
+t1 = time.perf_counter()
+sys.stderr.write('-- init\n'); sys.stderr.flush()
+imported = set(sys.modules)
+package.__init__(%(appname)r, logdir=%(logdir)r)
+t2 = time.perf_counter()
+sys.stderr.write('-- end\n'); sys.stderr.flush()
+sys.stdout.write(repr({
+    'import': t1 - t0, 'init': t2 - t1,
+    'import_modules': sorted(imported - before), 'init_modules': sorted(set(sys.modules) - imported)
+}))
+'''
+
+importtime_pattern = re.compile(r'^import time:\s*(\d+) \|\s*(\d+) \| ( *)(\S.*)$')
+
+
+def run(module, importtime=False):
+    logdir = tempfile.mkdtemp(prefix='simple_channel_log.bench_startup.')
+    try:
+        code = probe % {
+            'path': sys.path, 'module': module, 'appname': 'a000000000_bench_startup', 'logdir': logdir
+        }
+        # Without site, whose imports (typing by some .pth files, for one)
+        # would hide the same imports by the package. The path is passed on.
+        command = [sys.executable, '-S'] + (['-X', 'importtime'] if importtime else []) + ['-c', code]
+        p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=logdir)
+        out, err = p.communicate()
+        if p.returncode != 0:
+            raise RuntimeError('the probe failed:\n' + err.decode('utf8', 'replace'))
+        result = eval(out.decode('utf8'))
+        if importtime:
+            result['profile'] = parse_importtime(err.decode('utf8', 'replace'))
+        return result
+    finally:
+        shutil.rmtree(logdir, ignore_errors=True)
+
+
+def parse_importtime(text):
+    # {step: [(self us, cumulative us, depth, module)]}, the steps told apart
+    # by the markers the probe writes to stderr between them.
+    profile = {}
+    step = None
+    for line in text.splitlines():
+        if line.startswith('-- '):
+            step = line[3:]
+            continue
+        m = importtime_pattern.match(line)
+        if m is not None and step in ('import', 'init'):
+            profile.setdefault(step, []).append(
+                (int(m.group(1)), int(m.group(2)), len(m.group(3)) // 2, m.group(4))
+            )
+    return profile
+
+
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    return values[n // 2] if n % 2 else (values[n // 2 - 1] + values[n // 2]) / 2.0
+
+
+def measure(module, repeat):
+    runs = [run(module) for _ in range(repeat)]
+    profile = run(module, importtime=True)
+    result = {}
+    for step in 'import', 'init':
+        times = [x[step] * 1000 for x in runs]
+        entries = profile['profile'].get(step, [])
+        result[step] = {
+            'median_ms': median(times),
+            'min_ms': min(times),
+            'max_ms': max(times),
+            'modules': len(profile[step + '_modules']),
+            'slowest': [
+                {'module': name, 'self_ms': own / 1000.0, 'cumulative_ms': cumulative / 1000.0}
+                for own, cumulative, _, name in sorted(entries, reverse=True)[:10]
+            ]
+        }
+    result['import']['heavy'] = sorted(
+        x for x in profile['import_modules'] if x.split('.')[0] in heavy
+    )
+    return result
+
+
+def report(result, out):
+    out.write('%-8s %10s %10s %10s %8s\n' % ('step', 'median ms', 'min ms', 'max ms', 'modules'))
+    for step in 'import', 'init':
+        x = result[step]
+        out.write('%-8s %10.1f %10.1f %10.1f %8d\n' % (step, x['median_ms'], x['min_ms'], x['max_ms'], x['modules']))
+
+    for step in 'import', 'init':
+        out.write('\nslowest modules of %s (-X importtime, self time)\n' % step)
+        for x in result[step]['slowest']:
+            out.write('  %-48s %8.1f ms %8.1f ms cumulative\n' % (x['module'], x['self_ms'], x['cumulative_ms']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='simple_channel_log.bench_startup',
+        description='Measure the time and the modules of importing and initializing simple_channel_log.'
+    )
+    parser.add_argument('--module', default='simple_channel_log', help='module to import (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=10, help='fresh interpreters to time (default: 10)')
+    parser.add_argument('--budget', type=float, default=50, metavar='MS',
+                        help='median import time allowed (default: 50)')
+    parser.add_argument('--init-budget', type=float, default=200, metavar='MS',
+                        help='median __init__ time allowed (default: 200)')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args(argv)
+
+    result = measure(args.module, args.repeat)
+
+    if args.json:
+        json.dump(result, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        report(result, sys.stdout)
+
+    failures = []
+    if result['import']['median_ms'] > args.budget:
+        failures.append('import takes %.1f ms, over the budget of %.1f ms' % (result['import']['median_ms'], args.budget))
+    if result['init']['median_ms'] > args.init_budget:
+        failures.append('__init__ takes %.1f ms, over the budget of %.1f ms' % (
+            result['init']['median_ms'], args.init_budget
+        ))
+    if result['import']['heavy']:
+        failures.append('import loads modules to be loaded on first use: ' + ', '.join(result['import']['heavy']))
+
+    if failures:
+        sys.stderr.write('\nOver budget:\n')
+        for x in failures:
+            sys.stderr.write('  ' + x + '\n')
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
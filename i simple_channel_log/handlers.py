@@ -0,0 +1,587 @@
+# coding:utf-8
+import io
+import os
+import re
+import sys
+import gzip
+import time
+import shutil
+import weakref
+import threading
+import traceback
+
+if sys.version_info.major >= 3:
+    import queue
+else:
+    import Queue as queue
+
+from logging.handlers import TimedRotatingFileHandler
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+compressed_extensions = {'gzip': '.gz', 'zstd': '.zst'}
+backup_extensions     = tuple(compressed_extensions.values()) + ('.npz',)
+
+
+class LogFileHandler(TimedRotatingFileHandler):
+    # The file handler behind every log file written by `__init__`.
+    #
+    # With `lockdir` set (multi-process mode), each process writes to files of
+    # its own, named after a worker slot, e.g. "xxx_code-info.w3.log". A slot
+    # is the lowest number whose lock file in `lockdir` no live process holds,
+    # so the set of file names stays as small as the worker fleet and is
+    # reused across worker restarts, and each file, including its rollover,
+    # has a single writer. Handlers inherited through fork switch to a slot of
+    # their own on the first record written in the child.
+    #
+    # With `flush_interval` set (buffered mode), records are coalesced in a
+    # file buffer of `buffer_size` bytes, which is written out in one call
+    # when full, and by a background thread every `flush_interval` seconds,
+    # on rollover and on shutdown. The background thread also fsyncs the file
+    # every `fsync_interval` seconds if set.
+    #
+    # With `background_rollover` set, the rollover is done by the background
+    # thread instead of by the first record after the rollover time: the file
+    # is renamed and the next one opened beforehand, the handler lock is only
+    # held to swap the streams, and old backups are pruned afterwards.
+    #
+    # With `compress` set to "gzip" or "zstd" ("auto" is zstd if the
+    # zstandard package is installed, gzip otherwise), the backups are
+    # compressed by a low-priority background thread after every rollover,
+    # and the pruning by `backupCount` counts a compressed backup as the
+    # backup it was made from.
+    #
+    # With `max_bytes` set, the file is also rolled over once it has grown to
+    # `max_bytes` (checked before each record, or by the background thread
+    # with `background_rollover` set). The backups of one interval are then
+    # numbered, e.g. "xxx.log.2024-01-01", "xxx.log.2024-01-01.1", ..., and
+    # `backupCount` counts intervals, not files. With `disk_budget` set, the
+    # oldest backups of any log file under `budget_dir` are removed after
+    # each rollover until all the files there take at most `disk_budget`
+    # bytes; the compression and this eviction share a low-priority thread.
+    #
+    # With `archive` set, that thread also converts the backups into the
+    # columnar archives of simple_channel_log.archive, before compressing
+    # what is left, and removes them; requires NumPy.
+
+    def __init__(
+            self, filename, when='h', interval=1, backupCount=0, encoding=None, lockdir=None,
+            buffer_size=1 << 16, flush_interval=None, fsync_interval=None, background_rollover=False,
+            compress=None, max_bytes=None, disk_budget=None, budget_dir=None, archive=False
+    ):
+        self.filename       = filename
+        self.lockdir        = lockdir
+        self.pid            = os.getpid()
+        self.buffer_size    = buffer_size
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.next_flush     = flush_interval and time.time() + flush_interval
+        self.next_fsync     = fsync_interval and time.time() + fsync_interval
+        self.background_rollover = background_rollover
+        self.compress = compression_method(compress)
+        self.max_bytes   = max_bytes
+        self.disk_budget = disk_budget
+        self.budget_dir  = budget_dir or os.path.dirname(os.path.abspath(filename))
+        self.archive     = archive
+
+        if archive:
+            import numpy
+
+        if lockdir is not None:
+            filename = worker_filename(filename, lockdir)
+
+        makedirs(os.path.dirname(os.path.abspath(filename)))
+
+        TimedRotatingFileHandler.__init__(self, filename, when, interval, backupCount, encoding, delay=True)
+
+        if flush_interval is not None or background_rollover:
+            register_maintained_handler(self)
+
+        # Including the backups left over by an earlier run.
+        self.clean_up_later()
+
+    def _open(self):
+        if self.flush_interval is None:
+            return TimedRotatingFileHandler._open(self)
+        return io.open(
+            self.baseFilename, self.mode, buffering=self.buffer_size,
+            encoding=self.encoding, errors=getattr(self, 'errors', None)
+        )
+
+    def flush(self):
+        # Called after every record; in buffered mode the flushing is left to
+        # the full buffer and the background thread.
+        if self.flush_interval is None:
+            TimedRotatingFileHandler.flush(self)
+
+    def doRollover(self):
+        # As in TimedRotatingFileHandler, for the end of the interval as well
+        # as for a full file, and without overwriting an existing backup.
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+        current_time = int(time.time())
+
+        if os.path.exists(self.baseFilename):
+            os.rename(self.baseFilename, self.backup_filename(current_time))
+
+        if current_time >= self.rolloverAt:
+            self.rolloverAt = self.next_rollover_at(current_time)
+
+        if self.backupCount > 0:
+            for x in self.getFilesToDelete():
+                remove(x)
+
+        self.clean_up_later()
+
+    def backup_filename(self, current_time):
+        # The first backup of an interval is named after it, the ones after a
+        # size rollover in the same interval are numbered on from 1.
+        stem = self.baseFilename + '.' + time.strftime(self.suffix, self.rollover_time_tuple(current_time))
+        name = os.path.basename(stem)
+        indexes = [index for key, index, _ in self.backups() if key == name]
+        if not indexes:
+            return stem
+        return '%s.%d' % (stem, max(indexes) + 1)
+
+    def getFilesToDelete(self):
+        # As in TimedRotatingFileHandler, with all the backups of an interval,
+        # numbered or compressed, counted as one.
+        intervals = {}
+        for key, _, path in self.backups():
+            intervals.setdefault(key, []).append(path)
+        keys = sorted(intervals)
+        return [path for key in keys[:max(len(keys) - self.backupCount, 0)] for path in intervals[key]]
+
+    def backups(self):
+        # (name of the interval's first backup, index, path) of every backup,
+        # the index being 0 for the first backup of an interval.
+        dirname, basename = os.path.split(self.baseFilename)
+        prefix = basename + '.'
+        result = []
+        for name in os.listdir(dirname):
+            if not name.startswith(prefix):
+                continue
+            key, index = split_index(strip_backup_extension(name))
+            if self.extMatch.match(key[len(prefix):]):
+                result.append((key, index, os.path.join(dirname, name)))
+        return result
+
+    def compress_backups(self):
+        ext = compressed_extensions[self.compress]
+        for _, _, path in self.backups():
+            if strip_backup_extension(path) != path:
+                continue
+            if os.path.exists(path + ext):
+                continue
+            compress_file(path, self.compress)
+
+    def archive_backups(self):
+        from .archive import convert, archive_path
+        for _, _, path in self.backups():
+            if path.endswith('.npz') or os.path.exists(archive_path(path)):
+                continue
+            try:
+                convert(path, remove_source=True)
+            except (IOError, OSError):
+                # Most likely removed by the pruning, or by another process meanwhile.
+                if os.path.exists(path):
+                    raise
+
+    def clean_up_later(self):
+        if self.compress is not None or self.disk_budget is not None or self.archive:
+            clean_up_later(self)
+
+    def clean_up(self):
+        # Run by the low-priority background thread.
+        if self.archive:
+            self.archive_backups()
+        if self.compress is not None:
+            self.compress_backups()
+        if self.disk_budget is not None:
+            enforce_disk_budget(self.budget_dir, self.disk_budget)
+
+    def shouldRollover(self, record):
+        if self.background_rollover:
+            return False
+        if self.max_bytes and self.stream is not None and self.position() >= self.max_bytes:
+            return True
+        return TimedRotatingFileHandler.shouldRollover(self, record)
+
+    def position(self):
+        # The size of the file including what is still buffered, short of the
+        # last few kilobytes of text not yet encoded in buffered mode. Taken
+        # from the binary buffer, whose `tell` costs no system call, unlike
+        # the one of the text stream, which flushes.
+        return getattr(self.stream, 'buffer', self.stream).tell()
+
+    def oversized(self):
+        if not self.max_bytes:
+            return False
+        self.acquire()
+        try:
+            return self.stream is not None and self.position() >= self.max_bytes
+        finally:
+            self.release()
+
+    def maintain(self, now):
+        # Run by the background thread.
+        if self.background_rollover and self.pid == os.getpid() and (now >= self.rolloverAt or self.oversized()):
+            # A handler inherited through fork is left alone until it is
+            # reopened by the first record written in this process.
+            self.rollover_in_background()
+
+        if self.flush_interval is not None and now >= self.next_flush:
+            self.next_flush = now + self.flush_interval
+            self.flush_buffer()
+
+        if self.next_fsync and now >= self.next_fsync:
+            self.next_fsync = now + self.fsync_interval
+            self.acquire()
+            try:
+                fileno = self.stream and self.stream.fileno()
+            finally:
+                self.release()
+            # Outside of the handler lock, so that the disk is never waited
+            # for while logging.
+            if fileno:
+                try:
+                    os.fsync(fileno)
+                except OSError:
+                    pass
+
+    def rollover_in_background(self):
+        current_time = int(time.time())
+
+        if os.path.exists(self.baseFilename):
+            os.rename(self.baseFilename, self.backup_filename(current_time))
+
+        # Records written meanwhile go to the renamed file through the still
+        # open stream, which is swapped for the next one in an instant. A file
+        # not written to in this interval is left to be opened on demand.
+        stream = None if self.stream is None else self._open()
+
+        self.acquire()
+        try:
+            stream, self.stream = self.stream, stream
+            if current_time >= self.rolloverAt:
+                self.rolloverAt = self.next_rollover_at(current_time)
+        finally:
+            self.release()
+
+        if stream is not None:
+            stream.close()
+
+        if self.backupCount > 0:
+            for x in self.getFilesToDelete():
+                remove(x)
+
+        self.clean_up_later()
+
+    def rollover_time_tuple(self, current_time):
+        # The start of the interval that ends, or of the current one on a
+        # size rollover, as in TimedRotatingFileHandler.doRollover.
+        t = self.rolloverAt - self.interval
+        if self.utc:
+            return time.gmtime(t)
+        time_tuple = time.localtime(t)
+        dst_now = time.localtime(current_time)[-1]
+        if dst_now != time_tuple[-1]:
+            time_tuple = time.localtime(t + (3600 if dst_now else -3600))
+        return time_tuple
+
+    def next_rollover_at(self, current_time):
+        # As in TimedRotatingFileHandler.doRollover.
+        rollover_at = self.computeRollover(current_time)
+        while rollover_at <= current_time:
+            rollover_at += self.interval
+        if (self.when == 'MIDNIGHT' or self.when.startswith('W')) and not self.utc:
+            dst_now = time.localtime(current_time)[-1]
+            if dst_now != time.localtime(rollover_at)[-1]:
+                rollover_at += 3600 if dst_now else -3600
+        return rollover_at
+
+    def flush_buffer(self):
+        self.acquire()
+        try:
+            if self.stream is not None:
+                self.stream.flush()
+        finally:
+            self.release()
+
+    def emit(self, record):
+        if self.pid != os.getpid():
+            self.reopen()
+        TimedRotatingFileHandler.emit(self, record)
+
+    def reopen(self):
+        self.pid = os.getpid()
+        if self.lockdir is None:
+            return
+
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+        self.baseFilename = os.path.abspath(worker_filename(self.filename, self.lockdir))
+        makedirs(os.path.dirname(self.baseFilename))
+
+        if os.path.exists(self.baseFilename):
+            t = int(os.stat(self.baseFilename).st_mtime)
+        else:
+            t = int(time.time())
+        self.rolloverAt = self.computeRollover(t)
+
+
+maintained_handlers = weakref.WeakSet()
+maintainer_lock     = threading.Lock()
+maintainer_pid      = None
+
+
+def register_maintained_handler(handler):
+    global maintainer_pid
+
+    with maintainer_lock:
+        maintained_handlers.add(handler)
+        if maintainer_pid != os.getpid():
+            maintainer_pid = os.getpid()
+            maintainer = threading.Thread(target=maintain_periodically, name='simple_channel_log.maintainer')
+            maintainer.daemon = True
+            maintainer.start()
+
+
+def maintain_periodically():
+    while True:
+        handlers = list(maintained_handlers)
+        time.sleep(min([1] + [h.flush_interval for h in handlers if h.flush_interval is not None]))
+        now = time.time()
+        for handler in handlers:
+            try:
+                handler.maintain(now)
+            except Exception:
+                sys.stderr.write(traceback.format_exc() + '\nAn exception occurred while maintaining the log file.\n')
+
+
+def flush_buffered_handlers():
+    for handler in list(maintained_handlers):
+        if handler.flush_interval is not None:
+            try:
+                handler.flush_buffer()
+            except Exception:
+                pass
+
+
+def restart_maintainer():
+    # The background thread does not survive fork.
+    global maintainer_lock, maintainer_pid
+    maintainer_lock = threading.Lock()
+    maintainer_pid  = None
+    for handler in list(maintained_handlers):
+        register_maintained_handler(handler)
+
+
+if hasattr(os, 'register_at_fork'):
+    # Empty the buffers before fork, or the child would write out a copy of
+    # the records the parent has not flushed yet.
+    os.register_at_fork(before=flush_buffered_handlers, after_in_child=restart_maintainer)
+
+
+def compression_method(compress):
+    if compress is None:
+        return None
+    if compress == 'auto':
+        try:
+            import zstandard
+        except ImportError:
+            return 'gzip'
+        return 'zstd'
+    if compress == 'zstd':
+        import zstandard
+    elif compress != 'gzip':
+        raise ValueError('parameter compress "%s" is illegal.' % compress)
+    return compress
+
+
+def compress_file(path, method):
+    dirname, name = os.path.split(path)
+    ext = compressed_extensions[method]
+    # Hidden, so that a partly written file is never taken for a backup.
+    tmp = os.path.join(dirname, '.%s%s.%d.tmp' % (name, ext, os.getpid()))
+    try:
+        with open(path, 'rb') as src:
+            with open(tmp, 'wb') as dst:
+                if method == 'gzip':
+                    with gzip.GzipFile(name, 'wb', 6, dst) as z:
+                        shutil.copyfileobj(src, z, 1 << 20)
+                else:
+                    import zstandard
+                    zstandard.ZstdCompressor().copy_stream(src, dst)
+        # The age of a backup decides its eviction by the disk budget.
+        st = os.stat(path)
+        os.utime(tmp, (st.st_atime, st.st_mtime))
+        os.rename(tmp, path + ext)
+        os.remove(path)
+    except (IOError, OSError):
+        # Most likely removed by the pruning, or by another process meanwhile.
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        if os.path.exists(path):
+            raise
+
+
+def strip_backup_extension(name):
+    for ext in backup_extensions:
+        if name.endswith(ext):
+            return name[:-len(ext)]
+    return name
+
+
+def split_index(name):
+    # "xxx.log.2024-01-01.2" -> ("xxx.log.2024-01-01", 2); the time suffixes
+    # never end with a dot and digits.
+    m = re.match(r'(.*)\.(\d+)$', name)
+    if m is None:
+        return name, 0
+    return m.group(1), int(m.group(2))
+
+
+def enforce_disk_budget(root, budget):
+    # Remove the oldest backups of any log file under `root` until all the
+    # files there take at most `budget` bytes. The log files being written
+    # are never removed, so they alone may exceed the budget, and neither are
+    # the files in hidden directories, such as the transaction ID index.
+    total   = 0
+    backups = []
+    for dirpath, _, filenames in os.walk(root):
+        rel = os.path.relpath(dirpath, root)
+        hidden = rel != os.curdir and any(x.startswith('.') for x in rel.split(os.sep))
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            total += st.st_size
+            if not hidden and not name.startswith('.') and '.log.' in name:
+                backups.append((st.st_mtime, split_index(strip_backup_extension(name)), path, st.st_size))
+
+    backups.sort()
+    for _, _, path, size in backups:
+        if total <= budget:
+            break
+        remove(path)
+        total -= size
+
+
+def remove(path):
+    # Another process of the same application may have been first.
+    try:
+        os.remove(path)
+    except OSError:
+        if os.path.exists(path):
+            raise
+
+
+cleanup_queue = None
+cleaner_lock  = threading.Lock()
+cleaner_pid   = None
+
+
+def clean_up_later(handler):
+    global cleanup_queue, cleaner_pid
+
+    with cleaner_lock:
+        if cleaner_pid != os.getpid():
+            cleaner_pid   = os.getpid()
+            cleanup_queue = queue.Queue()
+            cleaner = threading.Thread(target=clean_up_forever, name='simple_channel_log.cleaner')
+            cleaner.daemon = True
+            cleaner.start()
+
+    cleanup_queue.put(handler)
+
+
+def clean_up_forever():
+    if sys.platform.startswith('linux') and hasattr(threading, 'get_native_id'):
+        # On Linux the priority applies to this thread only.
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except OSError:
+            pass
+
+    while True:
+        handler = cleanup_queue.get()
+        try:
+            handler.clean_up()
+        except Exception:
+            sys.stderr.write(traceback.format_exc() + '\nAn exception occurred while cleaning up the log files.\n')
+
+
+def restart_cleaner():
+    global cleaner_lock, cleaner_pid
+    cleaner_lock = threading.Lock()
+    cleaner_pid  = None
+
+
+if hasattr(os, 'register_at_fork'):
+    # The background thread does not survive fork.
+    os.register_at_fork(after_in_child=restart_cleaner)
+
+
+def worker_filename(filename, lockdir):
+    root, ext = os.path.splitext(filename)
+    return '%s.w%d%s' % (root, worker_slot(lockdir), ext)
+
+
+slot_lock  = threading.Lock()
+slot_pid   = None
+slot_files = {}  # lockdir: (slot, locked file)
+
+
+def worker_slot(lockdir):
+    global slot_pid
+
+    with slot_lock:
+        if slot_pid != os.getpid():
+            # The lock files inherited through fork belong to the parent,
+            # closing them here does not release its locks.
+            for _, f in slot_files.values():
+                if f is not None:
+                    f.close()
+            slot_files.clear()
+            slot_pid = os.getpid()
+
+        if lockdir in slot_files:
+            return slot_files[lockdir][0]
+
+        if fcntl is None:
+            # No file locks on this platform, fall back to the process ID.
+            slot_files[lockdir] = os.getpid(), None
+            return os.getpid()
+
+        makedirs(lockdir)
+
+        slot = 0
+        while True:
+            f = open(os.path.join(lockdir, '%d.lock' % slot), 'a')
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                f.close()
+                slot += 1
+                continue
+            # Kept open, and so locked, for the lifetime of the process.
+            slot_files[lockdir] = slot, f
+            return slot
+
+
+def makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
@@ -0,0 +1,126 @@
+# coding:utf-8
+# Post-import hooks, for the framework integrations to be installed without
+# importing the frameworks: `when_imported(name, hook)` calls `hook(module)`
+# as soon as module `name` has been imported by the application, or at once
+# if it already is. A finder at the head of `sys.meta_path` watches for the
+# modules with hooks pending, and wraps their loader to call the hooks right
+# after the module is executed, before the import statement returns.
+import sys
+import threading
+import traceback
+
+hooks      = {}  # module name: [hook]
+hooks_lock = threading.RLock()
+resolving  = threading.local()
+
+
+def when_imported(name, hook):
+    with hooks_lock:
+        module = sys.modules.get(name)
+        if module is None:
+            hooks.setdefault(name, []).append(hook)
+            if finder not in sys.meta_path:
+                sys.meta_path.insert(0, finder)
+            return
+    call(hook, module)
+
+
+def module_available(name):
+    # Whether a top level module is installed, without importing it.
+    if name in sys.modules:
+        return sys.modules[name] is not None
+    try:
+        if sys.version_info.major >= 3:
+            import importlib.util
+            return importlib.util.find_spec(name) is not None
+        import imp
+        f, _, _ = imp.find_module(name)
+        if f is not None:
+            f.close()
+        return True
+    except (ImportError, ValueError):
+        return False
+
+
+def run_hooks(name, module):
+    with hooks_lock:
+        pending = hooks.pop(name, [])
+    for hook in pending:
+        call(hook, module)
+
+
+def call(hook, module):
+    # The application's import must not fail because of the logging.
+    try:
+        hook(module)
+    except Exception:
+        sys.stderr.write(
+            traceback.format_exc() +
+            '\nAn exception occurred while installing the integration with "%s".\n' % module.__name__
+        )
+
+
+class PostImportFinder(object):
+
+    def find_spec(self, fullname, path=None, target=None):
+        if fullname not in hooks or self.resolving(fullname):
+            return None
+        import importlib.util
+        self.names().add(fullname)
+        try:
+            spec = importlib.util.find_spec(fullname)
+        finally:
+            self.names().discard(fullname)
+        if spec is None or not hasattr(spec.loader, 'exec_module'):
+            return None
+        spec.loader = PostImportLoader(spec.loader)
+        return spec
+
+    def find_module(self, fullname, path=None):
+        # Python 2: the module is imported here, with this finder skipped,
+        # and handed over by `load_module`.
+        if fullname not in hooks or self.resolving(fullname):
+            return None
+        self.names().add(fullname)
+        try:
+            __import__(fullname)
+        finally:
+            self.names().discard(fullname)
+        return self
+
+    def load_module(self, fullname):
+        module = sys.modules[fullname]
+        run_hooks(fullname, module)
+        return module
+
+    def resolving(self, fullname):
+        return fullname in self.names()
+
+    def names(self):
+        names = getattr(resolving, 'names', None)
+        if names is None:
+            names = resolving.names = set()
+        return names
+
+
+class PostImportLoader(object):
+
+    def __init__(self, loader):
+        self.loader = loader
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        # The module keeps its own loader.
+        module.__loader__ = self.loader
+        if getattr(module, '__spec__', None) is not None:
+            module.__spec__.loader = self.loader
+        self.loader.exec_module(module)
+        run_hooks(module.__name__, module)
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+
+finder = PostImportFinder()
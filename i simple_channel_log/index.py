@@ -0,0 +1,414 @@
+# coding:utf-8
+# Index of the transaction IDs in the log files, to find the records of a
+# transaction without reading through days of logs:
+#
+#     python -m "i simple_channel_log.index" build --logdir /app/logs
+#     python -m "i simple_channel_log.index" lookup 0123456789abcdef0123456789abcdef --logdir /app/logs
+#
+# from the root of the source tree, where the package directory is
+# "i simple_channel_log"; installed, the module is simple_channel_log.index.
+#
+# Every log file under the log directory, rotated and compressed ones
+# included, gets an index file under "<logdir>/.index" holding the offsets of
+# its records, sorted by a 64-bit hash of their transaction IDs, so that a
+# lookup is a binary search per sorted segment of the index followed by a
+# seek to each record. Records in compressed files are reached by
+# decompressing up to them.
+#
+# Building is incremental: only the part of a log file written since the last
+# build is read, and its entries are appended to the index as a new sorted
+# segment; once an index has `max_segments` segments, they are merged into
+# one. The index of a log file renamed by a rollover is taken over under its
+# new name. `lookup` searches the indexes as they are, unless --update is
+# given.
+# The records found are checked against the transaction ID, so neither a hash
+# collision nor an out-of-date index yields a wrong record.
+import io
+import os
+import re
+import sys
+import gzip
+import json
+import zlib
+import struct
+import heapq
+import hashlib
+import argparse
+
+index_dirname = '.index'
+
+# inode, size, length read, checksum of the head, end of the segments,
+# number of segments. Each segment is its number of entries followed by the
+# entries, sorted.
+magic  = b'SCLIDX2\n'
+header = struct.Struct('>QQQIQI')
+offset = struct.Struct('>Q')
+
+entry_size   = 16  # hash of the transaction ID, offset of the record
+head_size    = 4096
+max_segments = 16
+
+default_logdir = r'C:\BllLogs' if sys.platform == 'win32' else '/app/logs'
+
+log_file_pattern       = re.compile(r'\.log(\.|$)')
+transaction_id_pattern = re.compile(br'"transaction_id": ?"((?:[^"\\]|\\.)*)"')
+
+
+def build(logdir):
+    # Bring the index of every log file under `logdir` up to date. Returns
+    # the number of log files read and of records indexed.
+    stale = stale_indexes(logdir)
+
+    files = records = 0
+    for path in log_files(logdir):
+        try:
+            n = update(logdir, path, stale)
+        except (IOError, OSError, EOFError, zlib.error):
+            # Rotated, removed or being written by the compressor meanwhile.
+            sys.stderr.write('Skipped %s: %s\n' % (path, sys.exc_info()[1]))
+            continue
+        if n is not None:
+            files   += 1
+            records += n
+
+    for x in stale.values():
+        remove(x)
+
+    return files, records
+
+
+def lookup(logdir, transaction_id, update_first=False):
+    # Yield (path, record) of every record of the transaction, the log files
+    # in the order they were last written.
+    if update_first:
+        build(logdir)
+
+    tid = json.dumps(transaction_id, ensure_ascii=False)[1:-1].encode('utf8')
+    key = hash_key(tid)
+
+    paths = []
+    for path in log_files(logdir):
+        try:
+            paths.append((os.path.getmtime(path), path))
+        except OSError:
+            pass
+
+    for _, path in sorted(paths):
+        index = index_path(logdir, path)
+        if not os.path.exists(index):
+            continue
+        offsets = search(index, key)
+        if not offsets:
+            continue
+        for line in read_lines(path, offsets):
+            if tid in transaction_id_pattern.findall(line):
+                yield path, line
+
+
+def update(logdir, path, stale):
+    index = index_path(logdir, path)
+    st = os.stat(path)
+
+    head = read_header(index)
+    if head is not None and not matches(path, st, head):
+        head = None
+    if head is None:
+        # A log file renamed by a rollover has the inode it had before.
+        candidate = stale.pop(st.st_ino, None)
+        if candidate is not None and matches(path, st, read_header(candidate)):
+            makedirs(os.path.dirname(index))
+            os.rename(candidate, index)
+            head = read_header(index)
+
+    if head is not None and head[1] == st.st_size:
+        return None
+
+    compressed = path.endswith(('.gz', '.zst'))
+    start = 0 if head is None or compressed else head[2]
+
+    f = open_log(path)
+    try:
+        if start:
+            f.seek(start)
+        length = start
+        new = []
+        for line in f:
+            if not line.endswith(b'\n') and not compressed:
+                # Still being written.
+                break
+            for tid in set(transaction_id_pattern.findall(line)):
+                new.append(hash_key(tid) + offset.pack(length))
+            length += len(line)
+    finally:
+        f.close()
+
+    new.sort()
+    size = st.st_size if compressed else length
+    head_checksum = checksum(path, size)
+
+    if not start:
+        write_index(index, (st.st_ino, size, length, head_checksum), new)
+    elif head[5] >= max_segments:
+        write_index(index, (st.st_ino, size, length, head_checksum), heapq.merge(*read_segments(index, head) + [new]))
+    else:
+        append_segment(index, head, (st.st_ino, size, length, head_checksum), new)
+
+    return len(new)
+
+
+def write_index(index, head, entries):
+    # A new index of one segment, written aside and renamed over the old one.
+    data = b''.join(entries)
+    end = len(magic) + header.size + offset.size + len(data)
+    makedirs(os.path.dirname(index))
+    tmp = '%s.%d.tmp' % (index, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(magic)
+        f.write(header.pack(*head + (end, 1)))
+        f.write(offset.pack(len(data) // entry_size))
+        f.write(data)
+    os.rename(tmp, index)
+
+
+def append_segment(index, head, new_head, entries):
+    # The header is written last: up to then, lookups do not see the new
+    # segment, and an interrupted build leaves the index as it was.
+    end, segments = head[4], head[5]
+    with open(index, 'r+b') as f:
+        if entries:
+            f.seek(end)
+            f.write(offset.pack(len(entries)))
+            f.write(b''.join(entries))
+            end, segments = f.tell(), segments + 1
+            f.truncate()
+            f.flush()
+        f.seek(len(magic))
+        f.write(header.pack(*new_head + (end, segments)))
+
+
+def matches(path, st, head):
+    # Whether the index was made of this log file, or of the part it has of
+    # the file so far.
+    inode, size, _, head_checksum = head[:4]
+    if inode != st.st_ino or st.st_size < size:
+        return False
+    if path.endswith(('.gz', '.zst')) and st.st_size != size:
+        return False
+    return checksum(path, size) == head_checksum
+
+
+def checksum(path, size):
+    with open(path, 'rb') as f:
+        return zlib.crc32(f.read(min(size, head_size))) & 0xffffffff
+
+
+def stale_indexes(logdir):
+    # The indexes no longer matching their log file, by the inode they were
+    # made of. They are moved aside at once so that a new index of their log
+    # file does not replace them before they are taken over.
+    stale = {}
+    root = os.path.join(logdir, index_dirname)
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            index = os.path.join(dirpath, name)
+            if name.endswith('.tmp'):
+                remove(index)
+                continue
+            head = read_header(index)
+            if head is None:
+                remove(index)
+                continue
+            if name.endswith('.idx'):
+                path = os.path.join(logdir, os.path.relpath(index, root)[:-len('.idx')])
+                try:
+                    if matches(path, os.stat(path), head):
+                        continue
+                except (IOError, OSError):
+                    pass
+                os.rename(index, index + '.stale')
+                index += '.stale'
+            if head[0] in stale:
+                remove(stale[head[0]])
+            stale[head[0]] = index
+    return stale
+
+
+def search(index, key):
+    # The offsets of the entries of `key`, by binary search in each segment.
+    with open(index, 'rb') as f:
+        head = parse_header(f.read(len(magic) + header.size))
+        if head is None:
+            return []
+        offsets = []
+        position = len(magic) + header.size
+        while position < head[4]:
+            f.seek(position)
+            count = offset.unpack(f.read(offset.size))[0]
+            position += offset.size
+            offsets.extend(search_segment(f, position, count, key))
+            position += count * entry_size
+        return offsets
+
+
+def search_segment(f, begin, count, key):
+    lo, hi = 0, count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        f.seek(begin + mid * entry_size)
+        if f.read(8) < key:
+            lo = mid + 1
+        else:
+            hi = mid
+
+    offsets = []
+    f.seek(begin + lo * entry_size)
+    while lo < count:
+        entry = f.read(entry_size)
+        if entry[:8] != key:
+            break
+        offsets.append(offset.unpack(entry[8:])[0])
+        lo += 1
+    return offsets
+
+
+def read_lines(path, offsets):
+    f = open_log(path)
+    try:
+        position = 0
+        for x in sorted(set(offsets)):
+            if x < position:
+                continue
+            if path.endswith('.zst'):
+                skip(f, x - position)
+            else:
+                f.seek(x)
+            line = f.readline()
+            position = x + len(line)
+            yield line
+    finally:
+        f.close()
+
+
+def skip(f, n):
+    while n > 0:
+        chunk = f.read(min(n, 1 << 20))
+        if not chunk:
+            break
+        n -= len(chunk)
+
+
+def open_log(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.zst'):
+        import zstandard
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True))
+    return open(path, 'rb')
+
+
+def read_header(index):
+    try:
+        with open(index, 'rb') as f:
+            return parse_header(f.read(len(magic) + header.size))
+    except (IOError, OSError):
+        return None
+
+
+def parse_header(data):
+    if len(data) < len(magic) + header.size or not data.startswith(magic):
+        return None
+    return header.unpack(data[len(magic):])
+
+
+def read_segments(index, head):
+    # The entries of each segment of the index.
+    with open(index, 'rb') as f:
+        f.seek(len(magic) + header.size)
+        data = f.read(head[4] - len(magic) - header.size)
+    segments = []
+    position = 0
+    while position < len(data):
+        count = offset.unpack(data[position:position + offset.size])[0]
+        position += offset.size
+        segments.append([data[i:i + entry_size] for i in range(position, position + count * entry_size, entry_size)])
+        position += count * entry_size
+    return segments
+
+
+def hash_key(transaction_id):
+    return hashlib.md5(transaction_id).digest()[:8]
+
+
+def log_files(logdir, archives=False):
+    # The log files under `logdir`, skipping hidden directories such as the
+    # index and the worker locks, the hidden files of the compressor, and,
+    # unless `archives` is set, the columnar archives of
+    # simple_channel_log.archive.
+    for dirpath, dirnames, filenames in os.walk(logdir):
+        dirnames[:] = sorted(x for x in dirnames if not x.startswith('.'))
+        for name in sorted(filenames):
+            if name.startswith('.') or not log_file_pattern.search(name):
+                continue
+            if archives or not name.endswith('.npz'):
+                yield os.path.join(dirpath, name)
+
+
+def index_path(logdir, path):
+    return os.path.join(logdir, index_dirname, os.path.relpath(path, logdir) + '.idx')
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='simple_channel_log.index',
+        description='Index the log files by transaction ID and look transactions up.'
+    )
+    commands = parser.add_subparsers(dest='command')
+
+    x = commands.add_parser('build', help='bring the indexes up to date')
+    x.add_argument('--logdir', default=default_logdir, help='default: %s' % default_logdir)
+
+    x = commands.add_parser('lookup', help='print the records of a transaction')
+    x.add_argument('transaction_id')
+    x.add_argument('--logdir', default=default_logdir, help='default: %s' % default_logdir)
+    x.add_argument('--update', action='store_true', help='bring the indexes up to date first')
+    x.add_argument('-H', '--with-filename', action='store_true', help='print the log file of each record')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        files, records = build(args.logdir)
+        sys.stdout.write('%d log files read, %d records indexed.\n' % (files, records))
+        return 0
+
+    if args.command == 'lookup':
+        out = getattr(sys.stdout, 'buffer', sys.stdout)
+        found = False
+        for path, line in lookup(args.logdir, args.transaction_id, args.update):
+            found = True
+            if args.with_filename:
+                out.write(os.path.relpath(path, args.logdir).encode('utf8') + b':')
+            out.write(line if line.endswith(b'\n') else line + b'\n')
+        out.flush()
+        return 0 if found else 1
+
+    parser.print_help()
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,378 @@
+# coding:utf-8
+# Latency analytics of the journal logs, per endpoint (inbound calls) and per
+# downstream (outbound calls), in bounded memory:
+#
+#     python -m "i simple_channel_log.latency" /app/logs
+#     python -m "i simple_channel_log.latency" /app/logs/xxx_info-info.log.2024-01-0* --per-minute
+#
+# from the root of the source tree; installed, the module is
+# simple_channel_log.latency.
+#
+# The files, plain or compressed, or the journal logs under the directories
+# given, are streamed line by line. Only the fields needed are picked out of
+# each record, by regular expressions instead of JSON decoding, and gathered
+# into NumPy arrays a chunk at a time. Each chunk is folded into one latency
+# histogram per endpoint or downstream, with buckets of 1 ms up to 1 s and
+# 1% wider each beyond, so the memory used depends on the number of endpoints
+# and not on the number of records, and the quantiles are exact up to 1 s and
+# within 1% beyond. The columnar archives of simple_channel_log.archive are
+# read column by column instead, the payloads never loaded. Requires NumPy.
+import os
+import re
+import sys
+import json
+import math
+import argparse
+
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .index import log_files, open_log
+
+chunk_size = 1 << 20
+exact_bins = 1000  # milliseconds
+growth     = 1.01
+max_time   = 10 ** 7  # milliseconds, larger times fall into the last bucket
+nbins      = exact_bins + int(math.ceil(math.log(max_time / float(exact_bins)) / math.log(growth))) + 1
+quantiles  = (0.5, 0.9, 0.99)
+
+string = br'"((?:[^"\\]*(?:\\.[^"\\]*)*))"'
+
+# Each matched at the position of the field name, which is found by
+# `bytes.find`, much faster than a search by the pattern.
+log_time_pattern = re.compile(br'"log_time": ?"([^"]*)"')
+head_pattern     = re.compile(
+    br'"dialog_type": ?"([^"]*)", ?'
+    br'"address": ?(?:' + string + br'|null), ?'
+    br'"fcode": ?(?:' + string + br'|null), ?'
+    br'"tcode": ?(?:' + string + br'|null), ?'
+    br'"method_code": ?(?:' + string + br'|null)'
+)
+status_pattern     = re.compile(br'"http_status_code": ?(?:"(\d+)"|(\d+)|null)')
+total_time_pattern = re.compile(br'"total_time": ?(-?\d+)')
+
+class Latencies(object):
+    # Per group, a ("in", method code, address) for the inbound calls and a
+    # ("out", tcode, address) for the outbound ones: the latency histogram,
+    # the number of errors (HTTP status 5xx; records without a status, such
+    # as those of message consumers, are no errors) and the largest latency,
+    # and per group and minute, the number of calls and errors.
+
+    def __init__(self, max_groups=10000):
+        self.max_groups = max_groups
+        self.keys       = {}  # group as parsed: row
+        self.groups     = {}  # group: row
+        self.minutes    = {}  # b"YYYY-mm-dd HH:MM": column
+        self.histogram  = np.zeros((0, nbins), np.int64)
+        self.errors     = np.zeros(0, np.int64)
+        self.max        = np.zeros(0, np.int64)
+        self.per_minute = {}  # (row, column): [calls, errors]
+
+    def row(self, key):
+        # The group is decoded once, when first seen.
+        row = self.keys.get(key)
+        if row is not None:
+            return row
+
+        group = tuple(text(x) for x in key)
+        row = self.groups.get(group)
+        if row is None:
+            if len(self.groups) >= self.max_groups:
+                # Too many, e.g. addresses with IDs in the path; not cached,
+                # for the memory used to stay bounded.
+                return self.groups.setdefault((group[0], '(other)', ''), len(self.groups))
+            row = self.groups[group] = len(self.groups)
+        self.keys[key] = row
+        return row
+
+    def column(self, minute):
+        column = self.minutes.get(minute)
+        if column is None:
+            column = self.minutes[minute] = len(self.minutes)
+        return column
+
+    def add(self, rows, columns, times, errors):
+        rows    = np.asarray(rows, np.int64)
+        columns = np.asarray(columns, np.int64)
+        times   = np.clip(np.asarray(times, np.int64), 0, None)
+        errors  = np.asarray(errors, np.int64)
+
+        n = len(self.groups)
+        if n > len(self.errors):
+            grow = n - len(self.errors)
+            self.histogram = np.vstack([self.histogram, np.zeros((grow, nbins), np.int64)])
+            self.errors    = np.concatenate([self.errors, np.zeros(grow, np.int64)])
+            self.max       = np.concatenate([self.max, np.zeros(grow, np.int64)])
+
+        buckets = bucket_of(times)
+        self.histogram += np.bincount(rows * nbins + buckets, minlength=n * nbins).reshape(n, nbins)
+        self.errors    += np.bincount(rows, weights=errors, minlength=n).astype(np.int64)
+        np.maximum.at(self.max, rows, times)
+
+        cells, index = np.unique(rows * len(self.minutes) + columns, return_inverse=True)
+        calls = np.bincount(index)
+        errs  = np.bincount(index, weights=errors).astype(np.int64)
+        for cell, c, e in zip(cells.tolist(), calls.tolist(), errs.tolist()):
+            key = divmod(cell, len(self.minutes))
+            x = self.per_minute.get(key)
+            if x is None:
+                self.per_minute[key] = [c, e]
+            else:
+                x[0] += c
+                x[1] += e
+
+    def summary(self):
+        # One dict per group, the quantiles computed for all groups at once.
+        counts = self.histogram.sum(axis=1)
+        cumulative = np.cumsum(self.histogram, axis=1)
+        values = {}
+        for q in quantiles:
+            threshold = np.ceil(counts * q).astype(np.int64)
+            values[q] = bucket_value(np.argmax(cumulative >= np.maximum(threshold, 1)[:, None], axis=1))
+
+        minutes = sorted(self.minutes)
+        span = minutes_between(minutes[0].decode('ascii'), minutes[-1].decode('ascii')) + 1 if minutes else 1
+
+        peak = np.zeros(len(self.groups), np.int64)
+        for (row, _), (calls, _) in self.per_minute.items():
+            if calls > peak[row]:
+                peak[row] = calls
+
+        result = []
+        for group, row in self.groups.items():
+            count = int(counts[row])
+            if not count:
+                continue
+            x = {
+                'dialog_type': group[0],
+                'code': group[1],
+                'address': group[2],
+                'count': count,
+                'error_rate': self.errors[row] / float(count),
+                'max': int(self.max[row]),
+                'per_minute_avg': count / float(span),
+                'per_minute_peak': int(peak[row])
+            }
+            for q in quantiles:
+                x['p%d' % int(q * 100)] = int(values[q][row])
+            result.append(x)
+        return result
+
+    def timeline(self):
+        # Per minute: calls and errors of the inbound and outbound calls.
+        dialog_types = dict((row, group[0]) for group, row in self.groups.items())
+        names = dict((column, minute.decode('ascii')) for minute, column in self.minutes.items())
+        result = {}
+        for (row, column), (calls, errors) in self.per_minute.items():
+            x = result.setdefault(names[column], {'in': [0, 0], 'out': [0, 0]})
+            y = x.setdefault(dialog_types[row], [0, 0])
+            y[0] += calls
+            y[1] += errors
+        return sorted(result.items())
+
+
+def bucket_of(times):
+    large = np.floor(np.log(np.maximum(times, exact_bins) / float(exact_bins)) / math.log(growth)).astype(np.int64)
+    return np.where(times < exact_bins, times, np.minimum(exact_bins + large, nbins - 1))
+
+
+def bucket_value(buckets):
+    # The lower bound of the buckets, in milliseconds.
+    large = np.floor(exact_bins * growth ** np.maximum(buckets - exact_bins, 0)).astype(np.int64)
+    return np.where(buckets < exact_bins, buckets, large)
+
+
+def minutes_between(a, b):
+    t = '%Y-%m-%d %H:%M'
+    return int((datetime.strptime(b, t) - datetime.strptime(a, t)).total_seconds() // 60)
+
+
+def parse(line):
+    # (minute, group, error, total time) of a journal record, or None. The
+    # field names in the payloads are escaped, so never taken for the ones of
+    # the record.
+    total_time = total_time_pattern.match(line, max(line.rfind(b'"total_time":'), 0))
+    if total_time is None:
+        return None
+
+    log_time = log_time_pattern.match(line, max(line.find(b'"log_time":'), 0))
+    head     = head_pattern.match(line, max(line.find(b'"dialog_type":'), 0))
+    # After the payloads, so looked for from the end.
+    status   = status_pattern.match(line, max(line.rfind(b'"http_status_code":'), 0))
+
+    if log_time is not None and head is not None and status is not None:
+        dialog_type, address, _, tcode, method_code = head.groups()
+        group = dialog_type, method_code if dialog_type == b'in' else tcode, address
+        status = status.group(1) or status.group(2)
+        error = status is not None and int(status) >= 500
+        return log_time.group(1)[:16], group, error, int(total_time.group(1))
+
+    # Records written by another serializer, with the fields in another order.
+    try:
+        record = json.loads(line.decode('utf8'))
+        dialog_type = record['dialog_type']
+        code = record.get('method_code') if dialog_type == 'in' else record.get('tcode')
+        status = record.get('http_status_code')
+        return (
+            record['log_time'][:16].encode('ascii'), (dialog_type, code, record.get('address')),
+            status is not None and int(status) >= 500, int(record['total_time'])
+        )
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def text(value):
+    if value is None:
+        return ''
+    if not isinstance(value, bytes):
+        return value
+    if b'\\' in value:
+        return json.loads(b'"' + value + b'"')
+    return value.decode('utf8', 'replace')
+
+
+def journal_logs(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for x in log_files(path, archives=True):
+                if '_info-' in os.path.basename(x):
+                    yield x
+        else:
+            yield path
+
+
+def scan(paths, latencies):
+    rows, columns, times, errors = [], [], [], []
+    for path in journal_logs(paths):
+        if path.endswith('.npz'):
+            scan_archive(path, latencies)
+            continue
+        with open_log(path) as f:
+            for line in f:
+                x = parse(line)
+                if x is None:
+                    continue
+                minute, group, error, total_time = x
+                rows.append(latencies.row(group))
+                columns.append(latencies.column(minute))
+                times.append(total_time)
+                errors.append(error)
+                if len(rows) >= chunk_size:
+                    latencies.add(rows, columns, times, errors)
+                    rows, columns, times, errors = [], [], [], []
+    if rows:
+        latencies.add(rows, columns, times, errors)
+
+
+def scan_archive(path, latencies):
+    # The groups and minutes are those of the distinct values, looked up once
+    # per row group of the archive.
+    from .archive import Archive
+
+    with Archive(path) as archive:
+        for g in range(len(archive.meta['groups'])):
+            dialog_types, dialog_type_values = archive.factorize(g, 'dialog_type')
+            times, valid = archive.numbers(g, 'total_time')
+            valid &= dialog_types >= 0
+            valid &= ~archive.missing(g, 'log_time')
+            if not valid.any():
+                continue
+
+            codes = [dialog_types]
+            values = [dialog_type_values]
+            for name in 'method_code', 'tcode', 'address':
+                x, y = archive.factorize(g, name)
+                codes.append(x)
+                values.append(y)
+            keys, key_rows = np.unique(np.stack(codes, axis=1)[valid], axis=0, return_inverse=True)
+            groups = []
+            for d, m, t, a in keys.tolist():
+                dialog_type = values[0][d]
+                code = m if dialog_type == 'in' else t
+                groups.append(latencies.row((
+                    dialog_type,
+                    values[1 if dialog_type == 'in' else 2][code] if code >= 0 else None,
+                    values[3][a] if a >= 0 else None
+                )))
+
+            minutes, minute_rows = np.unique(archive.prefix(g, 'log_time', 16)[valid], return_inverse=True)
+            columns = [latencies.column(x) for x in minutes.tolist()]
+
+            status, known = archive.numbers(g, 'http_status_code')
+            latencies.add(
+                np.array(groups, np.int64)[key_rows.ravel()],
+                np.array(columns, np.int64)[minute_rows.ravel()],
+                times[valid],
+                (known & (status >= 500))[valid]
+            )
+
+
+def report(summary, timeline, top, sort, out):
+    for dialog_type, title in ('in', 'endpoint'), ('out', 'downstream'):
+        rows = sorted((x for x in summary if x['dialog_type'] == dialog_type), key=lambda x: -x[sort])
+        if not rows:
+            continue
+        out.write('%-48s %10s %7s %8s %8s %8s %8s %9s %9s\n' % (
+            title, 'count', 'err%', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'avg/min', 'peak/min'
+        ))
+        for x in rows[:top]:
+            name = ('%s %s' % (x['code'], x['address'])).strip()
+            if len(name) > 48:
+                name = name[:45] + '...'
+            out.write('%-48s %10d %6.2f%% %8d %8d %8d %8d %9.1f %9d\n' % (
+                name, x['count'], x['error_rate'] * 100, x['p50'], x['p90'], x['p99'], x['max'],
+                x['per_minute_avg'], x['per_minute_peak']
+            ))
+        out.write('\n')
+
+    if timeline is not None:
+        out.write('%-16s %10s %7s %10s %7s\n' % ('minute', 'in', 'err%', 'out', 'err%'))
+        for minute, x in timeline:
+            out.write('%-16s %10d %6.2f%% %10d %6.2f%%\n' % (
+                minute, x['in'][0], x['in'][1] * 100.0 / (x['in'][0] or 1),
+                x['out'][0], x['out'][1] * 100.0 / (x['out'][0] or 1)
+            ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='simple_channel_log.latency',
+        description='Latency, error rate and throughput per endpoint and per downstream of the journal logs.'
+    )
+    parser.add_argument('paths', nargs='+', metavar='PATH', help='journal log file, or log directory')
+    parser.add_argument('--top', type=int, default=50, help='rows per table (default: 50)')
+    parser.add_argument('--sort', default='count', choices=('count', 'p50', 'p90', 'p99', 'max', 'error_rate'),
+                        help='default: count')
+    parser.add_argument('--per-minute', action='store_true', help='also print the calls and errors per minute')
+    parser.add_argument('--max-groups', type=int, default=10000,
+                        help='endpoints and downstreams beyond this number are counted as "(other)"')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args(argv)
+
+    if np is None:
+        parser.error('NumPy is required, install it with "pip install numpy".')
+
+    latencies = Latencies(args.max_groups)
+    scan(args.paths, latencies)
+
+    summary  = latencies.summary()
+    timeline = latencies.timeline() if args.per_minute else None
+
+    if args.json:
+        result = {'groups': summary}
+        if timeline is not None:
+            result['per_minute'] = [dict(x, minute=minute) for minute, x in timeline]
+        json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write('\n')
+    else:
+        report(summary, timeline, args.top, args.sort, sys.stdout)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
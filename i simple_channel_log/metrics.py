@@ -0,0 +1,80 @@
+# coding:utf-8
+import bisect
+import threading
+
+
+class Metrics(object):
+    # RED metrics of the inbound calls, rendered in the Prometheus text
+    # exposition format. Each call costs one short locked update of a few
+    # counters and a fixed-bucket histogram.
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        self.lock      = threading.Lock()
+        self.requests  = {}  # (route, method_code, status): count
+        self.errors    = {}  # (route, method_code): count
+        self.durations = {}  # (route, method_code): [count, sum, buckets]
+
+    def observe(self, route, method_code, http_status_code, seconds):
+        key = route or '', '' if method_code is None else str(method_code)
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            status_key = key + (str(http_status_code),)
+            self.requests[status_key] = self.requests.get(status_key, 0) + 1
+            if http_status_code is None or http_status_code >= 500:
+                self.errors[key] = self.errors.get(key, 0) + 1
+            x = self.durations.get(key)
+            if x is None:
+                x = self.durations[key] = [0, 0.0, [0] * len(self.buckets)]
+            x[0] += 1
+            x[1] += seconds
+            if index < len(self.buckets):
+                x[2][index] += 1
+
+    def render(self):
+        with self.lock:
+            requests  = sorted(self.requests.items())
+            errors    = sorted(self.errors.items())
+            durations = sorted((k, (v[0], v[1], list(v[2]))) for k, v in self.durations.items())
+
+        lines = [
+            '# HELP simple_channel_log_requests_total Inbound requests.',
+            '# TYPE simple_channel_log_requests_total counter'
+        ]
+        for (route, method_code, status), count in requests:
+            lines.append('simple_channel_log_requests_total{%s,status="%s"} %d' % (
+                labels(route, method_code), status, count
+            ))
+
+        lines.extend([
+            '# HELP simple_channel_log_errors_total Inbound requests answered with a 5xx status.',
+            '# TYPE simple_channel_log_errors_total counter'
+        ])
+        for (route, method_code), count in errors:
+            lines.append('simple_channel_log_errors_total{%s} %d' % (labels(route, method_code), count))
+
+        lines.extend([
+            '# HELP simple_channel_log_request_duration_seconds Inbound request latency.',
+            '# TYPE simple_channel_log_request_duration_seconds histogram'
+        ])
+        for (route, method_code), (count, total, counts) in durations:
+            label = labels(route, method_code)
+            cumulative = 0
+            for le, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append('simple_channel_log_request_duration_seconds_bucket{%s,le="%s"} %d' % (
+                    label, le, cumulative
+                ))
+            lines.append('simple_channel_log_request_duration_seconds_bucket{%s,le="+Inf"} %d' % (label, count))
+            lines.append('simple_channel_log_request_duration_seconds_sum{%s} %r' % (label, total))
+            lines.append('simple_channel_log_request_duration_seconds_count{%s} %d' % (label, count))
+
+        return '\n'.join(lines) + '\n'
+
+
+def labels(route, method_code):
+    return 'route="%s",method_code="%s"' % (escape(route), escape(method_code))
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
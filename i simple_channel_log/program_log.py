@@ -1,21 +1,15 @@
 # coding:utf-8
 import os
 import sys
-import uuid
-import socket
-import inspect
 import threading
 import traceback
 
 from datetime import datetime
 
-if os.path.basename(sys.argv[0]) != 'setup.py':
-    import gqylpy_log as glog
-
 from .tools import (
     PY2, CO_QUALNAME, is_char, OmitLongString, FuzzyGet, try_json_dumps,
     flask_g, flask_request, flask_current_app, has_flask_request_context,
-    has_fastapi_request_context, FastAPITransactionLog
+    has_fastapi_request_context, fastapi_request_context
 )
 
 from .transaction_log.base import TransactionLogBase as Config
@@ -26,9 +20,7 @@ def logger(msg, *args, **extra):
         raise RuntimeError('uninitialized.')
 
     try:
-        app_name = Config.appname + '_code'
-
-        args, extra = OmitLongString(args), OmitLongString(extra)
+        args = OmitLongString(args)
 
         if PY2 and isinstance(msg, str):
             msg = msg.decode('utf8', errors='replace')
@@ -53,7 +45,7 @@ def logger(msg, *args, **extra):
                 FuzzyGet(getattr(flask_g, '__request_payload__', None), 'method_code').v
             )
         elif has_fastapi_request_context():
-            fastapi_request = FastAPITransactionLog.local.request
+            fastapi_request = fastapi_request_context.get()
             transaction_id = getattr(fastapi_request.state, '__transaction_id__', None)
             try:
                 view_func = fastapi_request.scope['route'].endpoint
@@ -66,10 +58,11 @@ def logger(msg, *args, **extra):
                 FuzzyGet(getattr(fastapi_request.state, '__request_payload__', None), 'method_code').v
             )
         else:
+            import uuid
             transaction_id = uuid.uuid4().hex
             method_code = None
 
-        f_back = inspect.currentframe().f_back
+        f_back = sys._getframe(1)
         level  = f_back.f_code.co_name
 
         f_back = f_back.f_back
@@ -79,8 +72,11 @@ def logger(msg, *args, **extra):
 
         logger_ = '%s.%s.line%d' % (module, name, line)
 
-        data = {
-            'app_name': app_name,
+        if Config.envelope_pid != os.getpid():
+            Config.refresh_envelope()
+
+        data = Config.program_log_envelope.copy()
+        data.update({
             'level': level.upper(),
             'log_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
             'logger': logger_,
@@ -88,21 +84,21 @@ def logger(msg, *args, **extra):
             'code_message': msg,
             'transaction_id': transaction_id,
             'method_code': method_code,
-            'method_name': getattr(f_back.f_code, CO_QUALNAME),
-            'error_code': None,
-            'tag': None,
-            'host_name': socket.gethostname()
-        }
+            'method_name': getattr(f_back.f_code, CO_QUALNAME)
+        })
 
         for k, v in extra.items():
             if data.get(k) is None:
-                data[k] = try_json_dumps(v) if isinstance(v, (dict, list, tuple)) else str(v)
+                if isinstance(v, (dict, list, tuple)):
+                    data[k] = try_json_dumps(v, omit_long_string=True)
+                else:
+                    data[k] = str(OmitLongString(v))
 
-        getattr(glog, level)(try_json_dumps(data), gname='code')
+        Config.write(level, data, 'code')
 
         if Config.output_to_terminal:
             if module != Config.__module__:
                 msg = '[%s] %s' % (logger_, msg)
-            getattr(glog, level)(msg, gname='stream')
+            Config.write(level, msg if is_char(msg) else str(msg), 'stream')
     except Exception:
         sys.stderr.write(traceback.format_exc() + '\nAn exception occurred while recording the log.\n')
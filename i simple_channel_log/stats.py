@@ -0,0 +1,82 @@
+# coding:utf-8
+import bisect
+import threading
+
+from timeit import default_timer
+
+
+class Stats(object):
+    # The time this library spends per integration, route and phase. Phases:
+    # "before" and "after" are the whole hooks, "extract", "serialize" and
+    # "write" are the parts of the journal logger inside "after".
+    buckets = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+
+    def record(self, integration, route, phases):
+        with self.lock:
+            for phase, seconds in phases:
+                key = integration, route, phase
+                x = self.data.get(key)
+                if x is None:
+                    x = self.data[key] = [0, 0.0, 0.0, [0] * (len(self.buckets) + 1)]
+                x[0] += 1
+                x[1] += seconds
+                if seconds > x[2]:
+                    x[2] = seconds
+                x[3][bisect.bisect_left(self.buckets, seconds)] += 1
+
+    def snapshot(self, reset=False):
+        with self.lock:
+            data = self.data
+            if reset:
+                self.data = {}
+            else:
+                data = dict((k, [v[0], v[1], v[2], list(v[3])]) for k, v in data.items())
+
+        result = {}
+        for (integration, route, phase), (count, total, max_, histogram) in data.items():
+            result.setdefault(integration, {}).setdefault(route, {})[phase] = {
+                'count': count,
+                'total': total,
+                'max': max_,
+                'histogram': list(zip(self.buckets + (float('inf'),), histogram))
+            }
+        return result
+
+
+class Timer(object):
+    # Times the phases of one transaction log record, which are recorded
+    # together by `commit` once the route is known.
+    __slots__ = ('stats', 'integration', 'route', 'phases', 'started', 'last')
+
+    def __init__(self, stats, integration, route=None):
+        self.stats       = stats
+        self.integration = integration
+        self.route       = route
+        self.phases      = []
+        self.started     = self.last = default_timer()
+
+    def start(self):
+        self.started = self.last = default_timer()
+
+    def mark(self):
+        self.last = default_timer()
+
+    def lap(self, phase):
+        # Time since the last `mark` or `lap`.
+        now = default_timer()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def stop(self, phase):
+        # Time since `start`.
+        now = default_timer()
+        self.phases.append((phase, now - self.started))
+        self.last = now
+
+    def commit(self):
+        self.stats.record(self.integration, self.route, self.phases)
+        self.phases = []
@@ -0,0 +1,340 @@
+# coding:utf-8
+# Rebuilds the call tree of transactions from the journal and program logs of
+# several services, and prints it as a timeline with the latency of each hop
+# and the critical path:
+#
+#     python -m "i simple_channel_log.stitch" /logs/svc-a /logs/svc-b --transaction-id 0123...
+#     python -m "i simple_channel_log.stitch" /logs/svc-a /logs/svc-b --slowest 10 --min-total-time 500
+#
+# from the root of the source tree; installed, the module is
+# simple_channel_log.stitch.
+#
+# The log directories are scanned as a stream, plain and compressed files
+# alike: only the records of the transactions asked for are parsed, so the
+# memory used does not grow with the size of the logs. With --slowest the
+# logs are scanned twice, first for the transactions of the slowest inbound
+# calls, reading only the tail of each journal record, then for their
+# records. With --use-index the records of --transaction-id are found by the
+# indexes of simple_channel_log.index instead.
+#
+# An outbound call ("out" record of service A to service B) is matched with
+# the inbound call of B from A that started closest to it, and nested under
+# the inbound call of A it was made within; program log records are placed
+# under the inbound call of their service they were written within. Clock
+# skew between hosts shows as an offset of the matched calls, the difference
+# of their times is reported as the network time of the hop.
+import re
+import sys
+import json
+import heapq
+import argparse
+
+from datetime import datetime
+
+from .index import log_files, open_log, lookup, transaction_id_pattern
+
+tail_pattern = re.compile(br'"total_time": ?(-?\d+)\}\s*$')
+
+
+class Span(object):
+    __slots__ = ('record', 'kind', 'fcode', 'tcode', 'start', 'total', 'end', 'parent', 'children')
+
+    def __init__(self, record):
+        self.record   = record
+        self.kind     = record['dialog_type']
+        self.fcode    = record.get('fcode')
+        self.tcode    = record.get('tcode')
+        self.start    = parse_time(record['request_time'])
+        self.total    = int(record.get('total_time') or 0)
+        self.end      = self.start + self.total
+        self.parent   = None
+        self.children = []
+
+    @property
+    def service(self):
+        return self.tcode if self.kind == 'in' else self.fcode
+
+    def ancestors(self):
+        x = self.parent
+        while x is not None:
+            yield x
+            x = x.parent
+
+
+class Event(object):
+    __slots__ = ('record', 'service', 'start')
+
+    def __init__(self, record):
+        self.record  = record
+        self.service = service_code(record.get('app_name'))
+        self.start   = parse_time(record['log_time'])
+
+
+def stitch(records):
+    # The root spans and the events not within any span, of the records of
+    # one transaction.
+    spans  = [Span(r) for r in records if r.get('dialog_type') in ('in', 'out') and r.get('request_time')]
+    events = [Event(r) for r in records if 'code_message' in r and r.get('log_time')]
+
+    ins  = sorted((x for x in spans if x.kind == 'in'), key=lambda x: x.start)
+    outs = sorted((x for x in spans if x.kind == 'out'), key=lambda x: x.start)
+
+    for out in outs:
+        within = innermost(ins, out.fcode, out.start, out.end)
+        if within is not None:
+            adopt(within, out)
+
+    for out in outs:
+        ancestors = set(out.ancestors())
+        candidates = [
+            x for x in ins
+            if x.parent is None and x not in ancestors and x.fcode == out.fcode and x.tcode == out.tcode
+        ]
+        if candidates:
+            adopt(out, min(candidates, key=lambda x: abs(x.start - out.start)))
+
+    roots = []
+    for event in sorted(events, key=lambda x: x.start):
+        within = innermost(ins, event.service, event.start, event.start)
+        if within is None:
+            roots.append(event)
+        else:
+            within.children.append(event)
+
+    roots.extend(x for x in spans if x.parent is None)
+    roots.sort(key=lambda x: x.start)
+    for x in spans:
+        x.children.sort(key=lambda c: c.start)
+    return roots
+
+
+def adopt(parent, child):
+    child.parent = parent
+    parent.children.append(child)
+
+
+def innermost(ins, service, start, end):
+    # The latest started inbound call of `service` covering [start, end]; the
+    # times are whole milliseconds, hence the tolerance of one.
+    result = None
+    for x in ins:
+        if x.start > start:
+            break
+        if x.tcode == service and end <= x.end + 1:
+            result = x
+    return result
+
+
+def critical_path(span):
+    # The chain of calls the span waited for: the child that ended last, then
+    # the child that ended last before that one started, and so on, each
+    # followed into its own children, in the order they were called.
+    chain = []
+    t = span.end + 1
+    for child in sorted((x for x in span.children if isinstance(x, Span)), key=lambda x: x.end, reverse=True):
+        if child.end <= t:
+            chain.append(child)
+            t = child.start
+    path = [span]
+    for child in reversed(chain):
+        path.extend(critical_path(child))
+    return path
+
+
+def self_time(span):
+    # The time of the span not spent in its child calls.
+    busy, last = 0, span.start
+    for child in sorted((x for x in span.children if isinstance(x, Span)), key=lambda x: x.start):
+        start, end = max(child.start, last), min(child.end, span.end)
+        if end > start:
+            busy += end - start
+            last = end
+    return max(span.total - busy, 0)
+
+
+def report(transaction_id, roots, out):
+    spans = list(walk(roots))
+    if not spans:
+        out.write('transaction %s: no records found\n\n' % transaction_id)
+        return
+
+    begin = min(x.start for _, x in spans)
+    end   = max(x.end if isinstance(x, Span) else x.start for _, x in spans)
+
+    critical = set()
+    slowest = None
+    for x in roots:
+        if isinstance(x, Span) and (slowest is None or x.total > slowest.total):
+            slowest = x
+    if slowest is not None:
+        critical.update(critical_path(slowest))
+
+    services = set(x.service for _, x in spans if x.service)
+    calls = sum(1 for _, x in spans if isinstance(x, Span))
+    out.write('transaction %s: %d services, %d calls, %d ms\n' % (
+        transaction_id, len(services), calls, end - begin
+    ))
+
+    for depth, x in spans:
+        indent = '  ' * depth
+        if isinstance(x, Event):
+            r = x.record
+            message = r.get('code_message')
+            if isinstance(message, (dict, list)):
+                message = json.dumps(message, ensure_ascii=False)
+            out.write('%9d ms %10s   %s%-8s %s %s\n' % (
+                x.start - begin, '', indent, r.get('level'), x.service, message
+            ))
+            continue
+        r = x.record
+        if x.kind == 'in':
+            hop = '%s in' % x.tcode
+        else:
+            hop = '%s -> %s out' % (x.fcode, x.tcode)
+        detail = '%s %s %s %s' % (r.get('http_method'), r.get('address'), r.get('method_code') or '-',
+                                  r.get('http_status_code'))
+        notes = ['self %d ms' % self_time(x)]
+        if x.kind == 'out':
+            matched = [c for c in x.children if isinstance(c, Span) and c.kind == 'in']
+            if matched:
+                notes.append('network %d ms' % (x.total - matched[0].total))
+        out.write('%9d ms %7d ms %s %s%s  %s  (%s)\n' % (
+            x.start - begin, x.total, '*' if x in critical else ' ', indent, hop, detail, ', '.join(notes)
+        ))
+
+    if slowest is not None:
+        out.write('critical path: %s\n' % ' > '.join(
+            '%s %d ms' % ('%s in' % x.tcode if x.kind == 'in' else '%s -> %s' % (x.fcode, x.tcode), self_time(x))
+            for x in critical_path(slowest)
+        ))
+    out.write('\n')
+
+
+def walk(nodes, depth=0):
+    for x in nodes:
+        yield depth, x
+        if isinstance(x, Span):
+            for y in walk(x.children, depth + 1):
+                yield y
+
+
+def journal_and_program_logs(logdirs):
+    for logdir in logdirs:
+        for path in log_files(logdir):
+            if '_info-' in path or '_code-' in path:
+                yield logdir, path
+
+
+def slowest_transactions(logdirs, count, min_total_time):
+    # The transactions of the `count` slowest inbound calls, by reading the
+    # tail of each journal record only. A transaction counts with its slowest
+    # inbound call, which is kept in `best` while it may be among the slowest.
+    best = {}
+    threshold = min_total_time
+    for _, path in journal_and_program_logs(logdirs):
+        if '_info-' not in path:
+            continue
+        with open_log(path) as f:
+            for line in f:
+                m = tail_pattern.search(line[-64:])
+                if m is None:
+                    continue
+                total_time = int(m.group(1))
+                if total_time < threshold:
+                    continue
+                if b'"dialog_type": "in"' not in line and b'"dialog_type":"in"' not in line:
+                    continue
+                tids = transaction_id_pattern.findall(line)
+                if not tids or total_time <= best.get(tids[0], -1):
+                    continue
+                best[tids[0]] = total_time
+                if len(best) >= count * 2:
+                    best = dict(heapq.nlargest(count, best.items(), key=lambda x: x[1]))
+                    threshold = max(threshold, min(best.values()))
+
+    return [tid for tid, _ in heapq.nlargest(count, best.items(), key=lambda x: x[1])]
+
+
+def collect(logdirs, transaction_ids, use_index=False):
+    # {transaction ID: records}, the transaction IDs as in the log files.
+    records = dict((x, []) for x in transaction_ids)
+
+    if use_index:
+        for logdir in logdirs:
+            for tid in transaction_ids:
+                for path, line in lookup(logdir, decode(tid), update_first=False):
+                    if '_info-' in path or '_code-' in path:
+                        add(records, line)
+        return records
+
+    for _, path in journal_and_program_logs(logdirs):
+        with open_log(path) as f:
+            for line in f:
+                add(records, line)
+    return records
+
+
+def add(records, line):
+    # Only the records of the wanted transactions are parsed.
+    for tid in set(transaction_id_pattern.findall(line)):
+        if tid in records:
+            try:
+                record = json.loads(line.decode('utf8'))
+            except ValueError:
+                return
+            if record.get('transaction_id') == decode(tid):
+                records[tid].append(record)
+            return
+
+
+def decode(tid):
+    return json.loads(b'"' + tid + b'"')
+
+
+def encode(tid):
+    return json.dumps(tid, ensure_ascii=False)[1:-1].encode('utf8')
+
+
+def service_code(app_name):
+    # The system code is the prefix of the application name.
+    if not app_name:
+        return None
+    return app_name[:10].upper()
+
+
+def parse_time(value):
+    # Milliseconds since the epoch of the naive local time of the record.
+    t = datetime.strptime(value, '%Y-%m-%d %H:%M:%S.%f')
+    return int((t - datetime(1970, 1, 1)).total_seconds() * 1000)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='simple_channel_log.stitch',
+        description='Rebuild the call tree of transactions across the log directories of several services.'
+    )
+    parser.add_argument('logdirs', nargs='+', metavar='LOGDIR', help='log directory of a service')
+    parser.add_argument('-t', '--transaction-id', action='append', default=[], help='transaction to show (repeatable)')
+    parser.add_argument('--slowest', type=int, metavar='N', help='show the transactions of the N slowest inbound calls')
+    parser.add_argument('--min-total-time', type=int, default=0, metavar='MS',
+                        help='with --slowest, ignore inbound calls faster than MS milliseconds')
+    parser.add_argument('--use-index', action='store_true', help='find --transaction-id by the transaction ID indexes')
+    args = parser.parse_args(argv)
+
+    if not args.transaction_id and not args.slowest:
+        parser.error('one of --transaction-id and --slowest is required')
+
+    tids = [encode(x) for x in args.transaction_id]
+    if args.slowest:
+        tids.extend(x for x in slowest_transactions(args.logdirs, args.slowest, args.min_total_time) if x not in tids)
+
+    records = collect(args.logdirs, tids, args.use_index and not args.slowest)
+
+    for tid in tids:
+        report(decode(tid), stitch(records[tid]), sys.stdout)
+
+    return 0 if any(records.values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
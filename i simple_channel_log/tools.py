@@ -1,44 +1,100 @@
 # coding:utf-8
-import os
+import re
 import sys
 import json
 
-if os.path.basename(sys.argv[0]) != 'setup.py':
-    import ipaddress
+from json.encoder import c_make_encoder, encode_basestring, encode_basestring_ascii
 
 if sys.version_info.major >= 3:
-    from urllib.parse import urlparse, parse_qs
     is_char = lambda x: isinstance(x, str)
     PY2 = False
 else:
-    from urlparse import urlparse, parse_qs
     is_char = lambda x: isinstance(x, (str, unicode))
     PY2 = True
 
-try:
-    import flask as _
-except ImportError:
-    has_flask_request_context = lambda: False
-else:
-    from flask import (
-        g           as flask_g,
-        request     as flask_request,
-        current_app as flask_current_app,
-        has_request_context as has_flask_request_context
-    )
+
+class ModuleAttribute(object):
+    # Stands for `module.name`, e.g. flask.g, without importing the module;
+    # resolved on each use, after the module has been imported.
+    __slots__ = ('module', 'name')
+
+    def __init__(self, module, name):
+        self.module = module
+        self.name   = name
+
+    def __getattr__(self, attr):
+        return getattr(getattr(sys.modules[self.module], self.name), attr)
+
+
+flask_g           = ModuleAttribute('flask', 'g')
+flask_request     = ModuleAttribute('flask', 'request')
+flask_current_app = ModuleAttribute('flask', 'current_app')
+
+
+def has_flask_request_context():
+    # No request is being handled before flask is imported.
+    has_request_context = getattr(sys.modules.get('flask'), 'has_request_context', None)
+    return has_request_context is not None and has_request_context()
+
 
 try:
-    import fastapi as _
+    from contextvars import ContextVar
 except ImportError:
-    FastAPITransactionLog = None
+    fastapi_request_context = None
     has_fastapi_request_context = lambda: False
 else:
-    from .transaction_log.x_fastapi import FastAPITransactionLog
-    has_fastapi_request_context = lambda: hasattr(FastAPITransactionLog.local, 'request')
+    # The request being handled by the FastAPI transaction log middleware. A
+    # context variable rather than a thread local, so that it follows each
+    # request across coroutines, tasks and threadpool-run sync endpoints.
+    fastapi_request_context = ContextVar('simple_channel_log.fastapi_request', default=None)
+    has_fastapi_request_context = lambda: fastapi_request_context.get() is not None
 
 CO_QUALNAME = 'co_qualname' if sys.version_info >= (3, 11) else 'co_name'
 
 
+class JSONBackend(object):
+    # `dumps`/`loads` of the third party serializer selected by parameter
+    # `json_backend` of `__init__`, None means the stdlib json module. Data
+    # rejected by the third party serializer falls back to the stdlib.
+    name  = 'json'
+    dumps = None
+    loads = None
+
+    names = ('orjson', 'ujson', 'rapidjson')
+
+    @classmethod
+    def use(cls, name):
+        if name is None or name == 'json':
+            cls.name, cls.dumps, cls.loads = 'json', None, None
+            return
+
+        if name == 'auto':
+            for x in cls.names:
+                try:
+                    return cls.use(x)
+                except ImportError:
+                    pass
+            return cls.use('json')
+
+        if name == 'orjson':
+            import orjson
+            option = orjson.OPT_NON_STR_KEYS
+            cls.dumps = staticmethod(lambda data: orjson.dumps(data, option=option).decode('utf8'))
+            cls.loads = staticmethod(orjson.loads)
+        elif name == 'ujson':
+            import ujson
+            cls.dumps = staticmethod(lambda data: ujson.dumps(data, ensure_ascii=False, escape_forward_slashes=False))
+            cls.loads = staticmethod(ujson.loads)
+        elif name == 'rapidjson':
+            import rapidjson
+            cls.dumps = staticmethod(lambda data: rapidjson.dumps(data, ensure_ascii=False))
+            cls.loads = staticmethod(rapidjson.loads)
+        else:
+            raise ValueError('parameter json_backend "%s" is illegal.' % name)
+
+        cls.name = name
+
+
 class OmitLongString(dict):
 
     def __init__(self, data):
@@ -57,6 +113,61 @@ class OmitLongString(dict):
         return data
 
 
+class OmitLongStringEncoder(json.JSONEncoder):
+    # Applies the `OmitLongString` rule to strings as they are encoded, so the
+    # data is walked once and never copied. The C encoder encodes the dict
+    # keys with the same function as the values, though, and keys are to be
+    # kept whole: when an omitted string turns out to be a key, which is
+    # rare, the data is encoded again from an `OmitLongString` copy.
+
+    def encode(self, o):
+        if is_char(o):
+            o = OmitLongString(o)
+        return json.JSONEncoder.encode(self, o)
+
+    def iterencode(self, o, _one_shot=False):
+        if PY2 or not _one_shot or c_make_encoder is None or self.indent is not None:
+            return json.JSONEncoder.iterencode(self, OmitLongString(o), _one_shot)
+
+        encoder = encode_basestring_ascii if self.ensure_ascii else encode_basestring
+
+        omitted = []
+
+        def encode_string(x):
+            if len(x) > 1000:
+                omitted.append(x)
+                x = '<Ellipsis>'
+            return encoder(x)
+
+        chunks = c_make_encoder(
+            {} if self.check_circular else None, self.default, encode_string,
+            self.indent, self.key_separator, self.item_separator, self.sort_keys,
+            self.skipkeys, self.allow_nan
+        )(o, 0)
+
+        if not omitted:
+            return chunks
+
+        # A quote inside a string is escaped, so an omitted key is the only
+        # string that can follow "{" or the item separator and precede the
+        # key separator.
+        text = ''.join(chunks)
+        key = '"<Ellipsis>"' + self.key_separator
+        if '{' + key in text or self.item_separator + key in text:
+            return json.JSONEncoder.iterencode(self, OmitLongString(o), _one_shot)
+        return [text]
+
+
+omit_long_string_encoder = OmitLongStringEncoder(ensure_ascii=False)
+
+# The start of a JSON string of more than 1000 characters. A string is never
+# shorter encoded, and every quote of a text without an escaped quote is the
+# start or the end of a string, so such a text holds no string to be omitted
+# if the pattern is not found in it. Found between two strings, it costs an
+# encoding by `omit_long_string_encoder` only.
+long_string_pattern = re.compile(r'"[^"]{1001}')
+
+
 class FuzzyGet(dict):
     v = None
 
@@ -82,6 +193,41 @@ class FuzzyGet(dict):
         return cls
 
 
+class FuzzyExtractor(object):
+    # Matches a fixed set of keys in one walk over the payload, each key
+    # resolving to the same value as `FuzzyGet(data, key).v`.
+
+    def __init__(self, *keys):
+        self.keys = {}
+        for key in keys:
+            self.keys.setdefault(normalize_key(key), []).append(key)
+
+    def __call__(self, data):
+        found = {}
+        if isinstance(data, (list, tuple)):
+            data = {'data': data}
+        self.walk(data, frozenset(self.keys), found)
+        return dict((key, v) for nkey, v in found.items() for key in self.keys[nkey])
+
+    def walk(self, data, nkeys, found):
+        if isinstance(data, dict):
+            for k, v in data.items():
+                nk = normalize_key(k) if is_char(k) else None
+                if nk in nkeys:
+                    found[nk] = v
+                    nkeys = nkeys - {nk}
+                    if not nkeys:
+                        break
+                self.walk(v, nkeys, found)
+        elif isinstance(data, (list, tuple)):
+            for v in data:
+                self.walk(v, nkeys, found)
+
+
+def normalize_key(key):
+    return key.replace(' ', '').replace('-', '').replace('_', '').lower()
+
+
 def get_tcode(parsed_url, request_headers, request_payload):
     tcode = FuzzyGet(request_headers, 'T-Code').v
     if tcode is None:
@@ -96,6 +242,7 @@ def is_syscode(x):
 
 
 def is_valid_ip(ip):
+    import ipaddress
     if PY2 and isinstance(ip, str):
         ip = ip.decode('utf8', errors='replace')
     try:
@@ -106,21 +253,48 @@ def is_valid_ip(ip):
 
 
 def try_json_loads(data):
+    if JSONBackend.loads is not None:
+        try:
+            return JSONBackend.loads(data)
+        except (ValueError, TypeError):
+            pass
     try:
         return json.loads(data)
     except (ValueError, TypeError):
         pass
 
 
-def try_json_dumps(data):
+def try_json_dumps(data, omit_long_string=False):
     try:
+        if omit_long_string:
+            # The third party serializers cannot omit strings as they go, so
+            # their text is kept when it holds no string to be omitted, which
+            # is the case of most payloads.
+            if JSONBackend.dumps is not None:
+                try:
+                    text = JSONBackend.dumps(data)
+                except (TypeError, ValueError, OverflowError):
+                    pass
+                else:
+                    if '\\"' not in text and not long_string_pattern.search(text):
+                        return text
+            return omit_long_string_encoder.encode(data)
+        if JSONBackend.dumps is not None:
+            try:
+                return JSONBackend.dumps(data)
+            except (TypeError, ValueError, OverflowError):
+                pass
         return json.dumps(data, ensure_ascii=False)
     except (TypeError, ValueError):
-        return str(data)
+        return str(OmitLongString(data) if omit_long_string else data)
 
 
 def fuzzy_get_many(data, *keys):
+    return first_not_none(FuzzyExtractor(*keys)(data), *keys)
+
+
+def first_not_none(found, *keys):
     for k in keys:
-        v = FuzzyGet(data, k).v
+        v = found.get(k)
         if v is not None:
             return v
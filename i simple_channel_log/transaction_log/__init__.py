@@ -1,28 +1,24 @@
 # coding:utf-8
 import functools
 
-try:
-    from flask import Flask
-except ImportError:
-    pass
-else:
+from ..hooks import when_imported
+
+
+def install_flask(flask):
     from .x_flask import FlaskTransactionLog
 
     def wrap_flask_init_method(func):
         @functools.wraps(func)
         def inner(self, *a, **kw):
             func(self, *a, **kw)
-            self.wsgi_app = FlaskTransactionLog(self.wsgi_app)
+            FlaskTransactionLog(self)
         inner.__wrapped__ = func
         return inner
 
-    Flask.wsgi_app = wrap_flask_init_method(Flask.__init__)
+    flask.Flask.__init__ = wrap_flask_init_method(flask.Flask.__init__)
 
-try:
-    from fastapi import FastAPI
-except ImportError:
-    pass
-else:
+
+def install_fastapi(fastapi):
     from .x_fastapi import FastAPITransactionLog
 
     def wrap_fastapi_init_method(func):
@@ -33,29 +29,20 @@ else:
         inner.__wrapped__ = func
         return inner
 
-    FastAPI.__init__ = wrap_fastapi_init_method(FastAPI.__init__)
+    fastapi.FastAPI.__init__ = wrap_fastapi_init_method(fastapi.FastAPI.__init__)
+
 
-try:
-    import requests
-except ImportError:
-    pass
-else:
+def install_requests(requests):
     from .x_requests import RequestsTransactionLog
     requests.Session.request = RequestsTransactionLog(requests.Session.request)
 
-try:
-    import unirest
-except ImportError:
-    pass
-else:
+
+def install_unirest(unirest):
     from .x_unirest import UnirestTransactionLog
     unirest.__request = UnirestTransactionLog(unirest.__request)
 
-try:
-    from ctec_consumer.dummy.ctec_consumer import Consumer
-except ImportError:
-    pass
-else:
+
+def install_ctec_consumer(ctec_consumer):
     from .x_ctec_consumer import CTECConsumerTransactionLog
 
     def wrap_register_worker(func):
@@ -65,4 +52,13 @@ else:
         inner.__wrapped__ = func
         return inner
 
-    Consumer.register_worker = wrap_register_worker(Consumer.register_worker)
+    ctec_consumer.Consumer.register_worker = wrap_register_worker(ctec_consumer.Consumer.register_worker)
+
+
+# Installed when the application imports the framework, which may be before
+# or after importing this package.
+when_imported('flask', install_flask)
+when_imported('fastapi', install_fastapi)
+when_imported('requests', install_requests)
+when_imported('unirest', install_unirest)
+when_imported('ctec_consumer.dummy.ctec_consumer', install_ctec_consumer)
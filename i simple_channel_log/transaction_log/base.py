@@ -2,23 +2,34 @@
 import os
 import sys
 import abc
-import socket
+import time
+import zlib
 import functools
 import threading
+import traceback
 
 from datetime import datetime
 
-if os.path.basename(sys.argv[0]) != 'setup.py':
-    import gqylpy_log as glog
-    from exceptionx import TryExcept, TryContext
+from ..tools import FuzzyExtractor, is_char, first_not_none, try_json_loads, try_json_dumps
+from ..async_writer import emit
+from ..stats import Timer
 
-from ..tools import FuzzyGet, OmitLongString, is_char, fuzzy_get_many, try_json_dumps
+# True for the type checkers only, typing is slow to import.
+TYPE_CHECKING = False
 
-from typing import TypeVar, Union
+if TYPE_CHECKING:
+    from typing import TypeVar, Union
 
-Str = TypeVar('Str', bound=Union[str, None])
-Int = TypeVar('Int', bound=Union[int, None])
-Dict = TypeVar('Dict', bound=Union[dict, None])
+    Str = TypeVar('Str', bound=Union[str, None])
+    Int = TypeVar('Int', bound=Union[int, None])
+    Dict = TypeVar('Dict', bound=Union[dict, None])
+
+request_payload_extractor = FuzzyExtractor(
+    'order_id', 'ht_id', 'province_code', 'city_code', 'phone', 'phone_num', 'number', 'accnbr'
+)
+response_payload_extractor = FuzzyExtractor(
+    'order_id', 'ht_id', 'province_code', 'city_code', 'phone', 'phone_num', 'accnbr', 'receive_phone', 'code'
+)
 
 
 class Logger(object):
@@ -47,23 +58,58 @@ def raise_external_exception(e, *a, **kw):
         raise
 
 
+def try_except(*a, **kw):
+    # exceptionx.TryExcept, applied on the first call: exceptionx imports
+    # asyncio, which is not needed until a transaction is logged.
+    def decorator(func):
+        @functools.wraps(func)
+        def inner(*args, **kwargs):
+            try:
+                wrapped = inner.wrapped
+            except AttributeError:
+                from exceptionx import TryExcept
+                wrapped = inner.wrapped = TryExcept(*a, **kw)(func)
+            return wrapped(*args, **kwargs)
+        return inner
+    return decorator
+
+
+def try_context(*a, **kw):
+    from exceptionx import TryContext
+    return TryContext(*a, **kw)
+
+
 class TransactionLogBase(object):
     __metaclass__ = abc.ABCMeta
 
     appname = None
-    svccode = None
+    syscode = None
     output_to_terminal = False
+    async_writer = None
+    capture_limit = 1 << 20
+    sample_rate = 1
+    sample_rates = {}
+    tail_capture_threshold = None
+    success_codes = ('0', '00', '000', '0000', '00000', '200')
+    stats = None
+    metrics = None
+
+    journallog_envelope = None
+    program_log_envelope = None
+    envelope_pid = None
+    envelope_refresher = None
+    envelope_refresh_interval = None
 
     def __init__(self, func):
         self.__wrapped__ = func
         functools.update_wrapper(self, func)
 
-    @TryExcept(Exception, last_tb=True, logger=Logger, ecallback=raise_external_exception)
+    @try_except(Exception, last_tb=True, logger=Logger, ecallback=raise_external_exception)
     def __call__(self, *a, **kw):
         return self.dispatch(*a, **kw)
 
     def dispatch(self, *a, **kw):
-        with TryContext(Exception, last_tb=True, logger=Logger):
+        with try_context(Exception, last_tb=True, logger=Logger):
             if self.appname is not None:
                 before_return = self.before(*a, **kw)
 
@@ -71,7 +117,7 @@ class TransactionLogBase(object):
         response = self.__wrapped__(*a, **kw)
         response_time = datetime.now()
 
-        with TryContext(Exception, last_tb=True, logger=Logger):
+        with try_context(Exception, last_tb=True, logger=Logger):
             if 'before_return' in locals():
                 self.after(before_return, request_time, response, response_time, *a, **kw)
 
@@ -89,29 +135,152 @@ class TransactionLogBase(object):
         return response
 
     def dispatch_v3(self, *a, **kw):
-        with TryContext(Exception, last_tb=True, logger=Logger):
+        with try_context(Exception, last_tb=True, logger=Logger):
             if self.appname is not None:
                 before_return = self.before(*a, **kw)
                 request_time = datetime.now()
 
         response = self.__wrapped__(*a, **kw)
 
-        with TryContext(Exception, last_tb=True, logger=Logger):
+        with try_context(Exception, last_tb=True, logger=Logger):
             if 'before_return' in locals():
                 self.after(before_return, request_time, response, datetime.now(), *a, **kw)
 
         return response
 
-    @TryExcept(Exception, last_tb=True, logger=None)
+    @try_except(Exception, last_tb=True, logger=None)
     def dispatch_before(self, *a, **kw):
         if self.appname is not None:
             return self.before(*a, **kw)
 
-    @TryExcept(Exception, last_tb=True, logger=None)
+    @try_except(Exception, last_tb=True, logger=None)
     def dispatch_after(self, *a, **kw):
         if a[0] is not None:
             return self.before(*a, **kw)
 
+    @classmethod
+    def refresh_envelope(cls):
+        # The fields that never change within a process, computed once here
+        # instead of per record. The fields set to None are filled per record;
+        # listing them keeps the order of the fields in the record.
+        import socket
+        host_name = socket.gethostname()
+        try:
+            host_ip = socket.gethostbyname(host_name)
+        except socket.error:
+            host_ip = cls.journallog_envelope and cls.journallog_envelope['host_ip']
+
+        cls.journallog_envelope = dict.fromkeys((
+            'app_name', 'level', 'log_time', 'logger', 'thread', 'transaction_id', 'dialog_type',
+            'address', 'fcode', 'tcode', 'method_code', 'method_name', 'http_method', 'request_time',
+            'request_headers', 'request_payload', 'response_time', 'response_headers', 'response_payload',
+            'response_code', 'response_remark', 'http_status_code', 'order_id', 'province_code', 'city_code',
+            'error_code', 'request_ip', 'host_ip', 'host_name', 'account_type', 'account_num',
+            'response_account_type', 'response_account_num', 'user', 'tag', 'service_line'
+        ))
+        cls.journallog_envelope.update({
+            'app_name': cls.appname + '_info',
+            'level': 'INFO',
+            'logger': 'simple_channel_log',
+            'host_ip': host_ip,
+            'host_name': host_name
+        })
+
+        cls.program_log_envelope = dict.fromkeys((
+            'app_name', 'level', 'log_time', 'logger', 'thread', 'code_message', 'transaction_id',
+            'method_code', 'method_name', 'error_code', 'tag', 'host_name'
+        ))
+        cls.program_log_envelope.update({'app_name': cls.appname + '_code', 'host_name': host_name})
+
+        if cls.envelope_pid != os.getpid():
+            cls.envelope_pid = os.getpid()
+            if cls.envelope_refresh_interval:
+                cls.envelope_refresher = threading.Thread(
+                    target=cls.refresh_envelope_periodically,
+                    name='simple_channel_log.refresh_envelope'
+                )
+                cls.envelope_refresher.daemon = True
+                cls.envelope_refresher.start()
+
+    @classmethod
+    def refresh_envelope_periodically(cls):
+        while cls.envelope_refresher is threading.current_thread():
+            time.sleep(cls.envelope_refresh_interval)
+            try:
+                cls.refresh_envelope()
+            except Exception:
+                sys.stderr.write(traceback.format_exc() + '\nAn exception occurred while refreshing the host identity.\n')
+
+    @classmethod
+    def sampled(
+            cls, transaction_id, method_code=None, path=None, http_status_code=None, response_payload=None,
+            exception=False, response_code=None
+    ):
+        # Head sampling of transaction logs. The decision is a hash of the
+        # transaction ID, so every record of a transaction, in this service or
+        # another one with the same rate, is kept or dropped together. Records
+        # of failures, by HTTP status code, by response code (given, or
+        # extracted from the response payload only for the records that would
+        # be dropped) or by an exception, are always kept.
+        if exception or cls.failed(http_status_code, None):
+            return True
+        rate = cls.sample_rates.get(method_code, cls.sample_rates.get(path, cls.sample_rate))
+        if rate >= 1:
+            return True
+        if rate > 0 and zlib.crc32(str(transaction_id).encode('utf8')) & 0xffffffff < rate * 0x100000000:
+            return True
+        if response_code is None:
+            response_code = response_payload_extractor(response_payload).get('code')
+        return cls.failed(None, response_code)
+
+    @classmethod
+    def slim(cls, total_time, http_status_code, response_code):
+        # Tail-based capture: when enabled, the payloads are serialized into
+        # the record only for slow or failed transactions.
+        if cls.tail_capture_threshold is None or total_time >= cls.tail_capture_threshold:
+            return False
+        return not cls.failed(http_status_code, response_code)
+
+    @classmethod
+    def failed(cls, http_status_code, response_code):
+        if http_status_code is not None and not 200 <= http_status_code < 300:
+            return True
+        return not (response_code is None or str(response_code) in cls.success_codes)
+
+    @classmethod
+    def capturable(cls, content_type, content_length=None):
+        # Whether a response body is worth reading and JSON-parsing for the
+        # transaction log: not oversized, and not a binary or event stream.
+        if content_length is not None:
+            try:
+                if int(content_length) > cls.capture_limit:
+                    return False
+            except (TypeError, ValueError):
+                pass
+        if not content_type:
+            return True
+        mimetype = content_type.split(';', 1)[0].strip().lower()
+        return 'json' in mimetype or mimetype.startswith('text/') and mimetype != 'text/event-stream'
+
+    @classmethod
+    def load_response_payload(cls, body):
+        if body is None or len(body) > cls.capture_limit:
+            return {}
+        return try_json_loads(body) or {}
+
+    @classmethod
+    def timer(cls, integration, route=None):
+        # None unless self-timing is enabled, so the hooks pay one call.
+        if cls.stats is not None:
+            return Timer(cls.stats, integration, route)
+
+    @classmethod
+    def write(cls, level, data, gname):
+        if cls.async_writer is None:
+            emit(level, data, gname)
+        else:
+            cls.async_writer.put((level, data, gname))
+
     @abc.abstractmethod
     def before(self, *a, **kw):
         raise NotImplementedError
@@ -138,14 +307,30 @@ class TransactionLogBase(object):
             response_payload,  # type: Dict
             http_status_code,  # type: Int
             request_ip,        # type: Str
+            timer=None,        # type: Timer
+            exception=False,   # type: bool
             **extra
     ):
-        order_id      = fuzzy_get_many((request_payload, response_payload), 'order_id', 'ht_id')
-        province_code = FuzzyGet(request_payload, 'province_code').v or FuzzyGet(response_payload, 'province_code').v
-        city_code     = FuzzyGet(request_payload, 'city_code').v or FuzzyGet(response_payload, 'city_code').v
+        if timer is not None:
+            timer.mark()
+
+        request_fields  = request_payload_extractor(request_payload)
+        response_fields = response_payload_extractor(response_payload)
+
+        if timer is not None:
+            timer.lap('extract')
 
-        account_num           = fuzzy_get_many(request_payload, 'phone', 'phone_num', 'number', 'accnbr')
-        response_account_num  = fuzzy_get_many(response_payload, 'phone', 'phone_num', 'accnbr', 'receive_phone')
+        # Same as searching (request_payload, response_payload) as one tuple:
+        # a match in the response payload is found last and wins.
+        either_fields = dict(request_fields)
+        either_fields.update(response_fields)
+
+        order_id      = first_not_none(either_fields, 'order_id', 'ht_id')
+        province_code = request_fields.get('province_code') or response_fields.get('province_code')
+        city_code     = request_fields.get('city_code') or response_fields.get('city_code')
+
+        account_num           = first_not_none(request_fields, 'phone', 'phone_num', 'number', 'accnbr')
+        response_account_num  = first_not_none(response_fields, 'phone', 'phone_num', 'accnbr', 'receive_phone')
         account_type          = None if account_num is None else '11'
         response_account_type = None if response_account_num is None else '11'
 
@@ -154,11 +339,23 @@ class TransactionLogBase(object):
         total_time = (response_time - request_time).total_seconds()
         total_time = int(round(total_time * 1000))
 
-        data = {
-            'app_name': TransactionLogBase.appname + '_info',
-            'level': 'INFO',
+        # Given by integrations without a response payload, such as consumers.
+        response_code = extra.pop('response_code', None)
+        if response_code is None:
+            response_code = response_fields.get('code')
+
+        if not exception and TransactionLogBase.slim(total_time, http_status_code, response_code):
+            request_payload_str = response_payload_str = None
+        else:
+            request_payload_str  = try_json_dumps(request_payload, omit_long_string=True)
+            response_payload_str = try_json_dumps(response_payload, omit_long_string=True)
+
+        if TransactionLogBase.envelope_pid != os.getpid():
+            TransactionLogBase.refresh_envelope()
+
+        data = TransactionLogBase.journallog_envelope.copy()
+        data.update({
             'log_time': response_time_str,
-            'logger': 'simple_channel_log',
             'thread': str(threading.current_thread().ident),
             'transaction_id': transaction_id,
             'dialog_type': dialog_type,
@@ -170,28 +367,21 @@ class TransactionLogBase(object):
             'http_method': http_method,
             'request_time': request_time.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
             'request_headers': try_json_dumps(request_headers),
-            'request_payload': try_json_dumps(OmitLongString(request_payload)),
+            'request_payload': request_payload_str,
             'response_time': response_time_str,
             'response_headers': try_json_dumps(response_headers),
-            'response_payload': try_json_dumps(OmitLongString(response_payload)),
-            'response_code': FuzzyGet(response_payload, 'code').v,
-            'response_remark': None,
+            'response_payload': response_payload_str,
+            'response_code': response_code,
             'http_status_code': http_status_code,
             'order_id': order_id,
             'province_code': province_code,
             'city_code': city_code,
-            'error_code': None,
             'request_ip': request_ip,
-            'host_ip': socket.gethostbyname(socket.gethostname()),
-            'host_name': socket.gethostname(),
             'account_type': account_type,
             'account_num': account_num,
             'response_account_type': response_account_type,
-            'response_account_num': response_account_num,
-            'user': None,
-            'tag': None,
-            'service_line': None
-        }
+            'response_account_num': response_account_num
+        })
         data.update(extra)
 
         for k, v in data.items():
@@ -200,4 +390,10 @@ class TransactionLogBase(object):
 
         data['total_time'] = total_time
 
-        glog.info(try_json_dumps(data), gname='info_')
+        if timer is not None:
+            timer.lap('serialize')
+
+        TransactionLogBase.write('info', data, 'info_')
+
+        if timer is not None:
+            timer.lap('write')
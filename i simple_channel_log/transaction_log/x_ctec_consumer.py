@@ -1,6 +1,10 @@
 # coding:utf-8
+import uuid
 
-from .base import TransactionLogBase
+from datetime import datetime
+
+from .base import TransactionLogBase, Logger, try_context
+from ..tools import try_json_loads, FuzzyGet
 
 
 class CTECConsumerTransactionLog(TransactionLogBase):
@@ -9,11 +13,76 @@ class CTECConsumerTransactionLog(TransactionLogBase):
         TransactionLogBase.__init__(self, func)
         self.topic = topic
 
-    def dispatch(self, *a, **kw):
-        pass
+    def dispatch(self, message, *a, **kw):
+        # As `TransactionLogBase.dispatch`, but a message whose worker raises
+        # is recorded too, before the exception is passed on.
+        before_return = None
+        with try_context(Exception, last_tb=True, logger=Logger):
+            if self.appname is not None:
+                before_return = self.before(message)
+
+        request_time = datetime.now()
+        try:
+            result = self.__wrapped__(message, *a, **kw)
+        except Exception:
+            if before_return is not None:
+                with try_context(Exception, last_tb=True, logger=Logger):
+                    self.after(before_return, request_time, None, datetime.now(), exception=True)
+            raise
+
+        if before_return is not None:
+            with try_context(Exception, last_tb=True, logger=Logger):
+                self.after(before_return, request_time, result, datetime.now())
+
+        return result
+
+    def before(self, message):
+        timer = self.timer('ctec_consumer', self.topic)
+
+        request_payload = try_json_loads(message.body) or message.body
+        transaction_id = FuzzyGet(request_payload, 'transaction_id').v or uuid.uuid4().hex
+
+        if timer is not None:
+            timer.stop('before')
+
+        return request_payload, transaction_id, timer
+
+    def after(self, before_return, request_time, result, response_time, exception=False):
+        request_payload, transaction_id, timer = before_return
+
+        # A worker returns the result code, or (result code, result message).
+        code = result[0] if isinstance(result, tuple) else result
 
-    def before(self):
-        pass
+        if timer is not None:
+            timer.start()
+        try:
+            # Messages have no method code; they are sampled by their topic.
+            if not self.sampled(transaction_id, path=self.topic, exception=exception, response_code=code):
+                return
 
-    def after(self):
-        pass
+            self.logger(
+                transaction_id=transaction_id,
+                dialog_type='in',
+                address=None,
+                fcode=FuzzyGet(request_payload, 'fcode').v,
+                tcode=self.syscode,
+                method_code=None,
+                method_name=getattr(self.__wrapped__, '__name__', None),
+                http_method=None,
+                request_time=request_time,
+                response_time=response_time,
+                request_headers=None,
+                request_payload=request_payload,
+                response_headers=None,
+                response_payload=None,
+                http_status_code=None,
+                request_ip=None,
+                timer=timer,
+                exception=exception,
+                topic=self.topic,
+                response_code=code
+            )
+        finally:
+            if timer is not None:
+                timer.stop('after')
+                timer.commit()
@@ -2,17 +2,18 @@ import sys
 import json
 import uuid
 import traceback
-import threading
 
 from datetime import datetime
 
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
+from starlette.requests import Request
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
 
-from ..tools import FuzzyGet, try_json_loads
+from .base import TransactionLogBase as Config
+from ..tools import FuzzyGet, try_json_loads, fastapi_request_context
+from ..stats import Timer
 
-from types import ModuleType
-from typing import TypeVar, ClassVar, Union, Dict, Any
+from typing import TypeVar, Union, Optional, Dict, Any
 
 if sys.version_info >= (3, 9):
     from typing import Annotated
@@ -25,28 +26,25 @@ if sys.version_info >= (3, 10):
 else:
     TypeAlias = TypeVar('TypeAlias')
 
-UUID: TypeAlias = TypeVar('UUID', bound=str)
 Str: TypeAlias = Annotated[Union[str, None], 'Compatible with None type.']
 
-simple_channel_log: ModuleType = __import__(__package__ + '.i ' + __package__, fromlist=...)
 
+class FastAPITransactionLog:
 
-class FastAPITransactionLog(BaseHTTPMiddleware):
-    appname: ClassVar[str]
-    syscode: ClassVar[str]
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
 
-    request_time:    datetime
-    request_headers: Dict[str, Any]
-    request_payload: Dict[str, Any]
-    transaction_id:  UUID
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or scope['path'] in ('/healthcheck', '/metrics') or Config.appname is None:
+            await self.app(scope, receive, send)
+            return
 
-    local: ClassVar = threading.local()
+        request_body = await read_request_body(receive)
+        request = Request(scope, replay_request_body(request_body, receive))
 
-    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
-        if request.url.path in ('/healthcheck', '/metrics') or not hasattr(self, 'appname'):
-            return await call_next(request)
+        context_token = fastapi_request_context.set(request)
 
-        self.local.request = request
+        timer: Optional[Timer] = Config.timer('fastapi')
 
         try:
             await self.before(request)
@@ -55,40 +53,73 @@ class FastAPITransactionLog(BaseHTTPMiddleware):
                 traceback.format_exc() +
                 '\nAn exception occurred while recording the internal transaction log.\n'
             )
+        else:
+            if timer is not None:
+                timer.stop('before')
+
+        response_start: Message = {}
+        response_headers: Dict[str, str] = {}
+        response_body = bytearray()
+        capture_limit: int = Config.capture_limit
+        finished = False
+
+        async def finish(status_code: Optional[int], exception: bool = False) -> None:
+            nonlocal finished
+            finished = True
+            if timer is not None:
+                timer.start()
+            try:
+                await self.after(
+                    request,
+                    status_code=status_code,
+                    response_headers=response_headers,
+                    response_payload=(
+                        Config.load_response_payload(bytes(response_body)) if capture_limit >= 0 else {}
+                    ),
+                    exception=exception,
+                    timer=timer
+                )
+            except Exception:
+                sys.stderr.write(
+                    traceback.format_exc() +
+                    '\nAn exception occurred while recording the internal transaction log.\n'
+                )
+            if timer is not None:
+                # The route is only known once the app has routed the request.
+                timer.route = getattr(scope.get('route'), 'path', None)
+                timer.stop('after')
+                timer.commit()
+
+        # Chunks are forwarded as soon as the app sends them; only a prefix of
+        # at most `capture_limit` bytes is kept for the transaction log, and
+        # nothing of binary or event stream bodies.
+        async def send_wrapper(message: Message) -> None:
+            nonlocal capture_limit
+
+            await send(message)
+
+            if message['type'] == 'http.response.start':
+                response_start.update(message)
+                response_headers.update(Headers(raw=message.get('headers', [])))
+                if not Config.capturable(response_headers.get('content-type'), response_headers.get('content-length')):
+                    capture_limit = -1
+            elif message['type'] == 'http.response.body':
+                if len(response_body) <= capture_limit:
+                    response_body.extend(message.get('body', b'')[:capture_limit + 1 - len(response_body)])
+                if not message.get('more_body', False):
+                    await finish(response_start.get('status'))
 
-        response = await call_next(request)
-
-        response_body = b''
         try:
-            body_iterator = getattr(response, 'body_iterator', None)
-            if body_iterator is None:
-                try:
-                    del self.local.request
-                except AttributeError:
-                    pass
-                return response
-
-            async for chunk in body_iterator:
-                response_body += chunk
-
-            await self.after(request, response, response_payload=try_json_loads(response_body) or {})
+            await self.app(scope, replay_request_body(request_body, receive), send_wrapper)
         except Exception:
-            sys.stderr.write(
-                traceback.format_exc() +
-                '\nAn exception occurred while recording the internal transaction log.\n'
-            )
-
-        try:
-            del self.local.request
-        except AttributeError:
-            pass
-
-        return Response(
-            content=response_body,
-            status_code=response.status_code,
-            media_type=response.media_type,
-            headers=response.headers
-        )
+            # The 500 response is sent by ServerErrorMiddleware, outside of
+            # this middleware, so it is recorded here, with whatever of the
+            # response had been sent before the endpoint raised.
+            if not finished:
+                await finish(500, exception=True)
+            raise
+        finally:
+            fastapi_request_context.reset(context_token)
 
     async def before(self, request: Request) -> None:
         if not hasattr(request.state, '__request_time__'):
@@ -120,19 +151,28 @@ class FastAPITransactionLog(BaseHTTPMiddleware):
                             request_payload['data'] = json_data
             request.state.__request_payload__ = request_payload
 
-        self.request_time    = request.state.__request_time__
-        self.request_headers = request.state.__request_headers__
-        self.request_payload = request.state.__request_payload__
-        self.transaction_id  = request.state.__transaction_id__ = (
-            FuzzyGet(self.request_headers, 'Transaction-ID').v or
-            FuzzyGet(self.request_payload, 'transaction_id').v or
+        request.state.__transaction_id__ = (
+            FuzzyGet(request.state.__request_headers__, 'Transaction-ID').v or
+            FuzzyGet(request.state.__request_payload__, 'transaction_id').v or
             uuid.uuid4().hex
         )
 
-    async def after(self, request: Request, response: Response, *, response_payload: Dict[str, Any]) -> None:
+    async def after(
+            self,
+            request:          Request,
+            *,
+            status_code:      int,
+            response_headers: Dict[str, str],
+            response_payload: Dict[str, Any],
+            exception:        bool = False,
+            timer:            Optional[Timer] = None
+    ) -> None:
+        request_headers: Dict[str, Any] = request.state.__request_headers__
+        request_payload: Dict[str, Any] = request.state.__request_payload__
+
         address = f'{request.url.scheme}://{request.url.netloc}{request.url.path}'
 
-        fcode: Str = FuzzyGet(self.request_headers, 'User-Agent').v
+        fcode: Str = FuzzyGet(request_headers, 'User-Agent').v
 
         try:
             view_func = request.scope['route'].endpoint
@@ -142,25 +182,68 @@ class FastAPITransactionLog(BaseHTTPMiddleware):
         method_code: Str = (
             getattr(view_func, '__method_code__', None) or
             getattr(request.state, 'method_code', None) or
-            FuzzyGet(self.request_headers, 'Method-Code').v or
-            FuzzyGet(self.request_payload, 'method_code').v
+            FuzzyGet(request_headers, 'Method-Code').v or
+            FuzzyGet(request_payload, 'method_code').v
         )
         method_name = getattr(view_func, '__name__', None)
 
-        simple_channel_log.journallog_logger(
-            transaction_id=self.transaction_id,
+        response_time = datetime.now()
+
+        if Config.metrics is not None:
+            Config.metrics.observe(
+                getattr(request.scope.get('route'), 'path', None),
+                method_code,
+                status_code,
+                (response_time - request.state.__request_time__).total_seconds()
+            )
+
+        if not Config.sampled(
+                request.state.__transaction_id__, method_code, request.url.path, status_code, response_payload, exception
+        ):
+            return
+
+        Config.logger(
+            transaction_id=request.state.__transaction_id__,
             dialog_type='in',
             address=address,
             fcode=fcode,
-            tcode=self.syscode,
+            tcode=Config.syscode,
             method_code=method_code,
             method_name=method_name,
             http_method=request.method,
-            request_time=self.request_time,
-            request_headers=self.request_headers,
-            request_payload=self.request_payload,
-            response_headers=dict(response.headers),
+            request_time=request.state.__request_time__,
+            response_time=response_time,
+            request_headers=request_headers,
+            request_payload=request_payload,
+            response_headers=response_headers,
             response_payload=response_payload,
-            http_status_code=response.status_code,
-            request_ip=request.client.host
+            http_status_code=status_code,
+            request_ip=request.client and request.client.host,
+            timer=timer,
+            exception=exception
         )
+
+
+async def read_request_body(receive: Receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] != 'http.request':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            break
+    return b''.join(chunks)
+
+
+def replay_request_body(body: bytes, receive: Receive) -> Receive:
+    replayed = False
+
+    async def inner() -> Message:
+        nonlocal replayed
+        if replayed:
+            return await receive()
+        replayed = True
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    return inner
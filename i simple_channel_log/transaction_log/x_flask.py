@@ -1,22 +1,145 @@
 # coding:utf-8
+import sys
+import uuid
+import traceback
+
+from datetime import datetime
+
+from flask import g, request, current_app
+
+if sys.version_info.major >= 3:
+    from urllib.parse import urlparse
+else:
+    from urlparse import urlparse
 
 from .base import TransactionLogBase
+from ..tools import is_char, FuzzyGet, try_json_loads
 
 
 class FlaskTransactionLog(TransactionLogBase):
 
     def __init__(self, app):
-        self.app = app  # 原始 WSGI 应用
-
-    def dispatch(self, environ, start_response):
-        self.before()
-        # 调用下层应用（例如 Flask 的 wsgi_app）
-        response = self.app(environ, start_response)
-        self.after()
-        return response
+        self.app = app  # 原始 Flask 应用
+        app.before_request(self.before)
+        app.after_request(self.after)
 
     def before(self):
-        pass
+        try:
+            if request.path in ('/healthcheck', '/metrics') or self.appname is None:
+                return
+
+            timer = self.timer('flask', request.url_rule.rule if request.url_rule is not None else None)
+
+            if not hasattr(g, '__request_time__'):
+                g.__request_time__ = datetime.now()
+
+            if not hasattr(g, '__request_headers__'):
+                g.__request_headers__ = dict(request.headers)
+
+            if not hasattr(g, '__request_payload__'):
+                request_payload = request.args.to_dict()
+                if request.form:
+                    request_payload.update(request.form.to_dict())
+                elif request.data:
+                    data = try_json_loads(request.data)
+                    if is_char(data):
+                        data = try_json_loads(data)
+                    if isinstance(data, dict):
+                        request_payload.update(data)
+                    elif isinstance(data, list):
+                        request_payload['data'] = data
+                g.__request_payload__ = request_payload
+
+            g.__transaction_id__ = (
+                FuzzyGet(g.__request_headers__, 'Transaction-ID').v or
+                FuzzyGet(g.__request_payload__, 'transaction_id').v or
+                uuid.uuid4().hex
+            )
+
+            if timer is not None:
+                timer.stop('before')
+                g.__timer__ = timer
+        except Exception:
+            sys.stderr.write(
+                traceback.format_exc() +
+                '\nAn exception occurred while recording the internal transaction log.\n'
+            )
+
+    def after(self, response):
+        timer = getattr(g, '__timer__', None)
+        if timer is not None:
+            timer.start()
+        try:
+            if request.path in ('/healthcheck', '/metrics') or self.appname is None:
+                return response
+
+            parsed_url = urlparse(request.url)
+            address = parsed_url.scheme + '://' + parsed_url.netloc + parsed_url.path
+
+            fcode = FuzzyGet(g.__request_headers__, 'User-Agent').v
+
+            view_func = current_app.view_functions.get(request.endpoint)
+
+            method_code = (
+                getattr(view_func, '__method_code__', None) or
+                getattr(request, 'method_code', None) or
+                FuzzyGet(g.__request_headers__, 'Method-Code').v or
+                FuzzyGet(g.__request_payload__, 'method_code').v
+            )
+            method_name = getattr(view_func, '__name__', None)
+
+            response_time = datetime.now()
+
+            if self.metrics is not None:
+                self.metrics.observe(
+                    request.url_rule.rule if request.url_rule is not None else None,
+                    method_code,
+                    response.status_code,
+                    (response_time - g.__request_time__).total_seconds()
+                )
+
+            response_payload = self.response_payload(response)
+
+            if not self.sampled(
+                    g.__transaction_id__, method_code, request.path, response.status_code, response_payload
+            ):
+                return response
+
+            self.logger(
+                transaction_id=g.__transaction_id__,
+                dialog_type='in',
+                address=address,
+                fcode=fcode,
+                tcode=self.syscode,
+                method_code=method_code,
+                method_name=method_name,
+                http_method=request.method,
+                request_time=g.__request_time__,
+                response_time=response_time,
+                request_headers=g.__request_headers__,
+                request_payload=g.__request_payload__,
+                response_headers=dict(response.headers),
+                response_payload=response_payload,
+                http_status_code=response.status_code,
+                request_ip=request.remote_addr,
+                timer=timer
+            )
+        except Exception:
+            sys.stderr.write(
+                traceback.format_exc() +
+                '\nAn exception occurred while recording the internal transaction log.\n'
+            )
+        finally:
+            if timer is not None:
+                timer.stop('after')
+                timer.commit()
+
+        return response
 
-    def after(self):
-        pass
+    def response_payload(self, response):
+        # Streamed and file responses are never buffered just for the log.
+        if response.is_streamed or response.direct_passthrough:
+            return {}
+        if not self.capturable(response.content_type, response.content_length):
+            return {}
+        return self.load_response_payload(response.get_data())
@@ -1,15 +1,156 @@
 # coding:utf-8
+import sys
+import uuid
+import inspect
+import functools
+
+if sys.version_info.major >= 3:
+    from urllib.parse import urlparse, parse_qs
+else:
+    from urlparse import urlparse, parse_qs
 
 from .base import TransactionLogBase
+from ..tools import (
+    CO_QUALNAME, is_char, try_json_loads, FuzzyGet, is_valid_ip, get_tcode,
+    flask_g, flask_request, flask_current_app, has_flask_request_context,
+    has_fastapi_request_context, fastapi_request_context,
+)
+
+internal_packages = ('requests', 'exceptionx', __package__.split('.')[0])
 
 
 class RequestsTransactionLog(TransactionLogBase):
 
-    def dispatch(self, *a, **kw):
-        pass
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return functools.partial(self, instance)
+
+    def dispatch(self, session, method, url, params=None, data=None, headers=None, *a, **kw):
+        # Always pass a headers dict, so that the headers set in `before` are
+        # sent, and a copy, so that they are not left in the caller's dict,
+        # which may be shared by later requests of other transactions.
+        headers = dict(headers or {})
+        return TransactionLogBase.dispatch(self, session, method, url, params, data, headers, *a, **kw)
+
+    def before(self, session, method, url, params=None, data=None, headers=None, *a, **kw):
+        parsed_url = urlparse(url)
+        timer = self.timer('requests', parsed_url.netloc + parsed_url.path)
+        request_payload = {k: v[0] for k, v in parse_qs(parsed_url.query).items()}
+
+        if isinstance(params, dict):
+            request_payload.update(params)
+
+        datax = data or kw.get('json')
+
+        if is_char(datax):
+            datax = try_json_loads(datax)
+        if isinstance(datax, dict):
+            request_payload.update(datax)
+        elif isinstance(datax, (list, tuple)):
+            request_payload['data'] = datax
+
+        # Outbound records are sampled by the inbound request they belong to.
+        if has_flask_request_context():
+            sample_path = flask_request.path
+            transaction_id = getattr(flask_g, '__transaction_id__', None)
+            view_func = flask_current_app.view_functions.get(flask_request.endpoint)
+            method_code = (
+                getattr(view_func, '__method_code__', None) or
+                getattr(flask_request, 'method_code', None) or
+                getattr(flask_g, 'method_code', None) or
+                FuzzyGet(getattr(flask_g, '__request_headers__', None), 'Method-Code').v or
+                FuzzyGet(getattr(flask_g, '__request_payload__', None), 'method_code').v
+            )
+        elif has_fastapi_request_context():
+            fastapi_request = fastapi_request_context.get()
+            sample_path = fastapi_request.url.path
+            transaction_id = getattr(fastapi_request.state, '__transaction_id__', None)
+            try:
+                view_func = fastapi_request.scope['route'].endpoint
+            except (KeyError, AttributeError):
+                view_func = None
+            method_code = (
+                getattr(view_func, '__method_code__', None) or
+                getattr(fastapi_request.state, 'method_code', None) or
+                FuzzyGet(getattr(fastapi_request.state, '__request_headers__', None), 'Method-Code').v or
+                FuzzyGet(getattr(fastapi_request.state, '__request_payload__', None), 'method_code').v
+            )
+        else:
+            sample_path = parsed_url.path
+            transaction_id = (
+                FuzzyGet(headers, 'Transaction-ID').v or
+                FuzzyGet(request_payload, 'transaction_id').v or
+                uuid.uuid4().hex
+            )
+            method_code = FuzzyGet(headers, 'Method-Code').v or FuzzyGet(request_payload, 'method_code').v
+
+        if isinstance(headers, dict):
+            headers.setdefault('User-Agent', self.syscode)
+            headers.setdefault('Transaction-ID', transaction_id)
+
+        if timer is not None:
+            timer.stop('before')
+
+        return parsed_url, request_payload, transaction_id, method_code, sample_path, timer
+
+    def after(
+            self, before_return, request_time, response, response_time,
+            session, method, url, params=None, data=None, headers=None, *a, **kw
+    ):
+        parsed_url, request_payload, transaction_id, method_code, sample_path, timer = before_return
+
+        if timer is not None:
+            timer.start()
+        try:
+            response_payload = self.response_payload(response, stream=kw.get('stream'))
+
+            if not self.sampled(transaction_id, method_code, sample_path, response.status_code, response_payload):
+                return
+
+            method_name = FuzzyGet(headers, 'Method-Name').v
+            if method_name is None:
+                # The first frame outside of requests and this package is the caller.
+                f_back = inspect.currentframe().f_back
+                while f_back.f_back is not None:
+                    if f_back.f_globals.get('__name__', '').split('.')[0] not in internal_packages:
+                        break
+                    f_back = f_back.f_back
+                method_name = getattr(f_back.f_code, CO_QUALNAME)
+
+            request_ip = parsed_url.hostname
+            if not is_valid_ip(request_ip):
+                request_ip = None
 
-    def before(self):
-        pass
+            self.logger(
+                transaction_id=transaction_id,
+                dialog_type='out',
+                address=parsed_url.scheme + '://' + parsed_url.netloc + parsed_url.path,
+                fcode=self.syscode,
+                tcode=get_tcode(parsed_url, headers, request_payload),
+                method_code=method_code,
+                method_name=method_name,
+                http_method=method.upper(),
+                request_time=request_time,
+                response_time=response_time,
+                request_headers=dict(response.request.headers),
+                request_payload=request_payload,
+                response_headers=dict(response.headers),
+                response_payload=response_payload,
+                http_status_code=response.status_code,
+                request_ip=request_ip,
+                timer=timer
+            )
+        finally:
+            if timer is not None:
+                timer.stop('after')
+                timer.commit()
 
-    def after(self):
-        pass
+    def response_payload(self, response, stream=False):
+        # With stream=True the body has not been downloaded yet, and reading it
+        # here would take it away from the caller.
+        if stream and not response._content_consumed:
+            return {}
+        if not self.capturable(response.headers.get('Content-Type'), response.headers.get('Content-Length')):
+            return {}
+        return self.load_response_payload(response.content)
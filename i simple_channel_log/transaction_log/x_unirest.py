@@ -1,23 +1,36 @@
 # coding:utf-8
+import sys
 import uuid
 import inspect
 
 import unirest
 
+if sys.version_info.major >= 3:
+    from urllib.parse import urlparse, parse_qs
+else:
+    from urlparse import urlparse, parse_qs
+
 from .base import TransactionLogBase
 from ..tools import (
-    CO_QUALNAME, urlparse, parse_qs, is_char, try_json_loads, FuzzyGet, is_valid_ip, get_tcode,
+    CO_QUALNAME, is_char, try_json_loads, FuzzyGet, is_valid_ip, get_tcode,
     flask_g, flask_request, flask_current_app, has_flask_request_context,
-    has_fastapi_request_context, FastAPITransactionLog,
+    has_fastapi_request_context, fastapi_request_context,
 )
 
 
 class UnirestTransactionLog(TransactionLogBase):
 
+    def dispatch(self, method, url, params={}, headers=None, *a, **kw):
+        # The headers set in `before` are sent with a copy of the caller's
+        # dict, which may be shared by later requests of other transactions.
+        headers = dict(headers or {})
+        return TransactionLogBase.dispatch(self, method, url, params, headers, *a, **kw)
+
     def before(self, method, url, params={}, headers=None, *a, **kw):
         request_params, request_headers = params, headers
 
         parsed_url = urlparse(url)
+        timer = self.timer('unirest', parsed_url.netloc + parsed_url.path)
         request_payload = {k: v[0] for k, v in parse_qs(parsed_url.query).items()}
 
         if is_char(request_params):
@@ -27,7 +40,9 @@ class UnirestTransactionLog(TransactionLogBase):
         elif isinstance(request_params, (list, tuple)):
             request_payload['data'] = request_params
 
+        # Outbound records are sampled by the inbound request they belong to.
         if has_flask_request_context():
+            sample_path = flask_request.path
             transaction_id = getattr(flask_g, '__transaction_id__', None)
             view_func = flask_current_app.view_functions.get(flask_request.endpoint)
             method_code = (
@@ -38,7 +53,8 @@ class UnirestTransactionLog(TransactionLogBase):
                 FuzzyGet(getattr(flask_g, '__request_payload__', None), 'method_code').v
             )
         elif has_fastapi_request_context():
-            fastapi_request = FastAPITransactionLog.local.request
+            fastapi_request = fastapi_request_context.get()
+            sample_path = fastapi_request.url.path
             transaction_id = getattr(fastapi_request.state, '__transaction_id__', None)
             try:
                 view_func = fastapi_request.scope['route'].endpoint
@@ -51,6 +67,7 @@ class UnirestTransactionLog(TransactionLogBase):
                 FuzzyGet(getattr(fastapi_request.state, '__request_payload__', None), 'method_code').v
             )
         else:
+            sample_path = parsed_url.path
             transaction_id = (
                 FuzzyGet(request_headers, 'Transaction-ID').v or
                 FuzzyGet(request_payload, 'transaction_id').v or
@@ -58,52 +75,72 @@ class UnirestTransactionLog(TransactionLogBase):
             )
             method_code = FuzzyGet(request_headers, 'Method-Code').v or FuzzyGet(request_payload, 'method_code').v
 
-        if request_headers is None:
-            request_headers = {'User-Agent': self.svccode, 'Transaction-ID': transaction_id}
-        elif isinstance(request_headers, dict):
-            request_headers.setdefault('User-Agent', self.svccode)
+        if isinstance(request_headers, dict):
+            request_headers.setdefault('User-Agent', self.syscode)
             request_headers.setdefault('Transaction-ID', transaction_id)
 
-        return request_headers, request_payload, transaction_id, method_code
+        if timer is not None:
+            timer.stop('before')
+
+        return request_headers, request_payload, transaction_id, method_code, sample_path, timer
 
     def after(
             self, before_return, request_time, response, response_time,
             method, url, params={}, headers=None, *a, **kw
     ):
-        request_headers, request_payload, transaction_id, method_code = before_return
-
-        parsed_url = urlparse(url)
-
-        method_name = FuzzyGet(request_headers, 'Method-Name').v
-        if method_name is None:
-            f_back = inspect.currentframe().f_back
-            for _ in range(6):
-                if f_back.f_back is not None:
-                    f_back = f_back.f_back
-            method_name = getattr(f_back.f_code, CO_QUALNAME)
-
-        request_ip = parsed_url.hostname
-        if not is_valid_ip(request_ip):
-            request_ip = None
-
-        self.logger(
-            transaction_id=transaction_id,
-            dialog_type='out',
-            address=parsed_url.scheme + '://' + parsed_url.netloc + parsed_url.path,
-            fcode=self.svccode,
-            tcode=get_tcode(parsed_url, request_headers, request_payload),
-            method_code=method_code,
-            method_name=method_name,
-            http_method=method.upper(),
-            request_time=request_time,
-            response_time=response_time,
-            request_headers=request_headers,
-            request_payload=request_payload,
-            response_headers=dict(response.headers),
-            response_payload=try_json_loads(response.raw_body) or {},
-            http_status_code=response.code,
-            request_ip=request_ip
-        )
+        request_headers, request_payload, transaction_id, method_code, sample_path, timer = before_return
+
+        if timer is not None:
+            timer.start()
+        try:
+            response_payload = self.response_payload(response)
+
+            if not self.sampled(transaction_id, method_code, sample_path, response.code, response_payload):
+                return
+
+            parsed_url = urlparse(url)
+
+            method_name = FuzzyGet(request_headers, 'Method-Name').v
+            if method_name is None:
+                f_back = inspect.currentframe().f_back
+                for _ in range(6):
+                    if f_back.f_back is not None:
+                        f_back = f_back.f_back
+                method_name = getattr(f_back.f_code, CO_QUALNAME)
+
+            request_ip = parsed_url.hostname
+            if not is_valid_ip(request_ip):
+                request_ip = None
+
+            self.logger(
+                transaction_id=transaction_id,
+                dialog_type='out',
+                address=parsed_url.scheme + '://' + parsed_url.netloc + parsed_url.path,
+                fcode=self.syscode,
+                tcode=get_tcode(parsed_url, request_headers, request_payload),
+                method_code=method_code,
+                method_name=method_name,
+                http_method=method.upper(),
+                request_time=request_time,
+                response_time=response_time,
+                request_headers=request_headers,
+                request_payload=request_payload,
+                response_headers=dict(response.headers),
+                response_payload=response_payload,
+                http_status_code=response.code,
+                request_ip=request_ip,
+                timer=timer
+            )
+        finally:
+            if timer is not None:
+                timer.stop('after')
+                timer.commit()
+
+    def response_payload(self, response):
+        headers = response.headers or {}
+        if not self.capturable(headers.get('Content-Type'), headers.get('Content-Length')):
+            return {}
+        return self.load_response_payload(response.raw_body)
 
     @classmethod
     def reset_unirest_user_agent(cls):
@@ -34,7 +34,12 @@ setuptools.setup(
         'fastapi': ['fastapi>=0.83.0'],
         'requests': ['requests>=2.19'],
         'unirest': ['unirest>=1.0.5'],
-        'ctec-consumer': ['ctec-consumer>=0.1']
+        'ctec-consumer': ['ctec-consumer>=0.1'],
+        'orjson': ['orjson>=3.0'],
+        'ujson': ['ujson>=2.0'],
+        'rapidjson': ['python-rapidjson>=1.0'],
+        'zstd': ['zstandard>=0.15'],
+        'numpy': ['numpy>=1.13']
     },
     classifiers=[
         'Development Status :: 4 - Beta',
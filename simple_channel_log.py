@@ -1,14 +1,42 @@
 # coding:utf-8
-from typing import Optional
+# True for the type checkers only, typing is slow to import. Deleted after
+# use, so that it is not taken for a name of the package.
+TYPE_CHECKING = False
+
+if TYPE_CHECKING:
+    from typing import Optional, Dict, List
+
+del TYPE_CHECKING
 
 
 def __init__(
-        appname,                  # type: str
-        logdir            =None,  # type: Optional[str]
-        when              =None,  # type: Optional[str]
-        interval          =None,  # type: Optional[int]
-        backup_count      =None,  # type: Optional[int]
-        output_to_terminal=None   # type: Optional[bool]
+        appname,                     # type: str
+        logdir               =None,  # type: Optional[str]
+        when                 =None,  # type: Optional[str]
+        interval             =None,  # type: Optional[int]
+        backup_count         =None,  # type: Optional[int]
+        output_to_terminal   =None,  # type: Optional[bool]
+        async_mode           =None,  # type: Optional[bool]
+        async_queue_size     =None,  # type: Optional[int]
+        async_overflow       =None,  # type: Optional[str]
+        json_backend         =None,  # type: Optional[str]
+        host_refresh_interval=None,  # type: Optional[int]
+        capture_limit        =None,  # type: Optional[int]
+        sample_rate          =None,  # type: Optional[float]
+        sample_rates         =None,  # type: Optional[Dict[str, float]]
+        tail_capture         =None,  # type: Optional[int]
+        success_codes        =None,  # type: Optional[List[str]]
+        self_timing          =None,  # type: Optional[bool]
+        metrics              =None,  # type: Optional[bool]
+        multiprocess         =None,  # type: Optional[bool]
+        flush_interval       =None,  # type: Optional[float]
+        flush_size           =None,  # type: Optional[int]
+        fsync_interval       =None,  # type: Optional[float]
+        background_rollover  =None,  # type: Optional[bool]
+        compress             =None,  # type: Optional[str]
+        max_bytes            =None,  # type: Optional[int]
+        disk_budget          =None,  # type: Optional[int]
+        archive              =None   # type: Optional[bool]
 ):
     """
     初始化日志配置。
@@ -28,6 +56,78 @@ def __init__(
         日志保留策略，控制最大历史版本数量，默认为 7。设为 0 表示永久保留。
     @param output_to_terminal:
         设为 True 日志（简要信息）将同时输出到终端，默认为 False。流水日志和埋点日志除外。
+    @param async_mode:
+        设为 True 启用异步写日志，默认为 False。启用后日志记录（程序日志、流水日志、埋点日志）
+        将放入有界队列，由独立的后台线程完成序列化和写文件，请求线程无需等待磁盘 I/O。
+    @param async_queue_size:
+        异步模式下队列的最大长度，默认为 10000。
+    @param async_overflow:
+        异步模式下队列已满时的处理策略，默认为 "block"。可选值有：block:阻塞等待,
+        drop_newest:丢弃当前日志, drop_oldest:丢弃队列中最早的日志。丢弃的条数可通过
+        `dropped_records` 查看。
+    @param json_backend:
+        指定 JSON 序列化库，默认使用标准库 json。可选值有：orjson, ujson, rapidjson,
+        auto（使用已安装的第一个）。第三方库无法处理的数据将自动回退到标准库。注意第三方库输出的
+        JSON 不含分隔符后的空格。
+    @param host_refresh_interval:
+        主机名和主机 IP 在初始化时解析一次并缓存（子进程中重新解析），设置该参数（单位：秒）
+        后将由后台线程按此间隔定期刷新，默认不刷新。
+    @param capture_limit:
+        流水日志记录响应内容的最大字节数，默认为 1048576（1MB）。超出该大小的响应、二进制响应
+        （如图片、文件下载）以及流式响应不读取和解析其内容，流水日志中响应内容记为空。
+    @param sample_rate:
+        流水日志采样率，取值 0~1，默认为 1（全部记录）。是否采样由交易流水号（transaction_id）
+        的哈希值决定，因此同一笔交易的调入、调出流水日志总是同时保留或同时丢弃。HTTP 状态码非 2xx、
+        响应码不在 `success_codes` 中或接口抛出异常的流水日志总是保留。
+    @param sample_rates:
+        按接口编码（method_code）或接口路径单独设置采样率，优先于 `sample_rate`，如：
+        `{"I00101": 0.1, "/index": 0}`。调出流水日志按其所属调入请求的接口编码和路径采样，
+        ctec_consumer 消费者的流水日志按主题（topic）采样。
+    @param tail_capture:
+        开启尾部采集，值为耗时阈值（毫秒），默认不开启。开启后，只有耗时达到该阈值、HTTP 状态码
+        非 2xx 或响应码不在 `success_codes` 中的交易，其流水日志才记录请求内容和响应内容，其余交易
+        只记录精简的流水日志（`request_payload`、`response_payload` 为空）。
+    @param success_codes:
+        采样及尾部采集中视为成功的响应码（响应内容中的 `code` 字段），默认为
+        `("0", "00", "000", "0000", "00000", "200")`。响应内容中没有 `code` 字段时视为成功。
+    @param self_timing:
+        启用后统计本库自身的耗时，默认不启用。通过 `stats()` 查看统计结果。
+    @param metrics:
+        启用后在进程内按路由和接口编码汇总调入请求的请求数、错误数（HTTP 状态码 5xx）及耗时
+        直方图，默认不启用。通过 `metrics()` 获取 Prometheus 文本格式的指标。
+    @param multiprocess:
+        多进程模式，默认不启用。在 gunicorn、uvicorn 等多 worker 部署下启用，每个进程写入各自的
+        日志文件并各自轮转，避免多个进程同时写入和轮转同一文件。文件名中加入 worker 槽位号，如
+        "xxx_code-info.w3.log"，槽位号为未被存活进程占用的最小编号（记录在日志目录的 .workers
+        目录下），worker 重启后复用，文件数量不会随进程重启增长。合并查看时使用通配符即可，如
+        "xxx_code-info.w*.log"。
+    @param flush_interval:
+        启用缓冲写入，值为刷新间隔（秒），如 0.2，默认不启用（每条日志立即写入文件）。启用后日志先
+        写入缓冲区，缓冲区满（见参数 `flush_size`）、达到刷新间隔、日志轮转或进程退出时合并写入
+        文件，大幅减少写文件的系统调用次数。进程异常终止时可能丢失最近一个刷新间隔内的日志。
+    @param flush_size:
+        缓冲写入的缓冲区大小（字节），默认为 65536（64KB）。
+    @param fsync_interval:
+        缓冲写入模式下定期调用 fsync 将日志落盘的间隔（秒），默认不调用。
+    @param background_rollover:
+        启用后由后台线程完成日志轮转，默认不启用（由轮转时间后的第一条日志在写日志的线程中完成）。
+        后台线程预先重命名旧文件并打开新文件，写日志的线程只在切换文件的瞬间等待，过期的历史日志
+        也由后台线程删除，避免轮转时刻（如每天 0 点）的延迟尖刺。
+    @param compress:
+        压缩轮转后的历史日志，默认不压缩。可选值有：gzip, zstd（需安装 zstandard）, auto（已安装
+        zstandard 时使用 zstd，否则使用 gzip）。压缩由低优先级的后台线程完成，压缩后的文件名加上
+        ".gz" 或 ".zst" 后缀，参数 `backup_count` 同样适用于压缩后的历史日志。
+    @param max_bytes:
+        单个日志文件的大小上限（字节），默认不限制。日志文件达到上限后即提前轮转，同一周期内的历史
+        日志依次编号，如 "xxx.log.2024-01-01"、"xxx.log.2024-01-01.1"，此时参数 `backup_count`
+        表示保留的周期数量。
+    @param disk_budget:
+        日志目录 `logdir` 的总大小上限（字节），默认不限制。每次轮转后由低优先级的后台线程按时间
+        从旧到新删除目录下所有日志的历史日志，直到总大小不超过上限。正在写入的日志文件不会被删除，
+        上限应明显大于 `max_bytes` 与日志文件数量的乘积。
+    @param archive:
+        将轮转后的流水日志转换为列式存档（".npz"，见 `simple_channel_log.archive`）并删除原文件，
+        默认不转换。转换由低优先级的后台线程完成，需安装 NumPy，只适用于流水日志。
     """
 
 
@@ -43,6 +143,43 @@ def fatal    (msg, *args, **extra): pass
 def trace(**extra): pass  # 埋点日志
 
 
+def dropped_records():
+    """
+    返回异步模式下因队列已满而丢弃的日志条数，按日志类型统计，如：
+    `{"info_": 12, "trace": 3}`。未启用异步模式时返回空字典。
+    """
+
+
+def stats(reset=False):
+    """
+    返回本库自身的耗时统计（需在初始化时启用参数 `self_timing`，否则返回空字典）。统计结果
+    按集成（flask、fastapi、requests、unirest、ctec_consumer）、路由和阶段分组，如：
+
+        {"flask": {"/index": {"before": {...}, "after": {...}, ...}}}
+
+    阶段 "before"、"after" 为请求前后钩子的总耗时，"extract"（提取订单号、手机号等字段）、
+    "serialize"（序列化报文）、"write"（写日志）为 "after" 中流水日志各部分的耗时。每个阶段
+    包含调用次数 count、总耗时 total（秒）、最大耗时 max（秒）以及耗时直方图 histogram，
+    直方图为 `[(上限秒数, 次数), ...]`，最后一个上限为无穷大。
+
+    @param reset: 为 True 时返回统计结果后将其清零。
+    """
+
+
+def metrics():
+    """
+    返回 Prometheus 文本格式的调入请求指标（需在初始化时启用参数 `metrics`，否则返回空字符串），
+    包括 `simple_channel_log_requests_total`、`simple_channel_log_errors_total` 和
+    `simple_channel_log_request_duration_seconds`，标签为路由 route 和接口编码 method_code。
+    采样不影响指标统计。
+
+    使用示例：
+        >>> @app.get("/metrics")
+        >>> def metrics():
+        >>>     return log.metrics(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+    """
+
+
 def set_method_code(method_code):
     """
     `set_method_code` 是一个装饰器函数，用于给 API 处理函数设置接口编码（method_code）。
@@ -0,0 +1,36 @@
+# coding:utf-8
+import os
+import sys
+import json
+import importlib
+
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if root not in sys.path:
+    sys.path.insert(0, root)
+
+package = 'i simple_channel_log'
+
+
+def module(name=None):
+    return importlib.import_module(package if name is None else package + '.' + name)
+
+
+@pytest.fixture(scope='session')
+def log(tmp_path_factory):
+    # The logger is initialized once per process.
+    log = module()
+    logdir = str(tmp_path_factory.mktemp('logs'))
+    log.__init__('a123456789_test', logdir=logdir)
+    log.logdir = logdir
+    return log
+
+
+def journal(log):
+    # The records of the journal log so far.
+    path = os.path.join(log.logdir, 'a123456789_test_info-info.log')
+    if not os.path.exists(path):
+        return []
+    with open(path, 'rb') as f:
+        return [json.loads(line.decode('utf8')) for line in f if line.strip()]
@@ -0,0 +1,34 @@
+# coding:utf-8
+import io
+import json
+
+import pytest
+
+from conftest import module
+
+pytest.importorskip('numpy')
+
+archive = module('archive')
+
+
+@pytest.mark.parametrize('values', [
+    ['-0', '0', '12'],
+    ['0', '-12', '007'],
+    ['123456789012345678', '-123456789012345678', '1234567890123456789'],
+    ['12\n', '0\n', '7'],
+    ['12 ', ' 12', '\t0', '12\r\n'],
+    [u'\u0661\u0662', '12'],
+])
+def test_digit_strings_round_trip(tmp_path, values):
+    path = str(tmp_path / 'a_info-info.log.2024-01-01')
+    lines = [json.dumps({'transaction_id': 't%d' % i, 'response_code': v}, ensure_ascii=False) for i, v in enumerate(values)]
+    with io.open(path, 'w', encoding='utf8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    assert archive.convert(path) == (len(values), 0)
+    assert list(archive.Archive(archive.archive_path(path)).lines()) == lines
+
+
+def test_digits_kind():
+    assert archive.digits_pattern.match('0') and archive.digits_pattern.match('-12')
+    assert not any(archive.digits_pattern.match(x) for x in ('-0', '00', '012', '-', '', '12\n', '0\n', ' 1', u'\u0661'))
@@ -0,0 +1,92 @@
+# coding:utf-8
+import pytest
+
+from conftest import module, journal
+
+CONSUME_SUCCESS, CONSUME_REDELIVER, CONSUME_REJECT = 0, 1, 2
+
+
+class Message(object):
+
+    def __init__(self, body):
+        self.body = body
+
+
+@pytest.fixture
+def Config(log):
+    Config = module('transaction_log.base').TransactionLogBase
+    sample_rate, threshold = Config.sample_rate, Config.tail_capture_threshold
+    yield Config
+    Config.sample_rate, Config.tail_capture_threshold = sample_rate, threshold
+
+
+def consume(worker, transaction_id, topic='orders'):
+    CTECConsumerTransactionLog = module('transaction_log.x_ctec_consumer').CTECConsumerTransactionLog
+    body = '{"transaction_id": "%s", "fcode": "b987654321", "order_id": "O-2"}' % transaction_id
+    return CTECConsumerTransactionLog(worker, topic=topic)(Message(body))
+
+
+def records(log, transaction_id):
+    return [x for x in journal(log) if x['transaction_id'] == transaction_id]
+
+
+def test_consumed_message_is_recorded(log, Config):
+    def handle_order(message):
+        return CONSUME_SUCCESS
+
+    assert consume(handle_order, 'ctec-1') == CONSUME_SUCCESS
+
+    [record] = records(log, 'ctec-1')
+    assert record['dialog_type'] == 'in'
+    assert record['fcode'] == 'b987654321'
+    assert record['tcode'] == 'A123456789'
+    assert record['method_name'] == 'handle_order'
+    assert record['topic'] == 'orders'
+    assert record['response_code'] == '0'
+    assert record['order_id'] == 'O-2'
+
+
+def test_failed_messages_are_always_sampled(log, Config):
+    Config.sample_rate = 0
+
+    assert consume(lambda message: CONSUME_SUCCESS, 'ctec-sampled-out') == CONSUME_SUCCESS
+    assert consume(lambda message: CONSUME_REDELIVER, 'ctec-redeliver') == CONSUME_REDELIVER
+    assert consume(lambda message: (CONSUME_REJECT, 'bad order'), 'ctec-reject') == (CONSUME_REJECT, 'bad order')
+
+    assert records(log, 'ctec-sampled-out') == []
+    assert [x['response_code'] for x in records(log, 'ctec-redeliver')] == ['1']
+    assert [x['response_code'] for x in records(log, 'ctec-reject')] == ['2']
+
+
+def test_worker_raising_is_recorded(log, Config):
+    Config.sample_rate = 0
+
+    def handle_order(message):
+        raise ValueError('bad order')
+
+    with pytest.raises(ValueError):
+        consume(handle_order, 'ctec-raise')
+
+    [record] = records(log, 'ctec-raise')
+    assert record['method_name'] == 'handle_order'
+    assert record['response_code'] is None
+
+
+def test_failed_messages_are_logged_in_full(log, Config):
+    Config.sample_rate = 0
+    Config.tail_capture_threshold = 60000
+
+    def handle_order(message):
+        raise ValueError('bad order')
+
+    consume(lambda message: CONSUME_REDELIVER, 'ctec-full-redeliver')
+    with pytest.raises(ValueError):
+        consume(handle_order, 'ctec-full-raise')
+    Config.sample_rate = 1
+    consume(lambda message: CONSUME_SUCCESS, 'ctec-slim')
+
+    for tid in 'ctec-full-redeliver', 'ctec-full-raise':
+        [record] = records(log, tid)
+        assert '"order_id": "O-2"' in record['request_payload']
+    [record] = records(log, 'ctec-slim')
+    assert record['request_payload'] is None
@@ -0,0 +1,42 @@
+# coding:utf-8
+import pytest
+
+from conftest import journal
+
+fastapi = pytest.importorskip('fastapi')
+pytest.importorskip('httpx')
+
+from fastapi.testclient import TestClient
+
+
+def test_raising_endpoint_is_recorded_as_500(log):
+    app = fastapi.FastAPI()
+
+    @app.post('/boom')
+    def boom():
+        raise RuntimeError('boom')
+
+    client = TestClient(app, raise_server_exceptions=False)
+    response = client.post('/boom', json={'order_id': 'O-1'}, headers={'Transaction-ID': 'fastapi-boom'})
+    assert response.status_code == 500
+
+    records = [x for x in journal(log) if x['transaction_id'] == 'fastapi-boom']
+    assert len(records) == 1
+    assert records[0]['dialog_type'] == 'in'
+    assert records[0]['http_status_code'] == '500'
+    assert records[0]['method_name'] == 'boom'
+    assert records[0]['order_id'] == 'O-1'
+    assert '"order_id": "O-1"' in records[0]['request_payload']
+
+
+def test_endpoint_is_recorded(log):
+    app = fastapi.FastAPI()
+
+    @app.get('/ok')
+    def ok():
+        return {'code': '0'}
+
+    TestClient(app).get('/ok', headers={'Transaction-ID': 'fastapi-ok'})
+
+    records = [x for x in journal(log) if x['transaction_id'] == 'fastapi-ok']
+    assert [x['http_status_code'] for x in records] == ['200']
@@ -0,0 +1,272 @@
+# coding:utf-8
+import os
+import sys
+import glob
+import time
+import logging
+import subprocess
+import multiprocessing
+
+import pytest
+
+from conftest import module
+
+handlers = module('handlers')
+
+needs_fork  = pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+needs_flock = pytest.mark.skipif(handlers.fcntl is None, reason='needs fcntl.flock')
+
+
+def make_logger(name, filename, **options):
+    handler = handlers.LogFileHandler(filename, encoding='utf8', **options)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger = logging.Logger(name)
+    logger.addHandler(handler)
+    return logger, handler
+
+
+def lines_of(pattern):
+    # The lines of every file matching `pattern`, backups included.
+    result = []
+    for path in glob.glob(pattern):
+        with open(path) as f:
+            result.extend(f.read().splitlines())
+    return result
+
+
+def hold_slot(lockdir, slots, release):
+    slots.put(handlers.worker_slot(lockdir))
+    release.wait()
+
+
+def write_records(filename, lockdir, worker, count):
+    logger, handler = make_logger(
+        'worker%d' % worker, filename, lockdir=lockdir, max_bytes=2000, background_rollover=True,
+        flush_interval=0.05
+    )
+    for i in range(count):
+        logger.info('worker %d record %d %s', worker, i, 'x' * 40)
+        if i % 50 == 0:
+            time.sleep(0.05)
+    handler.close()
+
+
+@needs_fork
+@needs_flock
+def test_workers_get_distinct_slots(tmp_path):
+    lockdir = str(tmp_path / '.workers')
+    context = multiprocessing.get_context('fork')
+    slots, release = context.Queue(), context.Event()
+
+    workers = [context.Process(target=hold_slot, args=(lockdir, slots, release)) for _ in range(3)]
+    for x in workers:
+        x.start()
+    taken = sorted(slots.get(timeout=10) for _ in workers)
+    assert taken == [0, 1, 2]
+
+    release.set()
+    for x in workers:
+        x.join(10)
+
+    # The slots of the workers that exited are free again.
+    worker = context.Process(target=hold_slot, args=(lockdir, slots, release))
+    worker.start()
+    assert slots.get(timeout=10) == 0
+    worker.join(10)
+
+
+@needs_fork
+@needs_flock
+def test_background_rollover_of_workers_loses_no_lines(tmp_path):
+    filename = str(tmp_path / 'a_code-info.log')
+    lockdir = str(tmp_path / '.workers')
+    context = multiprocessing.get_context('fork')
+    count = 400
+
+    workers = [context.Process(target=write_records, args=(filename, lockdir, n, count)) for n in range(2)]
+    for x in workers:
+        x.start()
+    for x in workers:
+        x.join(60)
+        assert x.exitcode == 0
+
+    # One file per worker slot, each rolled over several times.
+    assert sorted(os.path.basename(x) for x in glob.glob(filename[:-4] + '.w*.log')) == [
+        'a_code-info.w0.log', 'a_code-info.w1.log'
+    ]
+    assert len(glob.glob(filename[:-4] + '.w*.log.*')) > 4
+
+    lines = lines_of(filename[:-4] + '.w*.log*')
+    expected = ['worker %d record %d %s' % (n, i, 'x' * 40) for n in range(2) for i in range(count)]
+    assert len(lines) == len(expected)
+    assert sorted(lines) == sorted(expected)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def test_buffer_is_flushed_on_close(tmp_path):
+    filename = str(tmp_path / 'a_code-info.log')
+    logger, handler = make_logger('buffered.close', filename, flush_interval=3600)
+    logger.info('buffered')
+    assert read(filename) == ''
+    handler.close()
+    assert read(filename) == 'buffered\n'
+
+
+@pytest.mark.parametrize('background', [False, True])
+def test_buffer_is_flushed_on_rollover(tmp_path, background):
+    filename = str(tmp_path / 'a_code-info.log')
+    logger, handler = make_logger(
+        'buffered.rollover', filename, flush_interval=3600, background_rollover=background
+    )
+    logger.info('before')
+    if background:
+        handler.rollover_in_background()
+    else:
+        handler.doRollover()
+    logger.info('after')
+    handler.close()
+
+    [backup] = glob.glob(filename + '.*')
+    assert read(backup) == 'before\n'
+    assert read(filename) == 'after\n'
+
+
+def test_buffer_is_flushed_at_exit(tmp_path):
+    filename = str(tmp_path / 'a_code-info.log')
+    code = '\n'.join([
+        'import sys, logging, importlib',
+        'sys.path.insert(0, %r)' % os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'handlers = importlib.import_module("i simple_channel_log.handlers")',
+        'handler = handlers.LogFileHandler(%r, flush_interval=3600)' % filename,
+        'logger = logging.getLogger("buffered.exit")',
+        'logger.addHandler(handler)',
+        'logger.warning("buffered")',
+        'assert open(%r).read() == ""' % filename,
+    ])
+    assert subprocess.call([sys.executable, '-c', code]) == 0
+    assert read(filename) == 'buffered\n'
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError('timed out')
+        time.sleep(0.01)
+
+
+def rotate_and_compress(tmp_path, compress, ext):
+    filename = str(tmp_path / 'a_code-info.log')
+    logger, handler = make_logger('compress.' + compress, filename, compress=compress)
+    lines = ['record %d %s' % (i, u'记录' * 20) for i in range(1000)]
+    for x in lines:
+        logger.info(x)
+    handler.doRollover()
+    logger.info('after')
+    handler.close()
+
+    wait_for(lambda: glob.glob(filename + '.*' + ext) and len(glob.glob(filename + '.*')) == 1)
+    [backup] = glob.glob(filename + '.*')
+    with module('index').open_log(backup) as f:
+        assert f.read().decode('utf8').splitlines() == lines
+    assert read(filename) == 'after\n'
+    assert not [x for x in os.listdir(str(tmp_path)) if x.endswith('.tmp')]
+    return backup
+
+
+def test_gzip_compression(tmp_path):
+    rotate_and_compress(tmp_path, 'gzip', '.gz')
+
+
+def test_zstd_compression(tmp_path):
+    pytest.importorskip('zstandard')
+    rotate_and_compress(tmp_path, 'zstd', '.zst')
+
+
+def test_auto_compression_prefers_zstd(tmp_path):
+    pytest.importorskip('zstandard')
+    assert handlers.compression_method('auto') == 'zstd'
+    rotate_and_compress(tmp_path, 'auto', '.zst')
+
+
+def test_auto_compression_falls_back_to_gzip(tmp_path, monkeypatch):
+    # An entry of None in sys.modules makes the import fail.
+    monkeypatch.setitem(sys.modules, 'zstandard', None)
+    assert handlers.compression_method('auto') == 'gzip'
+    with pytest.raises(ImportError):
+        handlers.compression_method('zstd')
+    rotate_and_compress(tmp_path, 'auto', '.gz')
+
+
+def make_file(path, size, mtime=None):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_disk_budget_removes_the_oldest_backups_first(tmp_path):
+    root = str(tmp_path)
+    day = 86400
+    now = time.time()
+    active   = make_file(os.path.join(root, 'a_code-info.log'), 1000, now - 10 * day)
+    oldest   = make_file(os.path.join(root, 'a_code-info.log.2024-01-01.gz'), 1000, now - 3 * day)
+    older    = make_file(os.path.join(root, 'debug', 'a_code-debug.log.2024-01-02.zst'), 1000, now - 2 * day)
+    old      = make_file(os.path.join(root, 'a_info-info.log.2024-01-03'), 1000, now - day)
+    newest   = make_file(os.path.join(root, 'a_code-info.log.2024-01-04.gz'), 1000, now)
+    index    = make_file(os.path.join(root, '.index', 'a_code-info.log.2024-01-01.gz.idx'), 1000, now - 9 * day)
+    worker   = make_file(os.path.join(root, '.workers', '0.lock'), 0, now - 9 * day)
+
+    # The index counts towards the budget, but only backups are removed.
+    handlers.enforce_disk_budget(root, 4000)
+    assert not os.path.exists(oldest) and not os.path.exists(older)
+    assert all(os.path.exists(x) for x in (active, old, newest, index, worker))
+
+    # The log file being written alone may exceed the budget.
+    handlers.enforce_disk_budget(root, 500)
+    assert not os.path.exists(old) and not os.path.exists(newest)
+    assert all(os.path.exists(x) for x in (active, index, worker))
+
+
+def test_size_cap_numbers_the_backups_of_an_interval(tmp_path):
+    filename = str(tmp_path / 'a_code-info.log')
+    logger, handler = make_logger('size_cap', filename, max_bytes=500, backupCount=1)
+    stale = make_file(filename + '.2000-01-01_00', 10)
+    stale_numbered = make_file(filename + '.2000-01-01_00.1.gz', 10)
+
+    lines = ['record %03d %s' % (i, 'x' * 40) for i in range(100)]
+    for x in lines:
+        logger.info(x)
+    handler.close()
+
+    backups = sorted(glob.glob(filename + '.*'), key=lambda x: handlers.split_index(x))
+    assert len(backups) >= 9
+    first = backups[0]
+    assert [handlers.split_index(x) for x in backups] == [(first, i) for i in range(len(backups))]
+    assert all(os.path.getsize(x) <= 500 + 60 for x in backups)
+
+    # The older interval is pruned by backupCount=1 as a whole, the backups
+    # of the current interval are kept whatever their number.
+    assert not os.path.exists(stale) and not os.path.exists(stale_numbered)
+    assert sorted(lines_of(filename + '*')) == lines
+
+
+def test_disk_budget_after_rollover_keeps_the_active_file(tmp_path):
+    filename = str(tmp_path / 'a_code-info.log')
+    logger, handler = make_logger('budget', filename, max_bytes=1000, disk_budget=3000, compress='gzip')
+    for i in range(500):
+        logger.info('record %03d %s', i, os.urandom(30).hex())
+    handler.close()
+    handler.clean_up()
+
+    total = sum(os.path.getsize(os.path.join(str(tmp_path), x)) for x in os.listdir(str(tmp_path)))
+    assert total <= 3000
+    assert read(filename).splitlines()[-1].startswith('record 499 ')
+    assert all(x.endswith('.gz') for x in glob.glob(filename + '.*'))
@@ -0,0 +1,65 @@
+# coding:utf-8
+import os
+import gzip
+import json
+
+from conftest import module
+
+index = module('index')
+
+
+def write(path, *tids):
+    with open(path, 'ab') as f:
+        for tid in tids:
+            f.write(json.dumps({'transaction_id': tid, 'dialog_type': 'in'}).encode('utf8') + b'\n')
+
+
+def found(logdir, tid, **kw):
+    return [json.loads(line)['transaction_id'] for _, line in index.lookup(logdir, tid, **kw)]
+
+
+def test_builds_append_segments_and_compact(tmp_path):
+    logdir = str(tmp_path)
+    path = os.path.join(logdir, 'a_info-info.log')
+    idx = index.index_path(logdir, path)
+
+    write(path, 't0', 'tx')
+    assert index.build(logdir) == (1, 2)
+    assert index.read_header(idx)[5] == 1
+
+    for i in range(1, index.max_segments):
+        write(path, 't%d' % i, 'tx')
+        assert index.build(logdir) == (1, 2)
+    assert index.read_header(idx)[5] == index.max_segments
+    assert index.build(logdir) == (0, 0)
+
+    assert found(logdir, 't7') == ['t7']
+    assert found(logdir, 'tx') == ['tx'] * index.max_segments
+
+    # Merged into one segment by the next build.
+    write(path, 'tx')
+    index.build(logdir)
+    head = index.read_header(idx)
+    assert head[5] == 1 and head[4] == os.path.getsize(idx)
+    assert sorted(found(logdir, 'tx')) == ['tx'] * (index.max_segments + 1)
+    assert all(found(logdir, 't%d' % i) == ['t%d' % i] for i in range(index.max_segments))
+
+
+def test_lookup_searches_the_indexes_as_they_are(tmp_path):
+    logdir = str(tmp_path)
+    path = os.path.join(logdir, 'a_info-info.log')
+    write(path, 'a')
+    index.build(logdir)
+    write(path, 'b')
+
+    assert found(logdir, 'b') == []
+    assert found(logdir, 'b', update_first=True) == ['b']
+    assert found(logdir, 'a') == ['a']
+
+
+def test_compressed_log_files(tmp_path):
+    logdir = str(tmp_path)
+    with gzip.open(os.path.join(logdir, 'a_info-info.log.1.gz'), 'wb') as f:
+        f.write(b'{"transaction_id": "z"}\n{"transaction_id": "y"}\n')
+    assert index.build(logdir) == (1, 2)
+    assert found(logdir, 'y') == ['y']
@@ -0,0 +1,82 @@
+# coding:utf-8
+import io
+import json
+
+import pytest
+
+from conftest import module
+
+pytest.importorskip('numpy')
+
+latency = module('latency')
+archive = module('archive')
+
+
+def record(dialog_type, code, address, status, total_time, minute='00'):
+    # The fields in the order of the journal log.
+    fields = [
+        ('app_name', 'a123456789_test_info'), ('log_time', '2024-01-01 10:%s:00.000' % minute),
+        ('transaction_id', 't'), ('dialog_type', dialog_type), ('address', address), ('fcode', None),
+        ('tcode', code if dialog_type == 'out' else 'A123456789'),
+        ('method_code', code if dialog_type == 'in' else None),
+        ('request_payload', '{"http_status_code": 200, "total_time": 1}'),
+        ('http_status_code', None if status is None else str(status)), ('total_time', total_time)
+    ]
+    return '{' + ', '.join('%s: %s' % (json.dumps(k), json.dumps(v)) for k, v in fields) + '}'
+
+
+records = [
+    record('in', 'I001', '/order', 200, 10),
+    record('in', 'I001', '/order', 500, 30),
+    record('in', 'I001', '/order', 200, 20, minute='01'),
+    record('in', None, None, None, 5),
+    record('in', None, None, None, 7),
+    record('out', 'B987654321', 'http://b/pay', 502, 100),
+    record('out', 'B987654321', 'http://b/pay', 404, 40),
+]
+
+
+def summarize(path):
+    latencies = latency.Latencies()
+    latency.scan([path], latencies)
+    return dict(((x['dialog_type'], x['code'], x['address']), x) for x in latencies.summary())
+
+
+@pytest.fixture
+def log_file(tmp_path):
+    path = str(tmp_path / 'a123456789_test_info-info.log.2024-01-01')
+    with io.open(path, 'w', encoding='utf8') as f:
+        f.write(u'\n'.join(records) + u'\n')
+    return path
+
+
+def test_summary(log_file):
+    summary = summarize(log_file)
+    x = summary[('in', 'I001', '/order')]
+    assert (x['count'], x['p50'], x['max'], x['per_minute_peak']) == (3, 20, 30, 2)
+    assert x['error_rate'] == pytest.approx(1 / 3.0)
+
+    # Records without an HTTP status, as of message consumers, are no errors.
+    x = summary[('in', '', '')]
+    assert (x['count'], x['error_rate']) == (2, 0)
+
+    x = summary[('out', 'B987654321', 'http://b/pay')]
+    assert (x['count'], x['error_rate']) == (2, 0.5)
+
+
+def test_fields_in_another_order(tmp_path):
+    path = str(tmp_path / 'a_info-info.log')
+    with open(path, 'w') as f:
+        for dialog_type, status in ('in', None), ('in', 503), ('in', 200):
+            f.write(json.dumps({
+                'total_time': 3, 'http_status_code': status, 'method_code': 'I002', 'dialog_type': dialog_type,
+                'log_time': '2024-01-01 10:00:00.000', 'address': '/x'
+            }, sort_keys=True) + '\n')
+    x = summarize(path)[('in', 'I002', '/x')]
+    assert (x['count'], x['error_rate']) == (3, pytest.approx(1 / 3.0))
+
+
+def test_archives_agree_with_log_files(log_file):
+    expected = summarize(log_file)
+    archive.convert(log_file)
+    assert summarize(archive.archive_path(log_file)) == expected
@@ -0,0 +1,45 @@
+# coding:utf-8
+import pytest
+
+from conftest import journal
+
+requests = pytest.importorskip('requests')
+
+
+class Adapter(requests.adapters.BaseAdapter):
+    # Answers every request without a network, keeping the requests sent.
+
+    def __init__(self):
+        super(Adapter, self).__init__()
+        self.sent = []
+
+    def send(self, request, **kw):
+        self.sent.append(request)
+        response = requests.Response()
+        response.status_code = 200
+        response.headers['Content-Type'] = 'application/json'
+        response._content = b'{"code": "0"}'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def test_shared_headers_are_not_modified(log):
+    adapter = Adapter()
+    session = requests.Session()
+    session.mount('http://', adapter)
+    headers = {'Accept': 'application/json'}
+
+    session.get('http://upstream.test/a', headers=headers)
+    session.get('http://upstream.test/b', headers=headers)
+
+    assert headers == {'Accept': 'application/json'}
+    first, second = [x.headers['Transaction-ID'] for x in adapter.sent]
+    assert first != second
+    assert all(x.headers['Accept'] == 'application/json' for x in adapter.sent)
+
+    recorded = [x['transaction_id'] for x in journal(log) if x['dialog_type'] == 'out']
+    assert first in recorded and second in recorded
@@ -0,0 +1,55 @@
+# coding:utf-8
+import pytest
+
+from conftest import module
+
+
+@pytest.fixture
+def Config(log):
+    Config = module('transaction_log.base').TransactionLogBase
+    sample_rate = Config.sample_rate
+    Config.sample_rate = 0
+    yield Config
+    Config.sample_rate = sample_rate
+
+
+def test_failures_are_always_sampled(Config):
+    assert not Config.sampled('t1', http_status_code=200)
+    assert not Config.sampled('t1', http_status_code=200, response_payload={'code': '0'})
+    assert not Config.sampled('t1', http_status_code=200, response_payload={'data': {}})
+    assert Config.sampled('t1', http_status_code=502)
+    assert Config.sampled('t1', http_status_code=200, response_payload={'code': 'E1001'})
+    assert Config.sampled('t1', http_status_code=200, response_payload={'data': {'code': 500}})
+    assert Config.sampled('t1', http_status_code=500, exception=True)
+    assert Config.sampled('t1', exception=True)
+
+
+def test_success_codes_are_shared_with_tail_capture(Config):
+    threshold = Config.tail_capture_threshold
+    Config.tail_capture_threshold = 1000
+    try:
+        for code in '0', '200', 'E1001', None:
+            assert Config.slim(10, 200, code) == (not Config.sampled('t1', None, None, 200, {'code': code}))
+    finally:
+        Config.tail_capture_threshold = threshold
+
+
+def test_business_errors_of_an_endpoint_are_recorded(log, Config):
+    fastapi = pytest.importorskip('fastapi')
+    pytest.importorskip('httpx')
+    from fastapi.testclient import TestClient
+    from conftest import journal
+
+    app = fastapi.FastAPI()
+
+    @app.get('/order')
+    def order(code: str):
+        return {'code': code}
+
+    client = TestClient(app)
+    client.get('/order?code=0', headers={'Transaction-ID': 'sampling-ok'})
+    client.get('/order?code=E1001', headers={'Transaction-ID': 'sampling-error'})
+
+    recorded = set(x['transaction_id'] for x in journal(log))
+    assert 'sampling-error' in recorded
+    assert 'sampling-ok' not in recorded
@@ -0,0 +1,32 @@
+# coding:utf-8
+from conftest import module
+
+
+def test_import_loads_no_module_meant_for_first_use():
+    result = module('bench_startup').measure('simple_channel_log', 1)
+    assert result['import']['heavy'] == []
+
+
+def test_parse_importtime():
+    profile = module('bench_startup').parse_importtime(
+        'import time: self [us] | cumulative | imported package\n'
+        '-- import\n'
+        'import time:       120 |        300 |   json.decoder\n'
+        'import time:       180 |        480 | json\n'
+        '-- init\n'
+        'import time:        50 |         50 | socket\n'
+        '-- end\n'
+    )
+    assert profile == {
+        'import': [(120, 300, 1, 'json.decoder'), (180, 480, 0, 'json')],
+        'init': [(50, 50, 0, 'socket')]
+    }
+
+
+def test_stub_exports_the_functions_of_the_package_only():
+    import simple_channel_log
+    package = module()
+    public = [x for x in vars(simple_channel_log) if x[0] != '_']
+    assert 'TYPE_CHECKING' not in public
+    for name in public:
+        assert getattr(simple_channel_log, name) is getattr(package, name)
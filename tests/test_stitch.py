@@ -0,0 +1,134 @@
+# coding:utf-8
+import io
+import os
+import json
+
+from datetime import datetime, timedelta
+
+from conftest import module
+
+stitch = module('stitch')
+
+A, B, C, D = 'A000000001', 'B000000002', 'C000000003', 'D000000004'
+t0 = datetime(2024, 1, 1, 10, 0, 0)
+
+
+def span(dialog_type, fcode, tcode, start, total, tid='t1', address=None):
+    return {
+        'app_name': (tcode if dialog_type == 'in' else fcode).lower() + '_app_info',
+        'log_time': time(start + total), 'transaction_id': tid, 'dialog_type': dialog_type,
+        'address': address or '/%s' % tcode.lower(), 'fcode': fcode, 'tcode': tcode,
+        'request_time': time(start), 'http_status_code': '200', 'total_time': total
+    }
+
+
+def event(service, at, message, tid='t1'):
+    return {
+        'app_name': service.lower() + '_app_code', 'level': 'INFO', 'log_time': time(at),
+        'code_message': message, 'transaction_id': tid
+    }
+
+
+def time(ms):
+    return (t0 + timedelta(milliseconds=ms)).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+
+def describe(x):
+    if isinstance(x, stitch.Event):
+        return 'event %s' % x.record['code_message']
+    return '%s in' % x.tcode if x.kind == 'in' else '%s -> %s' % (x.fcode, x.tcode)
+
+
+def tree(nodes, depth=0):
+    return [(depth, describe(x)) for depth, x in stitch.walk(nodes, depth)]
+
+
+# A is called, calls B, which calls C, then calls D, which has no logs.
+records = [
+    span('in', 'X000000000', A, 0, 100),
+    span('out', A, B, 10, 50),
+    span('in', A, B, 12, 45),
+    event(B, 15, 'checking'),
+    span('out', B, C, 20, 30),
+    span('in', B, C, 21, 28),
+    span('out', A, D, 70, 20),
+]
+
+
+def test_nested_spans():
+    roots = stitch.stitch(records)
+    assert tree(roots) == [
+        (0, '%s in' % A),
+        (1, '%s -> %s' % (A, B)),
+        (2, '%s in' % B),
+        (3, 'event checking'),
+        (3, '%s -> %s' % (B, C)),
+        (4, '%s in' % C),
+        (1, '%s -> %s' % (A, D)),
+    ]
+
+    a = roots[0]
+    assert stitch.self_time(a) == 100 - 50 - 20
+    b_in = a.children[0].children[0]
+    assert stitch.self_time(b_in) == 45 - 30
+
+
+def test_missing_parents():
+    # The logs of B are missing: the call of C by B, the inbound call of C
+    # and the event of B have nothing to be nested under.
+    roots = stitch.stitch([x for x in records if x['app_name'][:10].upper() != B])
+    assert tree(roots) == [
+        (0, '%s in' % A),
+        (1, '%s -> %s' % (A, B)),
+        (1, '%s -> %s' % (A, D)),
+        (0, '%s in' % C),
+    ]
+
+    # Without the inbound call of A, its outbound calls are roots.
+    roots = stitch.stitch([x for x in records if not (x.get('tcode') == A)])
+    assert [describe(x) for x in roots] == ['%s -> %s' % (A, B), '%s -> %s' % (A, D)]
+    assert tree(roots[:1])[-1] == (3, '%s in' % C)
+
+
+def test_critical_path_in_call_order():
+    roots = stitch.stitch(records)
+    assert [describe(x) for x in stitch.critical_path(roots[0])] == [
+        '%s in' % A, '%s -> %s' % (A, B), '%s in' % B, '%s -> %s' % (B, C), '%s in' % C, '%s -> %s' % (A, D)
+    ]
+
+    # Overlapping calls: only the one ending last is waited for.
+    overlapping = [
+        span('in', 'X000000000', A, 0, 100),
+        span('out', A, B, 10, 60),
+        span('out', A, C, 20, 70),
+    ]
+    roots = stitch.stitch(overlapping)
+    assert [describe(x) for x in stitch.critical_path(roots[0])] == ['%s in' % A, '%s -> %s' % (A, C)]
+
+
+def write(logdir, name, lines):
+    with io.open(os.path.join(logdir, name), 'w', encoding='utf8') as f:
+        for x in lines:
+            f.write(json.dumps(x, ensure_ascii=False) + u'\n')
+
+
+def test_slowest_transactions_and_collect(tmp_path):
+    a, b = str(tmp_path / 'a'), str(tmp_path / 'b')
+    os.mkdir(a)
+    os.mkdir(b)
+    write(a, 'a_app_info-info.log', [
+        span('in', 'X000000000', A, 0, 100, tid='t1'),
+        span('in', 'X000000000', A, 0, 300, tid='t2'),
+        span('in', 'X000000000', A, 0, 200, tid='t3'),
+        span('out', A, B, 10, 250, tid='t2'),
+    ])
+    write(b, 'b_app_info-info.log', [span('in', A, B, 12, 240, tid='t2')])
+    write(b, 'b_app_code-info.log', [event(B, 20, 'working', tid='t2')])
+
+    assert stitch.slowest_transactions([a, b], 2, 0) == [b't2', b't3']
+    assert stitch.slowest_transactions([a, b], 5, 150) == [b't2', b't3']
+
+    records = stitch.collect([a, b], [b't2'])
+    assert tree(stitch.stitch(records[b't2'])) == [
+        (0, '%s in' % A), (1, '%s -> %s' % (A, B)), (2, '%s in' % B), (3, 'event working')
+    ]
@@ -0,0 +1,61 @@
+# coding:utf-8
+import json
+
+import pytest
+
+from conftest import module
+
+tools = module('tools')
+
+long_text = u'长文本' * 400
+long_key  = u'k' * 1001
+
+payloads = [
+    {'a': 1, 'b': [1.5, None, True], 'c': {'d': u'北京'}},
+    {'detail': long_text, 'items': [{'remark': long_text}, long_text, 'x' * 1000]},
+    {long_key: 'short'},
+    {long_key: long_text, long_key + 'x': long_text},
+    {'a': {long_key: [long_text]}, 'b': long_text},
+    {'<Ellipsis>': long_text, 'b': [long_text]},
+    {'text': u'{"<Ellipsis>": 1}, "<Ellipsis>": ' + long_text},
+    [long_text, {'x': long_text}],
+    long_text,
+    'short',
+]
+
+
+@pytest.mark.parametrize('payload', payloads)
+def test_same_as_dumping_an_omit_long_string_copy(payload):
+    expected = json.dumps(tools.OmitLongString(payload), ensure_ascii=False)
+    assert tools.try_json_dumps(payload, omit_long_string=True) == expected
+    assert tools.omit_long_string_encoder.encode(payload) == expected
+
+
+def test_long_keys_are_kept_whole():
+    data = json.loads(tools.try_json_dumps({long_key: long_text, long_key + 'x': 1}, omit_long_string=True))
+    assert data == {long_key: '<Ellipsis>', long_key + 'x': 1}
+
+
+@pytest.fixture(params=tools.JSONBackend.names)
+def backend(request):
+    name = tools.JSONBackend.name
+    try:
+        tools.JSONBackend.use(request.param)
+    except ImportError:
+        pytest.skip('%s is not installed' % request.param)
+    yield tools.JSONBackend
+    tools.JSONBackend.use(name)
+
+
+@pytest.mark.parametrize('payload', payloads + [
+    {'quotes': '"' * 1001}, {'escapes': '\\' * 600 + '\n' * 600}, {'json': '{"a": "b"}', 'b': long_text},
+    {'numbers': list(range(1000)), 'x': 'y'}
+])
+def test_json_backend_omits_long_strings(backend, payload):
+    expected = json.loads(json.dumps(tools.OmitLongString(payload), ensure_ascii=False))
+    assert json.loads(tools.try_json_dumps(payload, omit_long_string=True)) == expected
+
+
+def test_json_backend_encodes_payloads_without_long_strings(backend):
+    payload = {'a': 'x' * 1000, 'b': [{'c': u'北京'}] * 100}
+    assert tools.try_json_dumps(payload, omit_long_string=True) == backend.dumps(payload)